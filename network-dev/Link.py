@@ -0,0 +1,22 @@
+class Link:
+    __slots__ = ("src", "dst", "bandwidth", "latency", "capacity")
+
+    def __init__(self, src, dst, bandwidth=1e9, latency=1e-3, capacity=64):
+        """
+        2つのノードをつなぐ片方向のリンクを表すクラス
+
+        param src:送信側ノード
+        param dst:受信側ノード
+        param bandwidth:帯域（bit/s）
+        param latency:伝搬遅延（秒）
+        param capacity:送信待ちにできるパケット数（送信中を含む）。超えたら破棄
+        """
+        self.src = src
+        self.dst = dst
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.capacity = capacity
+
+    def __str__(self):
+        return (f"リンク({self.src.address} -> {self.dst.address}, "
+                f"{self.bandwidth / 1e6:g}Mbps, {self.latency * 1e3:g}ms, 容量 {self.capacity})")
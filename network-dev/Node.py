@@ -1,4 +1,6 @@
 class Node:
+    __slots__ = ("node_id", "address", "links", "index")
+
     def __init__(self, node_id, address=None):
         """
         ネットワーク内のノードを表すNodeクラス
@@ -11,14 +13,31 @@ class Node:
         self.node_id = node_id
         self.address = address
         self.links = []
-    # リンクを接続するメソッド追加予定
+        self.index = -1  # シミュレーター・Topology.from_nodes での通し番号
+
+    def connect(self, other, bandwidth=1e9, latency=1e-3, capacity=64, bidirectional=True):
+        """
+        他のノードとリンクで接続する（bidirectional なら逆向きのリンクも作る）
+
+        return:このノードから other へのリンク
+        """
+        from Link import Link
+        link = Link(self, other, bandwidth, latency, capacity)
+        self.links.append(link)
+        if bidirectional:
+            other.links.append(Link(other, self, bandwidth, latency, capacity))
+        return link
 
     def __str__(self):
         return f"ノード(ID: {self.node_id}, アドレス: {self.address})"
 
-# make 2 node
-node1 = Node(node_id=1, address="00:01")
-node2 = Node(node_id=2, address="00:02")
 
-print(node1)
-print(node2)
\ No newline at end of file
+if __name__ == "__main__":
+    # make 2 node
+    node1 = Node(node_id=1, address="00:01")
+    node2 = Node(node_id=2, address="00:02")
+    node1.connect(node2)
+
+    print(node1)
+    print(node2)
+    print(node1.links[0])
@@ -0,0 +1,32 @@
+def payload_size(payload):
+    """ペイロードのバイト数（bytes 系と str だけ測れる。それ以外は 0）"""
+    if isinstance(payload, str):
+        return len(payload.encode("utf-8"))
+    if isinstance(payload, memoryview):
+        return payload.nbytes
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    return 0
+
+
+class Packet:
+    __slots__ = ("source", "destination", "payload", "size", "packet_id")
+
+    def __init__(self, source, destination, payload, size=None, packet_id=-1):
+        """
+        ネットワーク内で送信されるパケットを表現するクラス
+
+        param source:パケットの送信元ノードのアドレス
+        param destination:パケットの宛先ノードのアドレス
+        param payload:パケットに含まれるデータ
+        param size:パケットのサイズ（バイト）。省略時は bytes 系・str（UTF-8）のペイロードの長さ、それ以外は 0
+        param packet_id:シミュレーター内での通し番号
+        """
+        self.source = source
+        self.destination = destination
+        self.payload = payload
+        self.size = size if size is not None else payload_size(payload)
+        self.packet_id = packet_id
+
+    def __str__(self):
+        return f"パケット(送信元: {self.source}, 宛先: {self.destination}, ペイロード: {self.payload})"
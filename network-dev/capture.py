@@ -0,0 +1,328 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+import wire
+
+# ファイル先頭のヘッダー
+#   magic(8s) version(H) reserved(H) index_every(I) data_end(Q) count(Q) first_time(d) last_time(d)
+# の後にレコード（time(d) length(I) + wire 形式のパケット length バイト）が時刻順に並ぶ。
+# 書き込み中のファイルは先に大きめに確保して mmap で書くので、有効なのは data_end まで。
+FILE_HEADER = struct.Struct("<8sHHIQQdd")
+RECORD = struct.Struct("<dI")
+MAGIC = b"NDCAP\x00\x00\x00"
+VERSION = 1
+INDEX_DTYPE = np.dtype([("time", "<f8"), ("offset", "<u8")])
+
+
+def index_path(path):
+    return path + ".idx"
+
+
+class CaptureWriter:
+    """パケットを追記専用のキャプチャファイルに書く
+
+    ファイルは initial_size で確保して mmap し、足りなくなったら倍に広げて張り直す。
+    パケットは wire.encode_into で mmap に直接書く（中間のバッファを作らない）。
+    index_every 件ごとに (時刻, オフセット) を疎なインデックスに控え、flush / close で
+    サイドカー（.idx）に書き出す。時刻は単調増加でなければならない。
+    """
+
+    def __init__(self, path, initial_size=1 << 24, index_every=256):
+        self.path = path
+        self.index_every = index_every
+        self.count = 0
+        self.first_time = 0.0
+        self.last_time = -float("inf")
+        self._index = []
+        self._file = open(path, "w+b")
+        self._size = max(initial_size, FILE_HEADER.size)
+        self._file.truncate(self._size)
+        self._mm = mmap.mmap(self._file.fileno(), self._size)
+        self._pos = FILE_HEADER.size
+        self._write_header()
+
+    def _grow(self, need):
+        size = self._size
+        while size < need:
+            size *= 2
+        self._mm.close()
+        self._file.truncate(size)
+        self._size = size
+        self._mm = mmap.mmap(self._file.fileno(), size)
+
+    def _reserve(self, t, length):
+        if t < self.last_time:
+            raise ValueError(f"時刻が戻っています: {t} < {self.last_time}")
+        pos = self._pos
+        end = pos + RECORD.size + length
+        if end > self._size:
+            self._grow(end)
+        if self.count % self.index_every == 0:
+            self._index.append((t, pos))
+        if self.count == 0:
+            self.first_time = t
+        self.last_time = t
+        self.count += 1
+        RECORD.pack_into(self._mm, pos, t, length)
+        self._pos = end
+        return pos + RECORD.size
+
+    def write(self, t, packet, seq=None):
+        """時刻 t（秒）のパケットを1件書く"""
+        start = self._reserve(t, wire.encoded_size(packet))
+        wire.encode_into(self._mm, start, packet, seq)
+
+    def write_bytes(self, t, data):
+        """wire 形式にエンコード済みのパケット1件をそのまま書く"""
+        n = len(data)
+        start = self._reserve(t, n)
+        self._mm[start:start + n] = data
+
+    def _write_header(self):
+        FILE_HEADER.pack_into(self._mm, 0, MAGIC, VERSION, 0, self.index_every, self._pos, self.count,
+                              self.first_time, max(self.last_time, self.first_time))
+
+    def flush(self):
+        self._write_header()
+        self._mm.flush()
+        index = np.array(self._index, dtype=INDEX_DTYPE)
+        tmp = index_path(self.path) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(index.tobytes())
+        os.replace(tmp, index_path(self.path))
+
+    def close(self):
+        if self._mm is None:
+            return
+        self.flush()
+        self._mm.close()
+        self._mm = None
+        self._file.truncate(self._pos)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureReader:
+    """キャプチャファイルを mmap で読む
+
+    records / packets が返すのは mmap の memoryview スライスで、コピーしない。
+    close の前にそれらへの参照を手放すこと（残っていると BufferError）。
+    seek(t) は疎なインデックスの二分探索と、最大 index_every 件の前進で位置を決める。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mm)
+        magic, version, _, self.index_every, self.data_end, self.count, self.first_time, self.last_time = \
+            FILE_HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC:
+            raise ValueError(f"キャプチャファイルではありません: {path}")
+        if version != VERSION:
+            raise ValueError(f"未対応のバージョン {version}")
+        self.data_end = min(self.data_end, len(self._mm))
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(index_path(self.path), "rb") as f:
+                index = np.frombuffer(f.read(), dtype=INDEX_DTYPE)
+            if len(index) == -(-self.count // self.index_every):
+                return index
+        except (OSError, ValueError):
+            pass
+        # サイドカーが無い・古いときは全件をたどって作り直す
+        entries = [(t, offset) for k, (offset, t, _) in enumerate(self._scan(FILE_HEADER.size))
+                   if k % self.index_every == 0]
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def _scan(self, offset):
+        """offset 以降の (レコードの位置, 時刻, wire バイトの memoryview)"""
+        view, end, unpack_from, size = self._view, self.data_end, RECORD.unpack_from, RECORD.size
+        while offset + size <= end:
+            t, n = unpack_from(view, offset)
+            start = offset + size
+            if start + n > end:
+                break
+            yield offset, t, view[start:start + n]
+            offset = start + n
+
+    def __len__(self):
+        return self.count
+
+    def seek(self, t):
+        """時刻 t 以降の最初のレコードの位置（無ければ data_end）"""
+        k = int(np.searchsorted(self.index["time"], t, side="left")) - 1
+        offset = int(self.index["offset"][k]) if k >= 0 else FILE_HEADER.size
+        for pos, rt, _ in self._scan(offset):
+            if rt >= t:
+                return pos
+        return self.data_end
+
+    def records(self, start=None, end=None):
+        """(時刻, wire バイトの memoryview) を時刻順に返す（start <= 時刻 < end）"""
+        offset = self.seek(start) if start is not None else FILE_HEADER.size
+        for _, t, data in self._scan(offset):
+            if end is not None and t >= end:
+                return
+            yield t, data
+
+    def packets(self, start=None, end=None, verify=False):
+        """(時刻, Packet) を返す。ペイロードは mmap の memoryview"""
+        decode = wire.decode
+        for t, data in self.records(start, end):
+            yield t, decode(data, 0, verify)[0]
+
+    def close(self):
+        if self._mm is None:
+            return
+        self._view.release()
+        self._mm.close()
+        self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- 記録 ---
+def record_simulator(sim, writer):
+    """Simulator で届いたパケットを到着時刻で記録する（on_deliver を置き換える）"""
+    previous = sim.on_deliver
+
+    def on_deliver(packet, t):
+        writer.write(t, packet)
+        if previous is not None:
+            previous(packet, t)
+
+    sim.on_deliver = on_deliver
+
+
+def record_endpoint(endpoint, writer, clock=time.monotonic):
+    """Endpoint が受け取った自分宛てのパケットを clock() の時刻で記録する"""
+    previous = endpoint.on_packet
+
+    def on_packet(packet):
+        writer.write(clock(), packet)
+        if previous is not None:
+            previous(packet)
+        else:
+            try:
+                endpoint.inbox.put_nowait(packet)
+            except asyncio.QueueFull:
+                endpoint.dropped_inbox += 1
+
+    endpoint.on_packet = on_packet
+
+
+# --- 再生 ---
+def replay_into_simulator(reader, sim, start=None, end=None, speed=1.0, at=0.0):
+    """キャプチャを Simulator の send に流し込む
+
+    最初のレコードが時刻 at、以降は記録時刻の差を speed で割った間隔で送る。
+    キャプチャのアドレス（整数）は Simulator のノードのアドレスに対応付ける。
+    Simulator はパケットを持ち続けるので、memoryview のペイロードはここで bytes にコピーする。
+    返り値は送ったパケット数。
+    """
+    addresses = sim.topology.addresses or ()
+    index = {wire.address_to_int(a): i for i, a in enumerate(addresses) if a is not None}
+    send = sim.send
+    t0 = None
+    count = 0
+    for t, packet in reader.packets(start, end):
+        if t0 is None:
+            t0 = t
+        src, dst = index.get(packet.source), index.get(packet.destination)
+        if src is None or dst is None:
+            continue
+        payload = packet.payload
+        send(at + (t - t0) / speed, src, dst, bytes(payload) if isinstance(payload, memoryview) else payload)
+        count += 1
+    return count
+
+
+async def replay_live(reader, endpoints, start=None, end=None, speed=1.0):
+    """キャプチャを実エンドポイントから送り直す（送信元アドレスの Endpoint から）
+
+    記録時刻の間隔を speed で割って再現する。speed=inf なら待たずに送り、
+    送信キューが満杯なら空くまで待つ。返り値は送ったパケット数。
+    """
+    by_address = {e.address: e for e in endpoints}
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    t0 = None
+    count = 0
+    for t, packet in reader.packets(start, end):
+        if t0 is None:
+            t0 = t
+        endpoint = by_address.get(packet.source)
+        if endpoint is None:
+            continue
+        delay = started + (t - t0) / speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if isinstance(packet.payload, memoryview):
+            packet.payload = bytes(packet.payload)  # キュー待ちの間に reader を閉じても壊れないように
+        await endpoint.send(packet)
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from Packet import Packet
+    from simulator import ring_topology
+
+    n = 1_000_000
+    payload = os.urandom(64)
+    addresses = [f"00:{i:04x}" for i in range(64)]
+    packets = [Packet(addresses[i % 64], addresses[(i * 7 + 1) % 64], payload, packet_id=i) for i in range(4096)]
+    path = os.path.join(tempfile.mkdtemp(), "bench.ndcap")
+
+    started = time.perf_counter()
+    with CaptureWriter(path, initial_size=1 << 20) as writer:
+        for i in range(n):
+            writer.write(i * 1e-6, packets[i & 4095])
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path)
+    print(f"書き込み {n:,} 件 / {size / 2 ** 20:.0f}MB: {elapsed:.2f}s = {n / elapsed / 1e6:.2f}M 件/s, "
+          f"{size / elapsed / 2 ** 20:.0f}MB/s")
+
+    with CaptureReader(path) as reader:
+        started = time.perf_counter()
+        total = sum(len(data) for _, data in reader.records())
+        elapsed = time.perf_counter() - started
+        print(f"読み出し（ビュー）{n / elapsed / 1e6:.2f}M 件/s, {total / elapsed / 2 ** 20:.0f}MB/s")
+
+        started = time.perf_counter()
+        count = sum(1 for _ in reader.packets(verify=True))
+        print(f"デコード（CRC 検査あり）{count / (time.perf_counter() - started) / 1e6:.2f}M 件/s")
+
+        times = np.random.default_rng(0).uniform(0, n * 1e-6, 1000)
+        started = time.perf_counter()
+        for t in times:
+            reader.seek(t)
+        print(f"時刻でシーク {(time.perf_counter() - started) / len(times) * 1e6:.1f}us/回 "
+              f"（インデックス {len(reader.index):,} 件）")
+
+        sim, _ = ring_topology(64)
+        count = replay_into_simulator(reader, sim, start=0.1, end=0.2, speed=0.5)
+        sim.run()
+        s = sim.stats()
+        print(f"シミュレーターへ再生 {count:,} 件（0.5 倍速）: 到着 {s['delivered']:,} / "
+              f"破棄 {s['dropped_queue']:,}")
@@ -0,0 +1,456 @@
+import gc
+import heapq
+import math
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import deque
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from simulator import Simulator, DELIVERED, DROPPED_QUEUE, DROPPED_ROUTE
+from topology import Topology, _gather
+
+
+# --- 分割 ---
+def _undirected_neighbors(topology, nodes):
+    """nodes に出入りするリンクの相手側ノード（重複あり）"""
+    rev_offsets, rev_links = topology.reverse()
+    out = topology.targets[_gather(topology.offsets, nodes)]
+    inn = topology.sources[rev_links[_gather(rev_offsets, nodes)]]
+    return np.concatenate([out, inn]).astype(np.int64)
+
+
+def partition(topology, k, imbalance=0.05, refine=True):
+    """ノードを k 個にほぼ均等に分け、切れるリンクが少なくなるようにする（ノード番号ごとの分割番号）
+
+    未割り当てのノードから BFS で領域を広げて n/k 個ずつ取り、最後に境界のノードを
+    隣接ノードが一番多い分割へ移す（各分割の大きさは ±imbalance まで）貪欲な改善を1回かける。
+    """
+    n = topology.n_nodes
+    target = -(-n // k)
+    owner = np.full(n, -1, dtype=np.int32)
+    for part in range(k - 1):
+        size = 0
+        frontier = np.empty(0, dtype=np.int64)
+        while size < target:
+            frontier = np.unique(frontier[owner[frontier] < 0])
+            if not len(frontier):
+                free = np.flatnonzero(owner < 0)
+                if not len(free):
+                    break
+                frontier = free[:1]  # つながっていない部分は次の未割り当てノードから
+            take = frontier[:target - size]
+            owner[take] = part
+            size += len(take)
+            frontier = np.concatenate([frontier[len(take):], _undirected_neighbors(topology, take)])
+    owner[owner < 0] = k - 1
+    if refine and k > 1:
+        _refine(topology, owner, k, imbalance)
+    return owner
+
+
+def _refine(topology, owner, k, imbalance):
+    sizes = np.bincount(owner, minlength=k)
+    upper = math.ceil(len(owner) / k * (1 + imbalance))
+    lower = math.floor(len(owner) / k * (1 - imbalance))
+    cut = owner[topology.sources] != owner[topology.targets]
+    candidates = np.unique(np.concatenate([topology.sources[cut], topology.targets[cut]]))
+    offsets, targets, sources = topology.offsets, topology.targets, topology.sources
+    rev_offsets, rev_links = topology.reverse()
+    moved = 0
+    for v in candidates.tolist():
+        neighbors = np.concatenate([targets[offsets[v]:offsets[v + 1]],
+                                    sources[rev_links[rev_offsets[v]:rev_offsets[v + 1]]]])
+        counts = np.bincount(owner[neighbors], minlength=k)
+        own = owner[v]
+        counts_other = counts.copy()
+        counts_other[own] = -1
+        best = int(counts_other.argmax())
+        if counts[best] > counts[own] and sizes[best] < upper and sizes[own] > lower:
+            owner[v] = best
+            sizes[own] -= 1
+            sizes[best] += 1
+            moved += 1
+    return moved
+
+
+def cut_links(topology, owner):
+    """分割をまたぐリンク番号"""
+    return np.flatnonzero(owner[topology.sources] != owner[topology.targets])
+
+
+# --- 分割間のリング ---
+class _Ring:
+    """2プロセス間の単一生産者・単一消費者リング（共有メモリ上、レコードは float64 × 4）
+
+    push は交換の周回 r の barrier.wait の前、pop_all はその後に呼ぶ。
+    ただし周回 r の pop_all と周回 r + 1 の push は同時に走り得るので、head / tail は
+    周回の偶奇ごとに別の欄へ公開し、相手が書き換え中でない方（barrier より前に書かれた方）だけを読む。
+    barrier（セマフォ）を挟むことで書き込みが相手から見えることを保証しているので、
+    CPU のメモリ順序には頼らない。barrier を外したり、push / pop_all の呼び順を変えたりしないこと。
+    """
+
+    def __init__(self, data, ctl, slot):
+        self.buf = np.frombuffer(data, dtype=np.float64).reshape(-1, 4)
+        self.mask = len(self.buf) - 1
+        self.ctl = np.frombuffer(ctl, dtype=np.int64)[4 * slot:4 * slot + 4]  # head × 2, tail × 2（周回の偶奇）
+        self.head = 0  # 消費者側だけが使う
+        self.tail = 0  # 生産者側だけが使う
+
+    def push(self, records, r):
+        """周回 r に records（(時刻, パケットID, ノード番号, ホップ数) のリスト）を入るだけ書き、書いた数を返す"""
+        head = int(self.ctl[r & 1])  # 周回 r - 2 の pop_all が公開した head（r - 1 の分はまだ書き換え中かもしれない）
+        tail = self.tail
+        n = min(len(self.buf) - (tail - head), len(records))
+        if n:
+            self.buf[(tail + np.arange(n)) & self.mask] = records[:n]
+            self.tail = tail = tail + n
+        self.ctl[2 + (r & 1)] = tail
+        return n
+
+    def pop_all(self, r):
+        """周回 r の barrier を抜けた後に、その周回までに書かれた分を読む"""
+        head, tail = self.head, int(self.ctl[2 + (r & 1)])
+        rows = self.buf[(head + np.arange(tail - head)) & self.mask].tolist() if tail != head else []
+        self.head = tail
+        self.ctl[r & 1] = tail
+        return rows
+
+
+# --- ワーカー ---
+def _worker(me, spec):
+    barrier = spec["barrier"]
+    try:
+        _run_partition(me, spec)
+    except threading.BrokenBarrierError:
+        sys.exit(1)  # 他のワーカーの異常終了に巻き込まれただけなので traceback は出さない
+    except BaseException:
+        barrier.abort()  # 他のワーカーを待たせたままにしない
+        raise
+
+
+def _run_partition(me, spec):
+    topo = spec["topology"]
+    k = spec["k"]
+    lookahead = spec["lookahead"]
+    until = spec["until"]
+    n_packets = spec["n_packets"]
+    barrier = spec["barrier"]
+    routes = spec["routes"]
+    dst_of = spec["dst"]
+    size_of = spec["size"]
+    owner = array("i", spec["owner"].tobytes())
+
+    m = topo.n_links
+    target = array("i", topo.targets.tobytes())
+    latency = array("d", topo.latency.tobytes())
+    bandwidth = array("d", topo.bandwidth.tobytes())
+    link_capacity = array("i", topo.capacity.tobytes())
+    busy_until = array("d", bytes(8 * m))
+    link_sent = array("q", bytes(8 * m))
+    link_dropped = array("q", bytes(8 * m))
+    backlogs = [None] * m
+
+    status = array("b", bytes(n_packets))
+    delivered = array("d", [math.nan]) * n_packets
+    hops = array("H", bytes(2 * n_packets))
+
+    data, ctl = spec["ring_data"], spec["ring_ctl"]
+    rings_out = [_Ring(data[me * k + j], ctl, me * k + j) if j != me else None for j in range(k)]
+    rings_in = [_Ring(data[j * k + me], ctl, j * k + me) for j in range(k) if j != me]
+    sync = np.frombuffer(spec["sync"], dtype=np.float64).reshape(2, k, 2)  # [周回の偶奇, ワーカー, (残り, 次の時刻)]
+
+    heap = []
+    pending = spec["pending"][me]  # 時刻の降順（末尾から取り出す）
+    out = [[] for _ in range(k)]
+    pop, replace, push = heapq.heappop, heapq.heapreplace, heapq.heappush
+    inf = math.inf
+    count = 0
+    last_t = 0.0
+    rnd = 0
+    T = spec["start"]
+
+    while T < inf and T <= until:
+        end = T + lookahead
+        out_min = inf
+        # --- 窓の中の自分のイベントを処理（Simulator.run と同じ手順） ---
+        while True:
+            head = heap[0] if heap else None
+            if pending and (head is None or pending[-1] < head):
+                event = pending.pop()
+                if heap:
+                    push(heap, event)
+                else:
+                    heap.append(event)
+                head = event
+            if head is None or head[0] >= end or head[0] > until:
+                break
+            t, pid, node = head
+            count += 1
+            last_t = t
+            dst = dst_of[pid]
+            if node == dst:
+                pop(heap)
+                status[pid] = DELIVERED
+                delivered[pid] = t
+                continue
+
+            link = routes[dst][node]
+            if link < 0:
+                pop(heap)
+                status[pid] = DROPPED_ROUTE
+                continue
+
+            backlog = backlogs[link]
+            if backlog is None:
+                backlog = backlogs[link] = deque()
+            while backlog and backlog[0] <= t:
+                backlog.popleft()
+            if len(backlog) >= link_capacity[link]:
+                pop(heap)
+                link_dropped[link] += 1
+                status[pid] = DROPPED_QUEUE
+                continue
+            busy = busy_until[link]
+            done = (busy if busy > t else t) + size_of[pid] * 8.0 / bandwidth[link]
+            busy_until[link] = done
+            backlog.append(done)
+            link_sent[link] += 1
+            hops[pid] += 1
+            arrive = done + latency[link]
+            nxt = target[link]
+            part = owner[nxt]
+            if part == me:
+                replace(heap, (arrive, pid, nxt))
+            else:
+                pop(heap)
+                out[part].append((arrive, pid, nxt, hops[pid]))
+                if arrive < out_min:
+                    out_min = arrive
+
+        # --- 分割をまたぐパケットを交換し、全体で次の時刻を決める ---
+        while True:
+            left = 0
+            for j, records in enumerate(out):
+                if j != me:
+                    del records[:rings_out[j].push(records, rnd)]
+                    left += len(records)
+            slot = sync[rnd & 1]
+            slot[me, 0] = left
+            slot[me, 1] = min(heap[0][0] if heap else inf, pending[-1][0] if pending else inf, out_min)
+            barrier.wait()
+            for ring in rings_in:
+                for t, pid, node, h in ring.pop_all(rnd):
+                    pid = int(pid)
+                    hops[pid] = int(h)
+                    push(heap, (t, pid, int(node)))
+            rnd += 1
+            if not slot[:, 0].any():
+                break
+        T = float(slot[:, 1].min())
+
+    # --- 結果を共有配列へ（パケットは最後にいた分割、リンクは送信側の分割が書く） ---
+    res = spec["results"]
+    local_status = np.frombuffer(status, dtype=np.int8)
+    finished = np.flatnonzero(local_status)
+    held = np.array([pid for _, pid, _ in heap], dtype=np.int64)
+    np.frombuffer(res["status"], dtype=np.int8)[finished] = local_status[finished]
+    np.frombuffer(res["delivered"], dtype=np.float64)[finished] = np.frombuffer(delivered)[finished]
+    shared_hops = np.frombuffer(res["hops"], dtype=np.uint16)
+    local_hops = np.frombuffer(hops, dtype=np.uint16)
+    shared_hops[finished] = local_hops[finished]
+    shared_hops[held] = local_hops[held]
+    mine = np.flatnonzero(np.frombuffer(owner, dtype=np.int32)[topo.sources] == me)
+    for name, local in (("busy_until", busy_until), ("link_sent", link_sent), ("link_dropped", link_dropped)):
+        dtype = np.dtype(local.typecode)
+        np.frombuffer(res[name], dtype=dtype)[mine] = np.frombuffer(local, dtype=dtype)[mine]
+    res["events"][me] = count
+    res["last"][me] = last_t
+
+
+def _join_workers(procs, barrier, grace=5.0):
+    """ワーカーの終了を待つ。シグナルで殺されたワーカーは barrier.abort() を呼べないので、
+    異常終了を見つけたら親が barrier を壊して残りを起こし、grace 秒待っても残れば止める"""
+    alive = list(procs)
+    while alive:
+        wait([p.sentinel for p in alive])
+        alive = [p for p in alive if p.exitcode is None]
+        if any(p.exitcode for p in procs if p.exitcode is not None):
+            barrier.abort()
+            break
+    for p in alive:
+        p.join(grace)
+        if p.exitcode is None:
+            p.terminate()
+            p.join()
+
+
+class ParallelSimulator(Simulator):
+    """トポロジーを分割して複数プロセスで動かす Simulator（結果は逐次実行と完全に一致する）
+
+    各ノードとその出リンクの状態は1つのワーカーが持つ。イベントを処理すると次のノードへの到着は
+    少なくとも「リンクの伝搬遅延」だけ先になるので、分割をまたぐリンクの最小遅延を lookahead として
+    [T, T + lookahead) の窓の中は各ワーカーが自分のヒープだけで (時刻, パケットID) 順に処理できる。
+    窓ごとにまたいだパケットを共有メモリのリングでまとめて渡し、全体の次のイベント時刻を T にする。
+    経路表は親プロセスで先に作ってワーカーに渡すので、逐次実行と同じ経路になる。
+
+    run は1回だけで、max_events と on_deliver は使えない。
+    """
+
+    def __init__(self, topology=None, max_packets=1 << 16, router=None, workers=None, ring_capacity=1 << 14,
+                 owner=None):
+        super().__init__(topology, max_packets, router)
+        self.workers = workers or os.cpu_count() or 1
+        self.ring_capacity = 1 << max(1, (ring_capacity - 1).bit_length())
+        self.owner = owner
+        self.lookahead = None
+
+    def run(self, until=math.inf, max_events=None):
+        if self.workers <= 1:
+            return super().run(until, max_events)
+        if max_events is not None or self.on_deliver is not None:
+            raise ValueError("並列実行では max_events / on_deliver は使えません")
+        if self.events:
+            raise RuntimeError("並列実行は途中から再開できません")
+        n = len(self.packets)
+        if not n:
+            return 0
+
+        topo = self.topology
+        k = self.workers
+        if self.owner is None:
+            self.owner = partition(topo, k)
+        owner = np.ascontiguousarray(self.owner, dtype=np.int32)
+        cut = cut_links(topo, owner)
+        self.lookahead = float(topo.latency[cut].min()) if len(cut) else math.inf
+        if not self.lookahead > 0:
+            raise ValueError("分割をまたぐリンクの遅延が0なので並列化できません")
+
+        router = self.router
+        for dst in set(self._dst[:n]):
+            router.tree(dst)
+        routes = {dst: router.next_hops[dst] for dst in set(self._dst[:n])}
+
+        pending = sorted(self._pending)
+        self._pending.clear()
+        per_worker = [[] for _ in range(k)]
+        for event in pending:
+            per_worker[owner[event[2]]].append(event)
+        for events in per_worker:
+            events.reverse()
+
+        ctx = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+        m = topo.n_links
+        results = {
+            "status": ctx.RawArray("b", n),
+            "delivered": ctx.RawArray("d", [math.nan] * n),
+            "hops": ctx.RawArray("H", n),
+            "busy_until": ctx.RawArray("d", m),
+            "link_sent": ctx.RawArray("q", m),
+            "link_dropped": ctx.RawArray("q", m),
+            "events": ctx.RawArray("q", k),
+            "last": ctx.RawArray("d", k),
+        }
+        spec = {
+            "topology": topo,
+            "k": k,
+            "lookahead": self.lookahead,
+            "until": until,
+            "n_packets": n,
+            "barrier": ctx.Barrier(k),
+            "routes": routes,
+            "dst": self._dst[:n],
+            "size": self._size[:n],
+            "owner": owner,
+            "pending": per_worker,
+            "start": pending[0][0] if pending else math.inf,
+            "ring_data": [ctx.RawArray("d", 4 * self.ring_capacity) if i // k != i % k else None
+                          for i in range(k * k)],
+            "ring_ctl": ctx.RawArray("q", 4 * k * k),
+            "sync": ctx.RawArray("d", 2 * k * 2),
+            "results": results,
+        }
+        procs = [ctx.Process(target=_worker, args=(i, spec), daemon=True) for i in range(k)]
+        gc.freeze()  # fork した子の GC が親のオブジェクトを走査してページを複製しないように
+        try:
+            for p in procs:
+                p.start()
+        finally:
+            gc.unfreeze()
+        _join_workers(procs, spec["barrier"])
+        failed = [p.exitcode for p in procs if p.exitcode]
+        if failed:
+            raise RuntimeError(f"ワーカーが異常終了しました: {failed}")
+
+        np.frombuffer(self.status, dtype=np.int8)[:n] = np.frombuffer(results["status"], dtype=np.int8)
+        np.frombuffer(self.delivered)[:n] = np.frombuffer(results["delivered"])
+        np.frombuffer(self.hops, dtype=np.uint16)[:n] = np.frombuffer(results["hops"], dtype=np.uint16)
+        if not self._links_ready:
+            self._prepare_links()
+        np.frombuffer(self.busy_until)[:] = np.frombuffer(results["busy_until"])
+        np.frombuffer(self.link_sent, dtype=np.int64)[:] = np.frombuffer(results["link_sent"], dtype=np.int64)
+        np.frombuffer(self.link_dropped, dtype=np.int64)[:] = np.frombuffer(results["link_dropped"], dtype=np.int64)
+        count = int(sum(results["events"]))
+        self.events += count
+        self.now = max(results["last"])
+        return count
+
+
+def torus_topology(side, bandwidth=1e9, latency=1e-4, capacity=64):
+    """side × side の格子の端をつないだトポロジー（ノード番号は 行 * side + 列）"""
+    idx = np.arange(side * side).reshape(side, side)
+    src = np.concatenate([idx.ravel(), idx.ravel()])
+    dst = np.concatenate([np.roll(idx, -1, axis=1).ravel(), np.roll(idx, -1, axis=0).ravel()])
+    return Topology.from_edges(src, dst, latency, bandwidth, capacity, bidirectional=True)
+
+
+if __name__ == "__main__":
+    # python parallel_sim.py [--side=1000] [--packets=20000] [--sinks=16] [--workers=2,4]
+    args = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    side = int(args.get("side", 1000))
+    n_packets = int(args.get("packets", 20_000))
+    n_sinks = int(args.get("sinks", 16))
+    worker_counts = [int(w) for w in args.get("workers", f"2,{max(2, os.cpu_count() or 1)}").split(",")]
+
+    started = time.perf_counter()
+    topo = torus_topology(side)
+    n = topo.n_nodes
+    rng = np.random.default_rng(0)
+    sinks = rng.choice(n, n_sinks, replace=False)
+    sends = list(zip((np.arange(n_packets) * 1e-6).tolist(), rng.integers(0, n, n_packets).tolist(),
+                     sinks[rng.integers(0, n_sinks, n_packets)].tolist()))
+    print(f"{n:,} ノード / {topo.n_links:,} リンク / パケット {n_packets:,}（宛先 {n_sinks}）"
+          f" 構築 {time.perf_counter() - started:.1f}s / CPU {os.cpu_count()}")
+
+    def load(sim):
+        for at, src, dst in sends:
+            sim.send(at, src, dst, size=1000)
+        for dst in sinks.tolist():
+            sim.router.tree(dst)  # 経路表の計算は計測に含めない
+        return sim
+
+    seq = load(Simulator(topo, max_packets=n_packets))
+    started = time.perf_counter()
+    seq.run()
+    base = time.perf_counter() - started
+    print(f"逐次   : {seq.events:,} イベント {base:.2f}s ({seq.events / base / 1e6:.2f}M events/s)")
+
+    for workers in worker_counts:
+        par = load(ParallelSimulator(topo, max_packets=n_packets, workers=workers))
+        started = time.perf_counter()
+        par.owner = partition(topo, workers)
+        split = time.perf_counter() - started
+        started = time.perf_counter()
+        par.run()
+        elapsed = time.perf_counter() - started
+        same = (np.array_equal(np.frombuffer(seq.delivered), np.frombuffer(par.delivered), equal_nan=True)
+                and seq.status == par.status and seq.hops == par.hops
+                and seq.link_sent == par.link_sent and seq.link_dropped == par.link_dropped)
+        print(f"並列 {workers:>2}: {par.events:,} イベント {elapsed:.2f}s (x{base / elapsed:.2f}) "
+              f"分割 {split:.1f}s / 切断リンク {len(cut_links(topo, par.owner)):,} / "
+              f"lookahead {par.lookahead * 1e3 if par.lookahead else 0:g}ms / 逐次と一致: {same}")
@@ -0,0 +1,278 @@
+import heapq
+import math
+import numbers
+import time
+from array import array
+
+import numpy as np
+
+from Node import Node
+from topology import NodeView
+
+INF = math.inf
+
+
+class Router:
+    """Topology 上の宛先ごとの最短経路木をキャッシュし、リンクの変更では影響する部分だけ直すルーター
+
+    weight は "hops"（リンク数、既定）/ "latency"（伝搬遅延）/ リンクごとの重みの配列。
+    宛先 d の木は
+        next_hops[d] : ノード番号ごとの次のリンク番号（array('i')、経路なしは -1）
+        dist[d]      : ノード番号ごとの d までの距離（array('d')、経路なしは inf）
+    で持つので、転送時の次のリンクは next_hops[d][ノード番号] の1回の参照で決まる。
+    木は初めて使う宛先のときに作り（重みが全部1なら numpy の BFS、それ以外は Dijkstra）、
+    set_weight / remove_link / add_link ではキャッシュ済みの木を増分で直す。
+      - 重みが下がった: そのリンクで近くなるノードから Dijkstra で広げる
+      - 重みが上がった / 削除: そのリンクを使っていた部分木だけ距離を捨てて引き直す
+    同じ距離の経路が複数あるときは、作り直した木と増分で直した木で選ぶリンクが違うことがある。
+    """
+
+    def __init__(self, topology, weight="hops", max_trees=None):
+        self.topology = topology
+        self.max_trees = max_trees  # キャッシュする木の上限（超えたら古い宛先から捨てる）
+        self.next_hops = {}
+        self.dist = {}
+        self.on_link_inserted = []  # callback(リンク番号)。add_link でリンク番号がずれたとき
+        self.repaired = 0  # 増分更新で距離を直したノード数（累計）
+
+        m = topology.n_links
+        if isinstance(weight, str):
+            if weight == "hops":
+                weights = np.ones(m)
+            elif weight == "latency":
+                weights = topology.latency
+            else:
+                raise ValueError(f"未知の weight: {weight}")
+        else:
+            weights = np.asarray(weight, dtype=np.float64)
+            if weights.shape != (m,):
+                raise ValueError(f"weight の長さがリンク数 {m} と合いません")
+        self.weights = array("d", np.ascontiguousarray(weights, dtype=np.float64).tobytes())
+        self._by_hops = isinstance(weight, str) and weight == "hops"
+        self._uniform = self._by_hops  # 全リンクの重みが1なら BFS で作れる
+        self._load_csr()
+
+    def _load_csr(self):
+        """ループで引く CSR を array に写す（トポロジーが変わったら呼び直す）"""
+        topo = self.topology
+        rev_offsets, rev_links = topo.reverse()
+        self._offsets = array("q", topo.offsets.tobytes())
+        self._targets = array("i", topo.targets.tobytes())
+        self._sources = array("i", topo.sources.tobytes())
+        self._rev_offsets = array("q", rev_offsets.tobytes())
+        self._rev_links = array("q", rev_links.tobytes())
+
+    # --- 参照 ---
+    def resolve(self, node):
+        """Node / NodeView / ノード番号 / アドレスをノード番号にする"""
+        if isinstance(node, NodeView):
+            return node.index
+        if isinstance(node, Node):
+            if not 0 <= node.index < self.topology.n_nodes:
+                raise ValueError(f"{node} はこのトポロジーに登録されていません")
+            return node.index
+        if isinstance(node, numbers.Integral):
+            return int(node)
+        return self.topology.index_of_address(node)
+
+    def tree(self, dst):
+        """dst への next_hops（無ければ作ってキャッシュ）"""
+        table = self.next_hops.get(dst)
+        if table is None:
+            if self.max_trees and len(self.next_hops) >= self.max_trees:
+                oldest = next(iter(self.next_hops))
+                del self.next_hops[oldest], self.dist[oldest]
+            table, self.dist[dst] = self._build(dst)
+            self.next_hops[dst] = table
+        return table
+
+    def next_hop(self, node, dst):
+        """node から dst へ向かう次のリンク番号（経路なしは -1）"""
+        dst = self.resolve(dst)
+        return self.tree(dst)[self.resolve(node)]
+
+    def distance(self, node, dst):
+        dst = self.resolve(dst)
+        self.tree(dst)
+        return self.dist[dst][self.resolve(node)]
+
+    def path(self, src, dst):
+        """src から dst までに通るノード番号のリスト（経路なしは空）"""
+        src, dst = self.resolve(src), self.resolve(dst)
+        table = self.tree(dst)
+        targets = self._targets
+        path = [src]
+        while src != dst:
+            link = table[src]
+            if link < 0:
+                return []
+            src = targets[link]
+            path.append(src)
+        return path
+
+    # --- 木の構築 ---
+    def _build(self, dst):
+        if self._uniform:
+            hops, next_link = self.topology.bfs(dst)
+            dist = np.where(hops >= 0, hops, np.inf).astype(np.float64)
+            return array("i", next_link.astype(np.int32).tobytes()), array("d", dist.tobytes())
+        n = self.topology.n_nodes
+        dist = array("d", [INF]) * n
+        table = array("i", [-1]) * n
+        dist[dst] = 0.0
+        self._propagate(dist, table, [(0.0, dst)])
+        return table, dist
+
+    def _propagate(self, dist, table, heap):
+        """heap のノードから入ってくるリンクを逆向きにたどって距離を縮める（Dijkstra）"""
+        pop, push = heapq.heappop, heapq.heappush
+        rev_offsets, rev_links = self._rev_offsets, self._rev_links
+        sources, weights = self._sources, self.weights
+        settled = 0
+        while heap:
+            d, v = pop(heap)
+            if d > dist[v]:
+                continue
+            settled += 1
+            for k in range(rev_offsets[v], rev_offsets[v + 1]):
+                link = rev_links[k]
+                u = sources[link]
+                nd = d + weights[link]
+                if nd < dist[u]:
+                    dist[u] = nd
+                    table[u] = link
+                    push(heap, (nd, u))
+        return settled
+
+    # --- 増分更新 ---
+    def _decrease(self, dst, link):
+        dist, table = self.dist[dst], self.next_hops[dst]
+        u = self._sources[link]
+        nd = dist[self._targets[link]] + self.weights[link]
+        if not nd < dist[u]:
+            return 0
+        dist[u] = nd
+        table[u] = link
+        return self._propagate(dist, table, [(nd, u)])
+
+    def _increase(self, dst, link):
+        dist, table = self.dist[dst], self.next_hops[dst]
+        u = self._sources[link]
+        if table[u] != link:
+            return 0
+        # link を通って dst に向かっていたノード（u を根とする部分木）を集める
+        rev_offsets, rev_links, sources = self._rev_offsets, self._rev_links, self._sources
+        affected = [u]
+        i = 0
+        while i < len(affected):
+            x = affected[i]
+            i += 1
+            for k in range(rev_offsets[x], rev_offsets[x + 1]):
+                l = rev_links[k]
+                if table[sources[l]] == l:
+                    affected.append(sources[l])
+        for x in affected:
+            dist[x] = INF
+            table[x] = -1
+        # 部分木の外（距離は変わらない）へ出るリンクから引き直して、部分木の中に広げる
+        offsets, targets, weights = self._offsets, self._targets, self.weights
+        heap = []
+        for x in affected:
+            best, best_link = INF, -1
+            for l in range(offsets[x], offsets[x + 1]):
+                nd = weights[l] + dist[targets[l]]
+                if nd < best:
+                    best, best_link = nd, l
+            if best_link >= 0:
+                dist[x] = best
+                table[x] = best_link
+                heap.append((best, x))
+        heapq.heapify(heap)
+        self._propagate(dist, table, heap)
+        return len(affected)
+
+    def set_weight(self, link, weight):
+        """リンクの重みを変えて、キャッシュ済みの木を直す。直したノード数を返す"""
+        old = self.weights[link]
+        if weight == old:
+            return 0
+        self.weights[link] = weight
+        self._uniform = self._uniform and weight == 1.0
+        repair = self._decrease if weight < old else self._increase
+        count = sum(repair(dst, link) for dst in self.next_hops)
+        self.repaired += count
+        return count
+
+    def remove_link(self, link):
+        """リンクを使えなくする（重み inf 扱い。リンク番号は変わらない）"""
+        return self.set_weight(link, INF)
+
+    def add_link(self, src, dst, latency=1e-3, bandwidth=1e9, capacity=64, weight=None):
+        """src から dst へのリンクを追加してそのリンク番号を返す
+
+        weight を省略すると "hops" なら1、それ以外は latency。
+        追加した位置より後ろのリンク番号は1つずれるので、キャッシュ済みの木もずらしてから直す。
+        """
+        src, dst = self.resolve(src), self.resolve(dst)
+        k = self.topology.insert_link(src, dst, latency, bandwidth, capacity)
+        for table in self.next_hops.values():
+            view = np.frombuffer(table, dtype=np.int32)
+            view[view >= k] += 1
+            del view
+        self.weights.insert(k, INF)  # 使えないリンクとして入れてから重みを下げる
+        self._load_csr()
+        for callback in self.on_link_inserted:
+            callback(k)
+        if weight is None:
+            weight = 1.0 if self._by_hops else latency
+        self.set_weight(k, weight)
+        return k
+
+
+if __name__ == "__main__":
+    import random
+
+    from topology import Topology
+
+    # 1万ノードのランダムグラフ（遅延を重みにする）で、全部作り直すのと増分更新を比べる
+    rng = np.random.default_rng(0)
+    n, degree, n_trees = 10_000, 4, 200
+    topo = Topology.from_edges(rng.integers(0, n, degree * n), rng.integers(0, n, degree * n),
+                               latency=rng.uniform(1e-4, 5e-3, degree * n), n_nodes=n, bidirectional=True)
+    router = Router(topo, weight="latency")
+    destinations = rng.choice(n, n_trees, replace=False).tolist()
+
+    started = time.perf_counter()
+    for d in destinations:
+        router.tree(d)
+    build = (time.perf_counter() - started) / n_trees
+    print(f"{n:,} ノード / {topo.n_links:,} リンク: 木1本の構築 {build * 1e3:.2f}ms")
+
+    random.seed(0)
+    changes = 200
+    started = time.perf_counter()
+    for _ in range(changes):
+        link = random.randrange(topo.n_links)
+        if random.random() < 0.3:
+            router.remove_link(link)
+        else:
+            router.set_weight(link, router.weights[link] * random.uniform(0.2, 3.0))
+    for _ in range(20):
+        router.add_link(random.randrange(n), random.randrange(n), latency=random.uniform(1e-4, 5e-3))
+    repair = (time.perf_counter() - started) / (changes + 20)
+    print(f"リンク変更1回あたり {repair * 1e3:.2f}ms（木 {n_trees} 本、作り直しなら "
+          f"{build * n_trees * 1e3:.0f}ms）/ 直したノード {router.repaired:,}")
+
+    # 作り直した木と距離が一致するか確認
+    fresh = Router(topo, weight=np.array(router.weights))
+    same = all(np.allclose(router.dist[d], fresh._build(d)[1]) for d in destinations)
+    print(f"作り直した木と距離が一致: {same}")
+
+    started = time.perf_counter()
+    lookups = 0
+    for d in destinations:
+        table = router.next_hops[d]
+        for v in range(0, n, 10):
+            table[v]
+            lookups += 1
+    print(f"次のリンクの参照 {(time.perf_counter() - started) / lookups * 1e9:.0f}ns/回")
@@ -0,0 +1,310 @@
+import heapq
+import math
+import time
+from array import array
+from collections import deque
+
+from Packet import Packet
+from routing import Router
+from topology import Topology
+
+# パケットの状態
+IN_FLIGHT = 0
+DELIVERED = 1
+DROPPED_QUEUE = 2   # リンクの待ち行列が満杯
+DROPPED_ROUTE = 3   # 宛先への経路が無い
+
+
+class Simulator:
+    """Topology の配列上で動く離散イベントシミュレーター
+
+    イベントは (時刻, パケットID, ノード番号) のタプルで二分ヒープに積む。
+    1つのパケットが同時に持つイベントは1つだけなので (時刻, パケットID) で
+    順序が一意に決まり、同じ入力なら毎回同じ結果になる。
+
+    send で予約したパケットは時刻順の別リストに置き、ヒープには経路上にある
+    パケットだけを載せる（ヒープを小さく保つ）。
+    リンクは送信完了時刻だけを持つ FIFO として扱い、「ノードに到着」イベントの
+    処理の中で待ち行列への追加・送信完了・次のノードへの到着時刻の計算まで
+    まとめて行う（送信完了イベントを別に積まない）。
+    リンクの属性と状態、パケットの統計はすべてリンク番号・パケットIDで引く array に置く。
+
+    経路は Router の next_hops をそのまま引く。router を渡せば重み付きの経路や、
+    実行の途中でのリンクの重み変更・削除・追加（router 経由）も反映される。
+
+    topology を渡さない場合は add_node / connect で Node を組み立て、
+    最初の send / run の時点で Topology に変換する。
+    """
+
+    def __init__(self, topology=None, max_packets=1 << 16, router=None):
+        self.nodes = []  # add_node で組み立てる場合の Node
+        if topology is None and router is not None:
+            topology = router.topology
+        self._topology = topology
+        self._router = None
+        if router is not None:
+            self._attach(router)
+        self.packets = []
+        self.now = 0.0
+        self.events = 0
+        self.on_deliver = None  # callback(packet, time)
+
+        self._heap = []
+        self._pending = []  # send で予約した (時刻, パケットID, ノード番号)
+        self._pending_sorted = True
+        self._links_ready = False
+        self._capacity = 0
+        self._dst = array("i")
+        self._size = array("d")
+        self.created = array("d")
+        self.delivered = array("d")
+        self.status = array("b")
+        self.hops = array("H")
+        self._grow(max_packets)
+
+    def _grow(self, capacity):
+        extra = capacity - self._capacity
+        self._dst.extend([0] * extra)
+        self._size.extend([0.0] * extra)
+        self.created.extend([0.0] * extra)
+        self.delivered.extend([math.nan] * extra)
+        self.status.extend([IN_FLIGHT] * extra)
+        self.hops.extend([0] * extra)
+        self._capacity = capacity
+
+    # --- 構築 ---
+    def add_node(self, node):
+        self._invalidate()
+        node.index = len(self.nodes)
+        self.nodes.append(node)
+        return node
+
+    def connect(self, a, b, bandwidth=1e9, latency=1e-3, capacity=64, bidirectional=True):
+        self._invalidate()
+        return a.connect(b, bandwidth, latency, capacity, bidirectional)
+
+    def _invalidate(self):
+        if self.packets:
+            raise RuntimeError("パケットを送った後はトポロジーを変更できません")
+        self._topology = None
+        self._router = None
+        self._links_ready = False
+
+    @property
+    def topology(self):
+        if self._topology is None:
+            self._topology = Topology.from_nodes(self.nodes)
+        return self._topology
+
+    @property
+    def router(self):
+        if self._router is None:
+            self._attach(Router(self.topology))
+        return self._router
+
+    def _attach(self, router):
+        self._router = router
+        router.on_link_inserted.append(self._link_inserted)
+
+    def _link_inserted(self, k):
+        """router.add_link で増えたリンクの列を入れる（以降のリンク番号は1つずれる）"""
+        if not self._links_ready:
+            return
+        topo = self.topology
+        self._target.insert(k, int(topo.targets[k]))
+        self._latency.insert(k, float(topo.latency[k]))
+        self._bandwidth.insert(k, float(topo.bandwidth[k]))
+        self._link_capacity.insert(k, int(topo.capacity[k]))
+        self.busy_until.insert(k, 0.0)
+        self.link_sent.insert(k, 0)
+        self.link_dropped.insert(k, 0)
+        self._backlog.insert(k, None)
+
+    def _prepare_links(self):
+        """リンクの属性を array に写し、状態を確保する（ホットループでは numpy を触らない）"""
+        topo = self.topology
+        m = topo.n_links
+        self._target = array("i", topo.targets.tobytes())
+        self._latency = array("d", topo.latency.tobytes())
+        self._bandwidth = array("d", topo.bandwidth.tobytes())
+        self._link_capacity = array("i", topo.capacity.tobytes())
+        self.busy_until = array("d", bytes(8 * m))
+        self.link_sent = array("q", bytes(8 * m))
+        self.link_dropped = array("q", bytes(8 * m))
+        self._backlog = [None] * m  # 使ったリンクだけ deque を作る
+        self._links_ready = True
+
+    # --- 送信 ---
+    def send(self, at, source, destination, payload=b"", size=None):
+        """時刻 at に source から destination（ノード・ノード番号・アドレス）へパケットを送る"""
+        src = self.router.resolve(source)
+        dst = self.router.resolve(destination)
+        addresses = self.topology.addresses
+        pid = len(self.packets)
+        if pid >= self._capacity:
+            self._grow(self._capacity * 2)
+        if addresses is not None:
+            packet = Packet(addresses[src], addresses[dst], payload, size, pid)
+        else:
+            packet = Packet(src, dst, payload, size, pid)
+        self.packets.append(packet)
+        self._dst[pid] = dst
+        self._size[pid] = packet.size
+        self.created[pid] = at
+        pending = self._pending
+        if pending and at < pending[-1][0]:
+            self._pending_sorted = False
+        pending.append((at, pid, src))
+        return packet
+
+    # --- 実行 ---
+    def run(self, until=math.inf, max_events=None):
+        """イベントを時刻順に処理する。処理したイベント数を返す"""
+        if not self._links_ready:
+            self._prepare_links()
+        heap = self._heap
+        pending = self._pending
+        if not self._pending_sorted:
+            pending.sort()
+            self._pending_sorted = True
+        pending.reverse()  # 末尾から取り出す
+        pop = heapq.heappop
+        replace = heapq.heapreplace
+        push = heapq.heappush
+        router = self.router
+        routes = router.next_hops
+        route_to = router.tree
+        dst_of = self._dst
+        size_of = self._size
+        status = self.status
+        delivered = self.delivered
+        hops = self.hops
+        target = self._target
+        latency = self._latency
+        bandwidth = self._bandwidth
+        link_capacity = self._link_capacity
+        busy_until = self.busy_until
+        link_sent = self.link_sent
+        link_dropped = self.link_dropped
+        backlogs = self._backlog
+        on_deliver = self.on_deliver
+        limit = max_events if max_events is not None else -1
+        count = 0
+
+        while count != limit:
+            # ヒープ先頭と、次に送り出す予約パケットのうち早い方
+            head = heap[0] if heap else None
+            if pending and (head is None or pending[-1] < head):
+                event = pending.pop()
+                if heap:
+                    push(heap, event)  # 下の replace / pop で取り除く
+                else:
+                    heap.append(event)
+                head = event
+            if head is None or head[0] > until:
+                break
+            t, pid, node = head
+            count += 1
+            dst = dst_of[pid]
+            if node == dst:
+                pop(heap)
+                status[pid] = DELIVERED
+                delivered[pid] = t
+                if on_deliver is not None:
+                    on_deliver(self.packets[pid], t)
+                continue
+
+            table = routes.get(dst) or route_to(dst)
+            link = table[node]
+            if link < 0:
+                pop(heap)
+                status[pid] = DROPPED_ROUTE
+                continue
+
+            # 送信し終わったものを待ち行列から外して、空きがあれば最後尾に並べる
+            backlog = backlogs[link]
+            if backlog is None:
+                backlog = backlogs[link] = deque()
+            while backlog and backlog[0] <= t:
+                backlog.popleft()
+            if len(backlog) >= link_capacity[link]:
+                pop(heap)
+                link_dropped[link] += 1
+                status[pid] = DROPPED_QUEUE
+                continue
+            busy = busy_until[link]
+            done = (busy if busy > t else t) + size_of[pid] * 8.0 / bandwidth[link]
+            busy_until[link] = done
+            backlog.append(done)
+            link_sent[link] += 1
+            hops[pid] += 1
+            replace(heap, (done + latency[link], pid, target[link]))
+
+        pending.reverse()
+        if count:
+            self.now = t
+        self.events += count
+        return count
+
+    # --- 統計 ---
+    def stats(self):
+        n = len(self.packets)
+        status = self.status[:n]
+        latencies = sorted(self.delivered[i] - self.created[i] for i in range(n) if status[i] == DELIVERED)
+
+        def pct(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else math.nan
+
+        return {
+            "packets": n,
+            "delivered": status.count(DELIVERED),
+            "dropped_queue": status.count(DROPPED_QUEUE),
+            "dropped_route": status.count(DROPPED_ROUTE),
+            "in_flight": status.count(IN_FLIGHT),
+            "latency_mean": sum(latencies) / len(latencies) if latencies else math.nan,
+            "latency_p50": pct(0.5),
+            "latency_p99": pct(0.99),
+            "events": self.events,
+        }
+
+
+def ring_topology(n, bandwidth=1e9, latency=1e-4, capacity=64):
+    """n 台を輪につないだネットワーク（ベンチマーク用）"""
+    import numpy as np
+    src = np.arange(n)
+    topo = Topology.from_edges(src, (src + 1) % n, latency, bandwidth, capacity, bidirectional=True,
+                               addresses=[f"00:{i:04x}" for i in range(n)])
+    return Simulator(topo), topo.nodes()
+
+
+if __name__ == "__main__":
+    import random
+
+    random.seed(1)
+    sim, nodes = ring_topology(64)
+    n_packets = 200_000
+    for k in range(n_packets):
+        src, dst = random.sample(nodes, 2)
+        sim.send(k * 1e-6, src, dst, size=1000)
+
+    started = time.perf_counter()
+    events = sim.run()
+    elapsed = time.perf_counter() - started
+    s = sim.stats()
+    print(f"イベント {events:,} 件 / {elapsed:.2f}s = {events / elapsed / 1e6:.2f}M events/s")
+    print(f"到着 {s['delivered']:,} / 待ち行列で破棄 {s['dropped_queue']:,} / 経路なし {s['dropped_route']:,}")
+    print(f"遅延 平均 {s['latency_mean'] * 1e3:.3f}ms p50 {s['latency_p50'] * 1e3:.3f}ms "
+          f"p99 {s['latency_p99'] * 1e3:.3f}ms")
+
+    # 大規模トポロジー: 10^6 ノードのランダムグラフの構築と1宛先分の経路計算
+    import numpy as np
+    rng = np.random.default_rng(0)
+    n = 1_000_000
+    started = time.perf_counter()
+    big = Topology.from_edges(rng.integers(0, n, 4 * n), rng.integers(0, n, 4 * n), n_nodes=n,
+                              bidirectional=True)
+    built = time.perf_counter() - started
+    started = time.perf_counter()
+    reach = int((big.bfs_next_hop(0) >= 0).sum())
+    print(f"{n:,} ノード / {big.n_links:,} リンク: 構築 {built:.2f}s / {big.nbytes() / 2 ** 20:.0f}MB / "
+          f"BFS {time.perf_counter() - started:.2f}s（到達 {reach:,} ノード）")
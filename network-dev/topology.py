@@ -0,0 +1,249 @@
+import numpy as np
+
+
+def _gather(offsets, rows):
+    """CSR の rows 行に属する要素番号を1本の配列にまとめる"""
+    starts = offsets[rows]
+    lens = offsets[rows + 1] - starts
+    total = int(lens.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    shift = np.repeat(starts - (np.cumsum(lens) - lens), lens)
+    return np.arange(total, dtype=np.int64) + shift
+
+
+class Topology:
+    """ノードとリンクを CSR 形式の配列で持つトポロジー
+
+    ノードは 0..n-1 の通し番号（index）で扱い、ノードIDとアドレスは別配列で持つ。
+    ノード i から出るリンクは offsets[i]:offsets[i+1] の範囲で、リンク番号ごとに
+    targets（行き先のノード番号）/ latency / bandwidth / capacity を持つ。
+    Node オブジェクトが欲しいときは node(i) で軽量なビューを作る。
+    """
+
+    def __init__(self, offsets, targets, latency, bandwidth, capacity, node_ids=None, addresses=None):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.latency = np.asarray(latency, dtype=np.float64)
+        self.bandwidth = np.asarray(bandwidth, dtype=np.float64)
+        self.capacity = np.asarray(capacity, dtype=np.int32)
+        n = len(self.offsets) - 1
+        self.node_ids = np.arange(n, dtype=np.int64) if node_ids is None else np.asarray(node_ids, dtype=np.int64)
+        self.addresses = addresses
+        self.sources = np.repeat(np.arange(n, dtype=np.int32), np.diff(self.offsets))
+        self._id_index = None
+        self._address_index = None
+        self._reverse = None
+
+    # --- 構築 ---
+    @classmethod
+    def from_edges(cls, src, dst, latency=1e-3, bandwidth=1e9, capacity=64, node_ids=None,
+                   addresses=None, bidirectional=False, n_nodes=None):
+        """辺リストから作る
+
+        src / dst は node_ids を渡したときはノードID、省略時は 0 始まりの通し番号
+        （ノード数は n_nodes、省略時は最大の番号 + 1）。
+        latency / bandwidth / capacity はスカラーか辺ごとの配列。
+        """
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        m = len(src)
+        attrs = [np.broadcast_to(np.asarray(a, dtype=dt), (m,))
+                 for a, dt in ((latency, np.float64), (bandwidth, np.float64), (capacity, np.int32))]
+
+        if node_ids is None:
+            n = n_nodes if n_nodes is not None else int(max(src.max(initial=-1), dst.max(initial=-1))) + 1
+        else:
+            node_ids = np.asarray(node_ids, dtype=np.int64)
+            n = len(node_ids)
+            order = np.argsort(node_ids, kind="stable")
+            sorted_ids = node_ids[order]
+            def to_index(ids):
+                pos = np.searchsorted(sorted_ids, ids)
+                pos[pos >= n] = 0
+                if not np.array_equal(sorted_ids[pos], ids):
+                    raise ValueError("node_ids に無いノードIDを含む辺があります")
+                return order[pos]
+            src, dst = to_index(src), to_index(dst)
+
+        if bidirectional:
+            src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+            attrs = [np.concatenate([a, a]) for a in attrs]
+
+        order = np.argsort(src, kind="stable")  # 同じノードから出る辺は入力順を保つ
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=offsets[1:])
+        return cls(offsets, dst[order], *(a[order] for a in attrs), node_ids=node_ids, addresses=addresses)
+
+    @classmethod
+    def from_nodes(cls, nodes):
+        """Node オブジェクトのリストから作る（並び順がそのまま通し番号になり、node.index に入れる）"""
+        index = {id(node): i for i, node in enumerate(nodes)}
+        src, dst, latency, bandwidth, capacity = [], [], [], [], []
+        for i, node in enumerate(nodes):
+            node.index = i
+            for link in node.links:
+                src.append(i)
+                dst.append(index[id(link.dst)])
+                latency.append(link.latency)
+                bandwidth.append(link.bandwidth)
+                capacity.append(link.capacity)
+        topo = cls.from_edges(src, dst, latency, bandwidth, capacity, n_nodes=len(nodes))
+        topo.node_ids = np.array([node.node_id for node in nodes], dtype=np.int64)
+        topo.addresses = [node.address for node in nodes]
+        return topo
+
+    # --- 参照 ---
+    @property
+    def n_nodes(self):
+        return len(self.offsets) - 1
+
+    @property
+    def n_links(self):
+        return len(self.targets)
+
+    def out_links(self, i):
+        """ノード i から出るリンク番号の範囲"""
+        return range(self.offsets[i], self.offsets[i + 1])
+
+    def neighbors(self, i):
+        return self.targets[self.offsets[i]:self.offsets[i + 1]]
+
+    def index_of(self, node_id):
+        if self._id_index is None:
+            self._id_index = {int(v): i for i, v in enumerate(self.node_ids)}
+        return self._id_index[node_id]
+
+    def index_of_address(self, address):
+        if self._address_index is None:
+            self._address_index = {a: i for i, a in enumerate(self.addresses or ()) if a is not None}
+        return self._address_index[address]
+
+    def node(self, i):
+        return NodeView(self, i)
+
+    def nodes(self):
+        return [NodeView(self, i) for i in range(self.n_nodes)]
+
+    def reverse(self):
+        """入ってくるリンクの CSR: (offsets, リンク番号)"""
+        if self._reverse is None:
+            order = np.argsort(self.targets, kind="stable")
+            offsets = np.zeros(self.n_nodes + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.targets, minlength=self.n_nodes), out=offsets[1:])
+            self._reverse = (offsets, order.astype(np.int64))
+        return self._reverse
+
+    def bfs(self, dst):
+        """各ノードから dst までのリンク数と最初のリンク番号（届かないノードはどちらも -1）"""
+        rev_offsets, rev_links = self.reverse()
+        hops = np.full(self.n_nodes, -1, dtype=np.int64)
+        next_link = np.full(self.n_nodes, -1, dtype=np.int64)
+        hops[dst] = 0
+        frontier = np.array([dst], dtype=np.int64)
+        level = 0
+        while len(frontier):
+            level += 1
+            links = rev_links[_gather(rev_offsets, frontier)]
+            srcs = self.sources[links]
+            fresh = hops[srcs] < 0
+            srcs, links = srcs[fresh], links[fresh]
+            frontier, first = np.unique(srcs, return_index=True)
+            next_link[frontier] = links[first]
+            hops[frontier] = level
+            frontier = frontier.astype(np.int64)
+        return hops, next_link
+
+    def bfs_next_hop(self, dst):
+        """各ノードから dst へ向かうときの最初のリンク番号（リンク数が最小、無ければ -1）"""
+        return self.bfs(dst)[1]
+
+    # --- 変更 ---
+    def insert_link(self, src, dst, latency=1e-3, bandwidth=1e9, capacity=64):
+        """src から dst へのリンクを src の出リンクの末尾に追加し、そのリンク番号を返す
+
+        CSR の途中に入るので、返した番号以降の既存リンクの番号は1つずつ後ろにずれる。
+        """
+        k = int(self.offsets[src + 1])
+        self.targets = np.insert(self.targets, k, dst)
+        self.latency = np.insert(self.latency, k, latency)
+        self.bandwidth = np.insert(self.bandwidth, k, bandwidth)
+        self.capacity = np.insert(self.capacity, k, capacity)
+        self.sources = np.insert(self.sources, k, src)
+        self.offsets[src + 1:] += 1
+        self._reverse = None
+        return k
+
+    def find_link(self, src, dst):
+        """src から dst への最初のリンク番号（無ければ -1）"""
+        start = int(self.offsets[src])
+        hit = np.flatnonzero(self.neighbors(src) == dst)
+        return start + int(hit[0]) if len(hit) else -1
+
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.offsets, self.targets, self.latency, self.bandwidth,
+                                      self.capacity, self.node_ids, self.sources))
+
+
+class NodeView:
+    """Topology の1ノードを Node と同じ属性で見せるビュー（配列は複製しない）"""
+    __slots__ = ("topology", "index")
+
+    def __init__(self, topology, index):
+        self.topology = topology
+        self.index = index
+
+    @property
+    def node_id(self):
+        return int(self.topology.node_ids[self.index])
+
+    @property
+    def address(self):
+        addresses = self.topology.addresses
+        return addresses[self.index] if addresses is not None else None
+
+    @property
+    def links(self):
+        return [LinkView(self.topology, k) for k in self.topology.out_links(self.index)]
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and other.topology is self.topology and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.topology), self.index))
+
+    def __str__(self):
+        return f"ノード(ID: {self.node_id}, アドレス: {self.address})"
+
+
+class LinkView:
+    """Topology の1リンクを Link と同じ属性で見せるビュー"""
+    __slots__ = ("topology", "index")
+
+    def __init__(self, topology, index):
+        self.topology = topology
+        self.index = index
+
+    @property
+    def src(self):
+        return NodeView(self.topology, int(self.topology.sources[self.index]))
+
+    @property
+    def dst(self):
+        return NodeView(self.topology, int(self.topology.targets[self.index]))
+
+    @property
+    def latency(self):
+        return float(self.topology.latency[self.index])
+
+    @property
+    def bandwidth(self):
+        return float(self.topology.bandwidth[self.index])
+
+    @property
+    def capacity(self):
+        return int(self.topology.capacity[self.index])
+
+    def __str__(self):
+        return (f"リンク({self.src.address} -> {self.dst.address}, "
+                f"{self.bandwidth / 1e6:g}Mbps, {self.latency * 1e3:g}ms, 容量 {self.capacity})")
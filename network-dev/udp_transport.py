@@ -0,0 +1,321 @@
+import asyncio
+import random
+import socket
+import struct
+import sys
+import time
+
+import wire
+from Node import Node
+from Packet import Packet
+from routing import Router
+from topology import Topology
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def datagram_received(self, data, addr):
+        self.endpoint._received(data)
+
+    def error_received(self, exc):
+        self.endpoint.errors += 1
+
+    # 送信バッファが詰まったら送信タスクを止める
+    def pause_writing(self):
+        self.endpoint._writable.clear()
+
+    def resume_writing(self):
+        self.endpoint._writable.set()
+
+
+class Endpoint:
+    """Node をループバックの UDP ソケットで動かす実エンドポイント
+
+    隣のノードごとに上限付きの送信キュー（asyncio.Queue）と送信タスクを持つ。
+    send はキューが満杯なら空くまで待ち（バックプレッシャー）、send_nowait は破棄して False を返す。
+    送信タスクはキューに溜まった分を wire.encode_batch で1つのデータグラムにまとめて送る。
+    受け取ったパケットは自分宛てなら on_packet か inbox へ、それ以外は next_hop に従って転送する。
+    アドレスは wire と同じく整数で扱う（node.address が無ければ node_id）。
+    """
+
+    def __init__(self, node, host="127.0.0.1", port=0, queue_size=256, inbox_size=4096, batch=32,
+                 max_datagram=60_000, rcvbuf=1 << 22):
+        self.node = node
+        self.address = wire.node_address(node)
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.batch = batch
+        self.max_datagram = max_datagram
+        self.rcvbuf = rcvbuf
+        self.sockname = None
+        self.links = {}     # 隣のアドレス -> 送信キュー
+        self.next_hop = {}  # 宛先アドレス -> 隣のアドレス
+        self.inbox = asyncio.Queue(inbox_size)
+        self.on_packet = None  # callback(packet)。設定すると inbox には入れない
+        self.on_drop = None    # callback(packet)。破棄したパケット
+
+        self.sent_packets = 0
+        self.sent_datagrams = 0
+        self.received = 0
+        self.forwarded = 0
+        self.dropped_queue = 0  # 送信キューが満杯
+        self.dropped_inbox = 0  # inbox が満杯
+        self.dropped_route = 0  # 転送先が無い
+        self.errors = 0
+
+        self._transport = None
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._tasks = []
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _Protocol(self), local_addr=(self.host, self.port))
+        sock = self._transport.get_extra_info("socket")
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        except OSError:
+            pass
+        self.sockname = self._transport.get_extra_info("sockname")
+        return self
+
+    def connect(self, peer):
+        """開始済みの peer へのリンク（送信キューと送信タスク）を作る"""
+        queue = asyncio.Queue(self.queue_size)
+        self.links[peer.address] = queue
+        self.next_hop.setdefault(peer.address, peer.address)
+        self._tasks.append(asyncio.get_running_loop().create_task(self._sender(queue, peer.sockname)))
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        if self._transport is not None:
+            self._transport.close()
+
+    # --- 送信 ---
+    def _queue_for(self, destination):
+        hop = self.next_hop.get(wire.address_to_int(destination))
+        return self.links.get(hop) if hop is not None else None
+
+    async def send(self, packet):
+        """packet を宛先へ向かうリンクのキューに入れる（満杯なら空くまで待つ）"""
+        queue = self._queue_for(packet.destination)
+        if queue is None:
+            raise KeyError(f"{packet.destination} への経路がありません")
+        await queue.put(packet)
+
+    def send_nowait(self, packet):
+        queue = self._queue_for(packet.destination)
+        if queue is None:
+            self.dropped_route += 1
+        else:
+            try:
+                queue.put_nowait(packet)
+                return True
+            except asyncio.QueueFull:
+                self.dropped_queue += 1
+        if self.on_drop is not None:
+            self.on_drop(packet)
+        return False
+
+    async def _sender(self, queue, peer):
+        encoded_size = wire.encoded_size
+        carry = None
+        while True:
+            first = carry if carry is not None else await queue.get()
+            carry = None
+            if queue.qsize() < self.batch:
+                await asyncio.sleep(0)  # 同じループの周回で届く分も同じデータグラムに載せる
+            items = [first]
+            size = encoded_size(first)
+            while len(items) < self.batch and not queue.empty():
+                packet = queue.get_nowait()
+                n = encoded_size(packet)
+                if size + n > self.max_datagram:
+                    carry = packet  # 次のデータグラムの先頭にする
+                    break
+                items.append(packet)
+                size += n
+            if not self._writable.is_set():
+                await self._writable.wait()
+            self._transport.sendto(wire.encode_batch(items), peer)
+            self.sent_packets += len(items)
+            self.sent_datagrams += 1
+
+    # --- 受信 ---
+    async def recv(self):
+        return await self.inbox.get()
+
+    def _received(self, data):
+        try:
+            packets = wire.decode_batch(data)
+        except ValueError:
+            self.errors += 1
+            return
+        for packet in packets:
+            if packet.destination == self.address:
+                self.received += 1
+                if self.on_packet is not None:
+                    self.on_packet(packet)
+                    continue
+                try:
+                    self.inbox.put_nowait(packet)
+                except asyncio.QueueFull:
+                    self.dropped_inbox += 1
+                    if self.on_drop is not None:
+                        self.on_drop(packet)
+            else:
+                self.forwarded += 1
+                self.send_nowait(packet)
+
+    def stats(self):
+        return {k: getattr(self, k) for k in ("sent_packets", "sent_datagrams", "received", "forwarded",
+                                              "dropped_queue", "dropped_inbox", "dropped_route", "errors")}
+
+
+class LoopbackNetwork:
+    """Node のリストから Endpoint を作り、Node.links の通りにつないで最短経路の転送表を入れる"""
+
+    def __init__(self, nodes, **options):
+        self.nodes = list(nodes)
+        self.endpoints = [Endpoint(node, **options) for node in self.nodes]
+
+    async def start(self):
+        for endpoint in self.endpoints:
+            await endpoint.start()
+        index = {id(node): i for i, node in enumerate(self.nodes)}
+        for node, endpoint in zip(self.nodes, self.endpoints):
+            for link in node.links:
+                endpoint.connect(self.endpoints[index[id(link.dst)]])
+
+        topo = Topology.from_nodes(self.nodes)
+        router = Router(topo)
+        targets = topo.targets.tolist()
+        for d, dst in enumerate(self.endpoints):
+            table = router.tree(d)
+            for v, endpoint in enumerate(self.endpoints):
+                if v != d and table[v] >= 0:
+                    endpoint.next_hop[dst.address] = self.endpoints[targets[table[v]]].address
+        return self
+
+    def close(self):
+        for endpoint in self.endpoints:
+            endpoint.close()
+
+    def stats(self):
+        total = {}
+        for endpoint in self.endpoints:
+            for k, v in endpoint.stats().items():
+                total[k] = total.get(k, 0) + v
+        return total
+
+
+async def load_test(n_nodes=16, packets=50_000, size=64, batch=32, queue_size=256, window=512, seed=0,
+                    idle_timeout=1.0):
+    """輪につないだ n_nodes 台でランダムな宛先に packets 個送り、pps と遅延を測る
+
+    ペイロードの先頭8バイトに送信時刻（perf_counter_ns）を入れ、宛先で遅延を計算する。
+    ネットワーク内のパケットは window 個までに抑える（キュー待ちだけで遅延が膨らまないように）。
+    ソケットで失われたパケットは on_packet / on_drop のどちらも呼ばれず枠が戻らないので、
+    送信中も含めて idle_timeout 秒進みが無ければ送信を打ち切り、残りは消失として数える。
+    """
+    nodes = [Node(i, f"00:{i:04x}") for i in range(n_nodes)]
+    for i in range(n_nodes):
+        nodes[i].connect(nodes[(i + 1) % n_nodes])
+    net = await LoopbackNetwork(nodes, batch=batch, queue_size=queue_size).start()
+
+    latencies = []
+    unpack_from = struct.Struct("!Q").unpack_from
+    clock = time.perf_counter_ns
+
+    in_flight = asyncio.Semaphore(window)
+
+    def on_packet(packet):
+        latencies.append(clock() - unpack_from(packet.payload)[0])
+        in_flight.release()
+
+    def on_drop(packet):
+        in_flight.release()
+
+    for endpoint in net.endpoints:
+        endpoint.on_packet = on_packet
+        endpoint.on_drop = on_drop
+
+    rng = random.Random(seed)
+    pad = bytes(max(0, size - 8))
+    per_node = packets // n_nodes
+    sent = 0
+
+    async def produce(endpoint):
+        nonlocal sent
+        for k in range(per_node):
+            dst = rng.randrange(n_nodes - 1)
+            dst = nodes[dst if dst < endpoint.node.node_id else dst + 1].address
+            await in_flight.acquire()
+            await endpoint.send(Packet(endpoint.node.address, dst, struct.pack("!Q", clock()) + pad, packet_id=k))
+            sent += 1
+
+    total = per_node * n_nodes
+    started = time.perf_counter()
+    producers = asyncio.gather(*(produce(e) for e in net.endpoints))
+    last, last_change = -1, time.perf_counter()
+    while True:
+        s = net.stats()
+        # 壊れたデータグラム（errors）は中のパケット数が分からないので1件として数える
+        done = len(latencies) + s["dropped_queue"] + s["dropped_inbox"] + s["dropped_route"] + s["errors"]
+        if producers.done() and done >= sent:
+            break
+        if done != last:
+            last, last_change = done, time.perf_counter()
+        elif time.perf_counter() - last_change > idle_timeout:
+            break  # 残りはソケットで失われた（送信側は枠が戻らず止まっている）
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    producers.cancel()
+    try:
+        await producers
+    except asyncio.CancelledError:
+        pass
+    net.close()
+
+    s = net.stats()
+    latencies.sort()
+
+    def pct(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] / 1e3 if latencies else float("nan")
+
+    return {
+        "sent": sent,
+        "unsent": total - sent,
+        "delivered": len(latencies),
+        "lost": max(0, sent - len(latencies) - s["dropped_queue"] - s["dropped_inbox"] - s["dropped_route"]),
+        "elapsed": elapsed,
+        "pps": len(latencies) / elapsed,
+        "datagrams": s["sent_datagrams"],
+        "packets_per_datagram": s["sent_packets"] / max(1, s["sent_datagrams"]),
+        "latency_p50_us": pct(0.5),
+        "latency_p99_us": pct(0.99),
+        "latency_p999_us": pct(0.999),
+        **{k: s[k] for k in ("forwarded", "dropped_queue", "dropped_inbox", "dropped_route", "errors")},
+    }
+
+
+if __name__ == "__main__":
+    # python udp_transport.py [--nodes=16] [--packets=50000] [--size=64] [--batch=32] [--queue=256]
+    #                         [--window=512]
+    args = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    result = asyncio.run(load_test(int(args.get("nodes", 16)), int(args.get("packets", 50_000)),
+                                   int(args.get("size", 64)), int(args.get("batch", 32)),
+                                   int(args.get("queue", 256)), int(args.get("window", 512))))
+    print(f"送信 {result['sent']:,}（未送信 {result['unsent']:,}）/ 到着 {result['delivered']:,} / 消失 {result['lost']:,} "
+          f"/ 転送 {result['forwarded']:,} / {result['elapsed']:.2f}s = {result['pps']:,.0f} pps")
+    print(f"データグラム {result['datagrams']:,}（平均 {result['packets_per_datagram']:.1f} パケット）")
+    print(f"遅延 p50 {result['latency_p50_us']:.0f}us p99 {result['latency_p99_us']:.0f}us "
+          f"p99.9 {result['latency_p999_us']:.0f}us")
+    print(f"破棄 送信キュー {result['dropped_queue']:,} / inbox {result['dropped_inbox']:,} "
+          f"/ 経路なし {result['dropped_route']:,} / エラー {result['errors']:,}")
@@ -0,0 +1,188 @@
+import struct
+import time
+import zlib
+from functools import lru_cache
+
+from Packet import Packet
+
+# ヘッダー32バイト（ネットワークバイトオーダー）
+#   version(B) flags(B) reserved(H) source(Q) destination(Q) seq(I) length(I) crc32(I)
+# の直後に length バイトのペイロードが続く。crc32 はペイロードのチェックサム。
+HEADER = struct.Struct("!BBHQQIII")
+HEADER_SIZE = HEADER.size
+VERSION = 1
+FLAG_TEXT = 0x01  # ペイロードが UTF-8 の文字列だった（decode で str に戻す）
+ADDRESS_MAX = (1 << 64) - 1
+
+
+def address_to_int(address):
+    """アドレス（"00:01" のような16進をコロンで区切った文字列か整数）を64bit整数にする
+
+    64bit に収まらない・16進として読めないアドレスは ValueError。
+    """
+    if isinstance(address, int):
+        if not 0 <= address <= ADDRESS_MAX:
+            raise ValueError(f"アドレスが64bitに収まりません: {address}")
+        return address
+    if not isinstance(address, str):
+        raise ValueError(f"アドレスは16進の文字列か整数です: {address!r}")
+    return _parse_address(address)
+
+
+@lru_cache(maxsize=1 << 16)
+def _parse_address(address):
+    try:
+        value = int(address.replace(":", ""), 16)
+    except ValueError:
+        raise ValueError(f"アドレスを16進として読めません: {address!r}") from None
+    if value > ADDRESS_MAX:
+        raise ValueError(f"アドレスが64bitに収まりません: {address!r}")
+    return value
+
+
+def node_address(node):
+    """Node の wire 上のアドレス（address が無ければ node_id を使う）"""
+    return address_to_int(node.address if node.address is not None else node.node_id)
+
+
+def _payload_bytes(payload):
+    if isinstance(payload, str):
+        return payload.encode("utf-8"), FLAG_TEXT
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return payload, 0
+    raise TypeError(f"送れるペイロードは bytes 系か str だけです: {type(payload).__name__}")
+
+
+def encoded_size(packet):
+    return HEADER_SIZE + len(_payload_bytes(packet.payload)[0])
+
+
+def encode_into(buf, offset, packet, seq=None, flags=0):
+    """buf の offset に packet を書き込み、次の書き込み位置を返す"""
+    data, kind = _payload_bytes(packet.payload)
+    n = len(data)
+    end = offset + HEADER_SIZE + n
+    HEADER.pack_into(buf, offset, VERSION, flags | kind, 0,
+                     address_to_int(packet.source), address_to_int(packet.destination),
+                     (packet.packet_id if seq is None else seq) & 0xFFFFFFFF, n, zlib.crc32(data))
+    buf[offset + HEADER_SIZE:end] = data
+    return end
+
+
+def encode(packet, seq=None, flags=0):
+    data, _ = _payload_bytes(packet.payload)
+    buf = bytearray(HEADER_SIZE + len(data))
+    encode_into(buf, 0, packet, seq, flags)
+    return buf
+
+
+def decode(buf, offset=0, verify=True):
+    """buf の offset から1パケット読み、(Packet, 次の位置) を返す
+
+    ペイロードは buf の memoryview スライスで、コピーしない（buf を書き換えると変わる）。
+    ただし FLAG_TEXT 付きのペイロードは str にデコードする（こちらはコピーになる）。
+    送信元・宛先は整数、packet_id には seq が入る。壊れたデータは ValueError。
+    """
+    view = buf if isinstance(buf, memoryview) else memoryview(buf)
+    if len(view) - offset < HEADER_SIZE:
+        raise ValueError("ヘッダーの途中で切れています")
+    version, flags, _, src, dst, seq, n, crc = HEADER.unpack_from(view, offset)
+    if version != VERSION:
+        raise ValueError(f"未対応のバージョン {version}")
+    start = offset + HEADER_SIZE
+    end = start + n
+    if end > len(view):
+        raise ValueError("ペイロードの途中で切れています")
+    payload = view[start:end]
+    if verify and zlib.crc32(payload) != crc:
+        raise ValueError(f"チェックサムが合いません（seq {seq}）")
+    if flags & FLAG_TEXT:
+        payload = _text(payload, seq)
+    return Packet(src, dst, payload, n, seq), end
+
+
+def _text(payload, seq):
+    try:
+        return str(payload, "utf-8")
+    except UnicodeDecodeError:
+        raise ValueError(f"テキストのペイロードが UTF-8 ではありません（seq {seq}）") from None
+
+
+def flags_of(buf, offset=0):
+    return buf[offset + 1]
+
+
+def encode_batch(packets, seq_start=None):
+    """パケットを1つの連続したバッファ（ヘッダー+ペイロードの繰り返し）に詰める
+
+    seq_start を渡すとそこからの連番、省略時は各パケットの packet_id を seq にする。
+    """
+    items = [(p, *_payload_bytes(p.payload)) for p in packets]
+    buf = bytearray(sum(HEADER_SIZE + len(data) for _, data, _ in items))
+    pack_into = HEADER.pack_into
+    crc32 = zlib.crc32
+    offset = 0
+    for i, (p, data, kind) in enumerate(items):
+        n = len(data)
+        seq = p.packet_id if seq_start is None else seq_start + i
+        pack_into(buf, offset, VERSION, kind, 0, address_to_int(p.source), address_to_int(p.destination),
+                  seq & 0xFFFFFFFF, n, crc32(data))
+        offset += HEADER_SIZE
+        buf[offset:offset + n] = data
+        offset += n
+    return buf
+
+
+def decode_batch(buf, verify=True):
+    """encode_batch で詰めたバッファを Packet のリストに戻す（ペイロードは memoryview、FLAG_TEXT なら str）"""
+    view = buf if isinstance(buf, memoryview) else memoryview(buf)
+    unpack_from = HEADER.unpack_from
+    crc32 = zlib.crc32
+    total = len(view)
+    packets = []
+    append = packets.append
+    offset = 0
+    while offset < total:
+        if total - offset < HEADER_SIZE:
+            raise ValueError("ヘッダーの途中で切れています")
+        version, flags, _, src, dst, seq, n, crc = unpack_from(view, offset)
+        if version != VERSION:
+            raise ValueError(f"未対応のバージョン {version}")
+        offset += HEADER_SIZE
+        payload = view[offset:offset + n]
+        offset += n
+        if offset > total:
+            raise ValueError("ペイロードの途中で切れています")
+        if verify and crc32(payload) != crc:
+            raise ValueError(f"チェックサムが合いません（seq {seq}）")
+        if flags & FLAG_TEXT:
+            payload = _text(payload, seq)
+        append(Packet(src, dst, payload, n, seq))
+    return packets
+
+
+if __name__ == "__main__":
+    import os
+
+    count = 10_000
+    for size in (64, 1024, 9000):
+        packets = [Packet(f"00:{i % 64:04x}", f"00:{(i * 7) % 64:04x}", os.urandom(size), packet_id=i)
+                   for i in range(count)]
+        rounds = max(1, 200_000_000 // (count * size))
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            buf = encode_batch(packets)
+        enc = (time.perf_counter() - started) / rounds
+        results = []
+        for verify in (True, False):
+            started = time.perf_counter()
+            for _ in range(rounds):
+                decoded = decode_batch(buf, verify)
+            results.append((time.perf_counter() - started) / rounds)
+        assert all(bytes(d.payload) == p.payload for d, p in zip(decoded, packets))
+
+        gb = len(buf) / 1e9
+        print(f"ペイロード {size:>5}B x {count:,}: encode {gb / enc:5.2f} GB/s ({count / enc / 1e6:.2f} Mpps)  "
+              f"decode {gb / results[0]:5.2f} GB/s ({count / results[0] / 1e6:.2f} Mpps)  "
+              f"CRC 検査なし {gb / results[1]:6.2f} GB/s ({count / results[1] / 1e6:.2f} Mpps)")
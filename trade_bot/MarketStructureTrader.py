@@ -1,12 +1,20 @@
-import MetaTrader5 as mt5
-import pandas as pd
+from lazy_modules import mt5, pd, TIMEFRAME_M15
 import numpy as np
 from datetime import datetime, timedelta
 import time
 from collections import deque
+from symbol_cache import default_cache
+from perf_timer import timer
+from order_log import order_log, KIND_OPEN, KIND_CLOSE
+from async_log import get_logger
+from position_tracker import PositionTracker
+from risk_aggregator import connect_risk
+import state_snapshot
+
+log = get_logger("MarketStructure")
 
 class MarketStructureTrader:
-    def __init__(self, symbol="USDJPY", timeframe=mt5.TIMEFRAME_M15, lot_size=0.1):
+    def __init__(self, symbol="USDJPY", timeframe=TIMEFRAME_M15, lot_size=0.1):
         self.symbol = symbol
         self.timeframe = timeframe
         self.lot_size = lot_size
@@ -30,6 +38,19 @@ class MarketStructureTrader:
         # Signals
         self.is_price_efficient = False
         
+        # SL/TP用の直近ボラティリティ（シグナル計算時に更新）
+        self.volatility = None
+        self.volatility_period = 20
+        
+        self.symbols = default_cache
+        self.tracker = None  # run() で PositionTracker を設定
+        self.risk = None     # run() で口座全体のリスク集計を設定
+        
+        # 再起動時に構造（ピボット・TLQ/ILQ・方向）を引き継ぐためのスナップショット
+        self.snapshots = state_snapshot.Snapshotter(
+            state_snapshot.snapshot_path("marketstructure", symbol, timeframe))
+        self._pending_state = None
+        
     def initialize_mt5(self):
         """MT5への接続"""
         if not mt5.initialize():
@@ -42,7 +63,7 @@ class MarketStructureTrader:
         """価格データを取得"""
         rates = mt5.copy_rates_from_pos(self.symbol, self.timeframe, 0, count)
         if rates is None:
-            print("価格データの取得に失敗しました")
+            log.warning("価格データの取得に失敗しました")
             return None
         
         df = pd.DataFrame(rates)
@@ -107,7 +128,7 @@ class MarketStructureTrader:
                 bos_signal = "BEARISH_BOS"
                 self.structure_direction = "bearish"
                 self.last_bos_time = datetime.now()
-                print(f"🔴 Bearish BOS検出: {current_price} < {self.bottom_tlq_price}")
+                log.info("🔴 Bearish BOS検出: {price} < {level}", price=current_price, level=self.bottom_tlq_price)
         
         # Bullish BOS: 上のTLQを上抜け
         if self.top_tlq_price and current_price > self.top_tlq_price:
@@ -115,7 +136,7 @@ class MarketStructureTrader:
                 bos_signal = "BULLISH_BOS"
                 self.structure_direction = "bullish"
                 self.last_bos_time = datetime.now()
-                print(f"🟢 Bullish BOS検出: {current_price} > {self.top_tlq_price}")
+                log.info("🟢 Bullish BOS検出: {price} > {level}", price=current_price, level=self.top_tlq_price)
         
         return bos_signal
     
@@ -178,8 +199,12 @@ class MarketStructureTrader:
         current_high = df.iloc[-1]['high']
         current_low = df.iloc[-1]['low']
         
+        # 簡易的なATR代替：直近のボラティリティ（SL/TPで再利用）
+        self.volatility = (df['high'] - df['low']).tail(self.volatility_period).mean()
+        
         # Market Structure更新
-        df = self.update_market_structure(df)
+        with timer.stage("indicator.swing_points"):
+            df = self.update_market_structure(df)
         self.update_liquidity_levels()
         
         # BOS検出
@@ -224,31 +249,28 @@ class MarketStructureTrader:
                 reason.append("ILQ Retest (Bearish)")
         
         if signal:
-            print(f"\n{'='*60}")
-            print(f"🎯 {signal}シグナル検出!")
-            print(f"理由: {', '.join(reason)}")
-            print(f"構造方向: {self.structure_direction}")
-            print(f"現在価格: {current_price}")
-            if self.bottom_ilq_price:
-                print(f"Bottom ILQ: {self.bottom_ilq_price}")
-            if self.top_ilq_price:
-                print(f"Top ILQ: {self.top_ilq_price}")
-            print(f"{'='*60}\n")
+            log.info(
+                "\n{rule}\n🎯 {signal}シグナル検出!\n理由: {reason}\n構造方向: {direction}\n"
+                "現在価格: {price}\nBottom ILQ: {bottom_ilq}\nTop ILQ: {top_ilq}\n{rule}\n",
+                rule='=' * 60, signal=signal, reason=', '.join(reason),
+                direction=self.structure_direction, price=current_price,
+                bottom_ilq=self.bottom_ilq_price, top_ilq=self.top_ilq_price,
+            )
         
         return signal
     
-    def calculate_sl_tp(self, order_type, entry_price):
+    def calculate_sl_tp(self, order_type, entry_price, atr=None):
         """ストップロスとテイクプロフィットの計算"""
-        symbol_info = mt5.symbol_info(self.symbol)
-        point = symbol_info.point
-        
         # ATRベースのSL/TP計算（簡略版）
         atr_multiplier_sl = 1.5
         atr_multiplier_tp = 3.0
         
-        # 簡易的なATR代替：直近のボラティリティ
-        df = self.get_rates(count=20)
-        atr = (df['high'] - df['low']).mean()
+        # シグナル計算時のボラティリティを再利用し、無ければ取得する
+        if atr is None:
+            atr = self.volatility
+        if atr is None:
+            df = self.get_rates(count=self.volatility_period)
+            atr = (df['high'] - df['low']).mean()
         
         if order_type == mt5.ORDER_TYPE_BUY:
             sl = entry_price - (atr * atr_multiplier_sl)
@@ -259,27 +281,61 @@ class MarketStructureTrader:
         
         return sl, tp
     
-    def open_position(self, order_type):
-        """ポジションを開く"""
-        symbol_info = mt5.symbol_info(self.symbol)
+    def _send(self, request, kind, tick, bar_time=None, decided_ns=None):
+        """order_send して結果を発注ログに記録"""
+        sent_ns = time.time_ns()
+        with timer.stage("order_send"):
+            result = mt5.order_send(request)
+        done_ns = time.time_ns()
+        
+        info = self.symbols.info(self.symbol)
+        order_log.append(
+            self.symbol, "MarketStruct", 1 if request["type"] == mt5.ORDER_TYPE_BUY else -1, kind,
+            bar_time, tick.time_msc, decided_ns, sent_ns, done_ns,
+            request["price"], result.price if result else 0.0, request["deviation"],
+            request["type_filling"], result.retcode if result else -1,
+            info.point if info else 0.0, request["volume"], result.order if result else 0,
+        )
+        return result
+    
+    def open_position(self, order_type, bar_time=None, decided_ns=None):
+        """ポジションを開く（bar_time: シグナル元バーの時刻 epoch秒）"""
+        symbol_info = self.symbols.info(self.symbol)
         if symbol_info is None:
-            print(f"{self.symbol}が見つかりません")
+            log.warning("{symbol}が見つかりません", symbol=self.symbol)
             return False
         
-        if not symbol_info.visible:
-            if not mt5.symbol_select(self.symbol, True):
-                print(f"{self.symbol}の選択に失敗しました")
-                return False
+        if not self.symbols.ensure_selected(self.symbol):
+            log.warning("{symbol}の選択に失敗しました", symbol=self.symbol)
+            return False
         
-        tick = mt5.symbol_info_tick(self.symbol)
+        tick = self.symbols.tick(self.symbol)
+        if tick is None:
+            log.warning("価格の取得に失敗しました")
+            return False
         price = tick.ask if order_type == mt5.ORDER_TYPE_BUY else tick.bid
         
+        lots = self.lot_size
+        if self.risk is not None:
+            side = 1 if order_type == mt5.ORDER_TYPE_BUY else -1
+            self.risk.update_price(self.symbol, tick.bid, tick.ask)
+            ok, reason = self.risk.can_open(self.magic_number, self.symbol, side, lots)
+            if not ok:
+                log.warning("リスク制限で見送り: {reason}", reason=reason)
+                return False
+            # 相関の高い他銘柄の建玉と同じ向きなら縮小（重なりが大きければ見送り）
+            lots = self.risk.adjust_lots(self.magic_number, self.symbol, side, lots)
+            lots = round(round(lots / symbol_info.volume_step) * symbol_info.volume_step, 8)
+            if lots < symbol_info.volume_min:
+                log.warning("相関のある建玉と重なるため見送り")
+                return False
+        
         sl, tp = self.calculate_sl_tp(order_type, price)
         
         request = {
             "action": mt5.TRADE_ACTION_DEAL,
             "symbol": self.symbol,
-            "volume": self.lot_size,
+            "volume": lots,
             "type": order_type,
             "price": price,
             "sl": sl,
@@ -291,24 +347,36 @@ class MarketStructureTrader:
             "type_filling": mt5.ORDER_FILLING_IOC,
         }
         
-        result = mt5.order_send(request)
+        result = self._send(request, KIND_OPEN, tick, bar_time, decided_ns)
+        if result is None:
+            log.error("❌ 注文失敗: {error}", error=mt5.last_error())
+            return False
         
         if result.retcode != mt5.TRADE_RETCODE_DONE:
-            print(f"❌ 注文失敗: {result.retcode} - {result.comment}")
+            log.error("❌ 注文失敗: {retcode} - {comment}", retcode=result.retcode, comment=result.comment)
             return False
         
         order_type_str = "買い" if order_type == mt5.ORDER_TYPE_BUY else "売り"
-        print(f"✅ {order_type_str}注文成功: 価格={price:.5f}, SL={sl:.5f}, TP={tp:.5f}")
+        log.info("✅ {side}注文成功: 価格={price:.5f}, SL={sl:.5f}, TP={tp:.5f}",
+                 side=order_type_str, price=price, sl=sl, tp=tp)
         return True
     
     def check_positions(self):
-        """現在のポジションを確認"""
+        """現在のポジションを確認（ノーポジ判定はトラッカーで済ませる）"""
+        if self.tracker is not None:
+            self.tracker.poll()
+            if self.tracker.count(self.symbol, self.magic_number) == 0:
+                return []
+        # 損益表示のため、保有中のときだけ端末から取得
         positions = mt5.positions_get(symbol=self.symbol, magic=self.magic_number)
         return positions if positions else []
     
     def close_position(self, position):
         """ポジションを閉じる"""
-        tick = mt5.symbol_info_tick(self.symbol)
+        tick = self.symbols.tick(self.symbol)
+        if tick is None:
+            log.warning("価格の取得に失敗しました")
+            return False
         
         request = {
             "action": mt5.TRADE_ACTION_DEAL,
@@ -324,20 +392,137 @@ class MarketStructureTrader:
             "type_filling": mt5.ORDER_FILLING_IOC,
         }
         
-        result = mt5.order_send(request)
+        result = self._send(request, KIND_CLOSE, tick)
+        if result is None:
+            log.error("ポジション決済失敗: {error}", error=mt5.last_error())
+            return False
         
         if result.retcode != mt5.TRADE_RETCODE_DONE:
-            print(f"ポジション決済失敗: {result.retcode}")
+            log.error("ポジション決済失敗: {retcode}", retcode=result.retcode)
+            return False
+        
+        log.info("✅ ポジション決済成功: #{ticket}", ticket=position.ticket)
+        return True
+    
+    def save_state(self, df):
+        """ピボット・流動性レベル・構造方向と、照合用の最終確定バーを保存"""
+        last = df.iloc[-2]  # [-1] は形成中
+        epoch = lambda ts: int(pd.Timestamp(ts).timestamp())
+        meta = {
+            "strategy": "marketstructure", "symbol": self.symbol, "timeframe": self.timeframe,
+            "last_bar": [epoch(last['time']), float(last['close'])],
+            "pivot_highs": [float(v) for v in self.pivot_highs],
+            "pivot_lows": [float(v) for v in self.pivot_lows],
+            "pivot_high_times": [epoch(t) for t in self.pivot_high_times],
+            "pivot_low_times": [epoch(t) for t in self.pivot_low_times],
+            "structure_direction": self.structure_direction,
+            "last_bos_time": self.last_bos_time.timestamp() if self.last_bos_time else None,
+            "bottom_tlq_price": self.bottom_tlq_price, "top_tlq_price": self.top_tlq_price,
+            "bottom_ilq_price": self.bottom_ilq_price, "top_ilq_price": self.top_ilq_price,
+        }
+        return self.snapshots.save(meta)
+    
+    def restore_state(self):
+        """スナップショットを読み込む（反映は最初のバーで照合してから）"""
+        loaded = self.snapshots.load()
+        if loaded is None:
+            return False
+        meta, _ = loaded
+        if meta.get("symbol") != self.symbol or meta.get("timeframe") != self.timeframe:
+            log.warning("スナップショットのシンボル/時間足が違うため破棄")
+            return False
+        self._pending_state = meta
+        return True
+    
+    def _apply_state(self, df):
+        """保存時の最終確定バーが最新データに同じ値で含まれていれば構造を復元"""
+        meta, self._pending_state = self._pending_state, None
+        bar_time, bar_close = meta["last_bar"]
+        closed = df.iloc[:-1]
+        match = closed[closed['time'] == pd.to_datetime(bar_time, unit='s')]
+        if match.empty or not np.isclose(match['close'].iloc[0], bar_close):
+            log.warning("スナップショットが最新データと一致しないため破棄（最終バー {t}）",
+                        t=pd.to_datetime(bar_time, unit='s'))
             return False
         
-        print(f"✅ ポジション決済成功: #{position.ticket}")
+        self.pivot_highs.extend(meta["pivot_highs"])
+        self.pivot_lows.extend(meta["pivot_lows"])
+        self.pivot_high_times.extend(pd.to_datetime(meta["pivot_high_times"], unit='s'))
+        self.pivot_low_times.extend(pd.to_datetime(meta["pivot_low_times"], unit='s'))
+        self.structure_direction = meta["structure_direction"]
+        self.last_bos_time = datetime.fromtimestamp(meta["last_bos_time"]) if meta["last_bos_time"] else None
+        self.bottom_tlq_price = meta["bottom_tlq_price"]
+        self.top_tlq_price = meta["top_tlq_price"]
+        self.bottom_ilq_price = meta["bottom_ilq_price"]
+        self.top_ilq_price = meta["top_ilq_price"]
+        log.info("スナップショット復元: 構造 {direction}, ピボット 高{nh}/安{nl}",
+                 direction=self.structure_direction, nh=len(self.pivot_highs), nl=len(self.pivot_lows))
         return True
     
+    def process_bars(self, df):
+        """シグナル生成からエントリー・ポジション表示までの1サイクル"""
+        if self._pending_state is not None:
+            self._apply_state(df)
+        
+        # シグナル生成
+        with timer.stage("generate_signal"):
+            signal = self.generate_trading_signal(df)
+        decided_ns = time.time_ns()
+        bar_time = int(df['time'].iloc[-1].timestamp())
+        
+        # 現在のポジション確認
+        with timer.stage("check_positions"):
+            positions = self.check_positions()
+        
+        # エントリー判定
+        if signal == 'BUY' and len(positions) == 0:
+            self.open_position(mt5.ORDER_TYPE_BUY, bar_time, decided_ns)
+            
+        elif signal == 'SELL' and len(positions) == 0:
+            self.open_position(mt5.ORDER_TYPE_SELL, bar_time, decided_ns)
+        
+        # ポジション状況表示
+        if len(positions) > 0:
+            for pos in positions:
+                pnl = pos.profit
+                pos_type = "買い" if pos.type == mt5.ORDER_TYPE_BUY else "売り"
+                log.info("保有中: {side} | 損益: {pnl:.2f} | チケット: #{ticket}",
+                         side=pos_type, pnl=pnl, ticket=pos.ticket)
+        
+        # 構造が変わり得るシグナル時と、一定間隔でスナップショット
+        if signal or self.snapshots.due():
+            self.save_state(df)
+    
+    def run_stream(self):
+        """ティックからバーを組み立て、バー確定の瞬間に判定するメインループ"""
+        if not self.initialize_mt5():
+            return
+        
+        self.tracker = PositionTracker()  # 他ボットの建玉もリスク集計に使うので全マジック
+        self.tracker.start()
+        self.risk = connect_risk(self.tracker)
+        self.restore_state()
+        
+        from tick_bars import stream_strategy
+        
+        print(f"ストリームモード: {self.symbol} / 時間足 {self.timeframe}")
+        try:
+            stream_strategy(self, self.process_bars)
+        except KeyboardInterrupt:
+            print("\n自動売買を停止します...")
+        finally:
+            mt5.shutdown()
+    
     def run(self, check_interval=60):
         """メインループ"""
         if not self.initialize_mt5():
             return
         
+        self.tracker = PositionTracker()  # 他ボットの建玉もリスク集計に使うので全マジック
+        self.tracker.start()
+        self.risk = connect_risk(self.tracker)
+        self.restore_state()
+        
         print(f"\n{'='*60}")
         print(f"Market Structure自動売買開始")
         print(f"通貨ペア: {self.symbol}")
@@ -347,31 +532,17 @@ class MarketStructureTrader:
         
         try:
             while True:
+                timer.maybe_dump()
+                
                 # 価格データ取得
-                df = self.get_rates()
+                with timer.stage("get_rates"):
+                    df = self.get_rates()
                 if df is None:
                     time.sleep(check_interval)
                     continue
                 
-                # シグナル生成
-                signal = self.generate_trading_signal(df)
-                
-                # 現在のポジション確認
-                positions = self.check_positions()
-                
-                # エントリー判定
-                if signal == 'BUY' and len(positions) == 0:
-                    self.open_position(mt5.ORDER_TYPE_BUY)
-                    
-                elif signal == 'SELL' and len(positions) == 0:
-                    self.open_position(mt5.ORDER_TYPE_SELL)
-                
-                # ポジション状況表示
-                if len(positions) > 0:
-                    for pos in positions:
-                        pnl = pos.profit
-                        pos_type = "買い" if pos.type == mt5.ORDER_TYPE_BUY else "売り"
-                        print(f"保有中: {pos_type} | 損益: {pnl:.2f} | チケット: #{pos.ticket}")
+                with timer.stage("process_bars"):
+                    self.process_bars(df)
                 
                 # 待機
                 time.sleep(check_interval)
@@ -379,6 +550,9 @@ class MarketStructureTrader:
         except KeyboardInterrupt:
             print("\n自動売買を停止します...")
         finally:
+            if timer.enabled:
+                timer.dump()
+            log.close()
             mt5.shutdown()
 
 
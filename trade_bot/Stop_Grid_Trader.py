@@ -1,15 +1,12 @@
-import tkinter as tk
-from tkinter import messagebox, ttk
 import threading, time, sys
-import MetaTrader5 as mt5
-import numpy as np
 from datetime import datetime 
-
-# psutil = None でスキップするなら手動で使いたいMT5のパスを入力する処理書かないと、、
-try: 
-    import psutil
-except ImportError:
-    psutil = None
+from lazy_modules import mt5, available
+from batch_orders import BatchOrderSubmitter
+from grid_book import GridBook
+from spread_stats import RollingSpreadStats
+from terminal_probe import probe_terminals, pick_headless
+from position_tracker import PositionTracker
+from risk_aggregator import connect_risk
 
 # constants
 DEF_SYMBOL = "BTCUSD"
@@ -27,11 +24,14 @@ DEVIATION = 100 # points
 MAGIC_NUMBER = 1234 # unique identifier for this bot's order
 GRID_TAG = "enhanced grid" # order tag
 CHECK_INTERVAL = 1.0 # sec
+RETRY_MAX_INTERVAL = 60.0 # sec 再グリッドで何も置けなかったときの待ち時間の上限
 
 # 
 def _discover_terminals() -> list[str]:
+    # psutil が無いならスキップ。手動で使いたいMT5のパスを入力する処理書かないと、、
     paths = []
-    if psutil:
+    if available("psutil"):
+        import psutil # 端末探索のときだけ読む（バックテストやワーカーでは不要）
         for p in psutil.process_iter(attr=["name", "exe"]):
             if "terminal64.exe" in (p.info.get("name") or "").lower(): # name = p.name()だと遅いしps止まったりするとエラーになる。info.get()だとpsutilが内部的にinfo_dict = p.name()みたいな処理して
                exe = p.info.get("exe") or "" # except節でinfo_dict["name"] = None　みたいにエラーも処理してくれてる
@@ -39,10 +39,207 @@ def _discover_terminals() -> list[str]:
                    paths.append(exe)
     return paths
 
-def choose_terminal() -> str | None:
+def choose_terminal(rows: list[dict] | None = None) -> str | None:
+    if rows is None:
+        rows = probe_terminals(_discover_terminals())
+    import tkinter as tk # GUIはここでだけ使うので遅延import（--headless や他モジュールからの利用で読まない）
+    from tkinter import messagebox, ttk
     root = tk.Tk(); root.withdraw() 
     win  = tk.Toplevel(root); win.title("Choose MT5 Terminal"); win.grab_set() # モーダルにする
-    cols = ("exe", "login" "server", "balance", "currency", "name")
+    cols = ("exe", "login", "server", "balance", "currency", "name")
     tree = ttk.Treeview(win, columns=cols, show="headings", height=8)
-    for c, w in zip(cols, (300, 100, 150, 100, 200)):
-        tree.heading(c, text=c.title()); tree.column(c, width=w, anchor="w")
\ No newline at end of file
+    for c, w in zip(cols, (300, 100, 150, 100, 80, 200)):
+        tree.heading(c, text=c.title()); tree.column(c, width=w, anchor="w")
+    for r in rows:
+        values = [r.get(c, "") for c in cols]
+        if "login" not in r: values[1] = r.get("error", "") # 接続できなかった端末は理由を表示
+        tree.insert("", "end", iid=r["exe"], values=values)
+    tree.pack(fill="both", expand=True, padx=8, pady=8)
+
+    chosen = {"exe": None}
+    def ok(_=None):
+        sel = tree.selection()
+        if not sel:
+            messagebox.showwarning("MT5", "端末を選択してください", parent=win); return
+        chosen["exe"] = sel[0]; root.destroy()
+    tree.bind("<Double-1>", ok)
+    ttk.Button(win, text="OK", command=ok).pack(pady=(0, 8))
+    win.protocol("WM_DELETE_WINDOW", root.destroy)
+    root.mainloop()
+    return chosen["exe"]
+
+def select_terminal(headless=False, login=None, server=None) -> str | None:
+    """端末探索 → 口座情報（キャッシュ/並列取得） → 選択。headless なら Tk を使わない"""
+    exes = _discover_terminals()
+    if not exes:
+        print("起動中のMT5端末が見つかりません")
+        return None
+    if headless and len(exes) == 1 and login is None and server is None:
+        return exes[0] # 1台だけなら接続確認もしない
+    rows = probe_terminals(exes)
+    if headless:
+        return pick_headless(rows, login, server)
+    return choose_terminal(rows)
+
+# grid
+def _pending_request(symbol, order_type, price, lots=DEF_LOTS, digits=DEF_DIGITS) -> dict:
+    return {
+        "action": mt5.TRADE_ACTION_PENDING,
+        "symbol": symbol,
+        "volume": lots,
+        "type": order_type,
+        "price": round(price, digits),
+        "deviation": DEVIATION,
+        "magic": MAGIC_NUMBER,
+        "comment": GRID_TAG,
+        "type_time": mt5.ORDER_TIME_GTC,
+        "type_filling": mt5.ORDER_FILLING_RETURN,
+    }
+
+def grid_levels(bid, ask, step, orders_side=DEF_ORDERS_SIDE, digits=DEF_DIGITS):
+    """買い逆指値は ask の上、売り逆指値は bid の下に step 間隔で並べる"""
+    buys = [round(ask + step * i, digits) for i in range(1, orders_side + 1)]
+    sells = [round(bid - step * i, digits) for i in range(1, orders_side + 1)]
+    return buys, sells
+
+def grid_step(bid, ask, multiplier=DEF_MULTIPLIER, stats=None, point=10 ** -DEF_DIGITS):
+    """グリッド間隔 = multiplier × スプレッド
+
+    DEF_USE_DYNAMIC のときは瞬間値ではなく直近スプレッドのp90を使う（ノイズ対策）。
+    """
+    spread = ask - bid
+    if DEF_USE_DYNAMIC and stats is not None and stats.count >= 100:
+        spread = max(stats.quantile(0.9), stats.ewma) * stats.point
+    return max(spread, point) * multiplier
+
+def sync_book(book: GridBook, symbol=DEF_SYMBOL) -> GridBook:
+    """端末の注文一覧から板を作り直す（起動時と定期的な再同期のみ）"""
+    book.load(mt5.orders_get(symbol=symbol), mt5.ORDER_TYPE_BUY_STOP, mt5.ORDER_TYPE_SELL_STOP)
+    return book
+
+def regrid(book: GridBook, symbol, bid, ask, step, submitter=None, risk=None):
+    """間隔や価格が動いたレベルだけ取消・追加して板を更新
+
+    risk を渡すと、追加分が全部約定した場合の建玉で口座全体の上限を確認し、
+    超える側の追加は見送る（取消は常に行う）。
+    返り値は実際に置けた注文の数。
+    """
+    buys, sells = grid_levels(bid, ask, step)
+    cancel, add_buys, add_sells = book.diff(buys, sells, tol=step * 0.25)
+    if risk is not None:
+        risk.update_price(symbol, bid, ask)
+        for side, adds in ((1, add_buys), (-1, add_sells)):
+            if not adds:
+                continue
+            ok, reason = risk.can_open(MAGIC_NUMBER, symbol, side, DEF_LOTS * len(adds))
+            if not ok:
+                print(f"リスク制限で{'買い' if side > 0 else '売り'}側の追加を見送り: {reason}")
+                adds.clear()
+
+    requests = [{"action": mt5.TRADE_ACTION_REMOVE, "order": t, "symbol": symbol}
+                for t in cancel]
+    sides = [None] * len(cancel)
+    for price in add_buys:
+        requests.append(_pending_request(symbol, mt5.ORDER_TYPE_BUY_STOP, price))
+        sides.append("BUY")
+    for price in add_sells:
+        requests.append(_pending_request(symbol, mt5.ORDER_TYPE_SELL_STOP, price))
+        sides.append("SELL")
+    if not requests:
+        return 0
+
+    submitter = submitter or BatchOrderSubmitter(deviation=DEVIATION)
+    reports = submitter.submit(requests)
+    submitter.print_report(reports)
+    added = 0
+    for rep, req, side in zip(reports, requests, sides):
+        if rep.retcode not in (mt5.TRADE_RETCODE_DONE, mt5.TRADE_RETCODE_PLACED):
+            # 取消に失敗しても、注文がもう無い（約定済みなど）なら板から外す
+            if side is None and not mt5.orders_get(ticket=req["order"]):
+                book.remove(req["order"])
+            continue
+        if side is None:
+            book.remove(req["order"])
+        else:
+            book.add(side, req["price"], rep.order)
+            added += 1
+    print(f"再グリッド: 取消{len(cancel)}件 / 追加{added}/{len(add_buys) + len(add_sells)}件")
+    return added
+
+def watch_grid(symbol=DEF_SYMBOL, loops=DEF_LOOP, multiplier=DEF_MULTIPLIER):
+    """CHECK_INTERVAL ごとに約定を監視し、どちらかが約定したら間隔を更新して再グリッド"""
+    info = mt5.symbol_info(symbol)
+    if info is None:
+        print(f"{symbol}が見つかりません")
+        return
+    # ヒストグラムは現在のスプレッドの20倍まで（超えた分も溢れリストで正確に扱われる）
+    stats = RollingSpreadStats(info.point, max_spread_points=max(5000, info.spread * 20))
+    book = sync_book(GridBook(MAGIC_NUMBER, GRID_TAG), symbol)
+    submitter = BatchOrderSubmitter(deviation=DEVIATION)
+
+    # 約定履歴から直接フィルを拾う（価格での判定より確実で、スリップした約定も漏らさない）
+    filled = []
+    # 他ボットの建玉も含めて DEF_MAX_RISK を口座全体で見るため全マジックを追跡
+    tracker = PositionTracker(reconcile_interval=30.0)
+    def on_event(event, data):
+        if event == "fill" and data.entry == mt5.DEAL_ENTRY_IN and book.remove(data.order):
+            filled.append(data.order)
+    tracker.subscribe(on_event)
+    tracker.start()
+    risk = connect_risk(tracker, max_loss_pct=DEF_MAX_RISK)
+
+    last_msc = 0
+    loop = 0
+    failures = 0 # 続けて何も置けなかった回数
+    retry_at = 0.0
+    while loop < loops:
+        tick = mt5.symbol_info_tick(symbol)
+        if tick is None:
+            time.sleep(CHECK_INTERVAL)
+            continue
+        if tick.time_msc != last_msc:
+            stats.update(tick.bid, tick.ask)
+            last_msc = tick.time_msc
+
+        tracker.poll()
+        hit = bool(filled) | bool(check_fills(book, tick.bid, tick.ask))
+        filled.clear()
+        if hit or (not len(book) and time.monotonic() >= retry_at):
+            step = grid_step(tick.bid, tick.ask, multiplier, stats, info.point)
+            snap = stats.snapshot()
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] LOOP {loop + 1}/{loops} 間隔={step:.{DEF_DIGITS}f} "
+                  f"(spread last={snap['last']} p90={snap['p90']} ewma={snap['ewma']:.1f}pt)")
+            if regrid(book, symbol, tick.bid, tick.ask, step, submitter, risk):
+                loop += 1 # 注文を置けたときだけ1ループと数える
+                failures = 0
+            else:
+                # リスク制限や発注失敗で何も置けなかった → 間隔を倍々に空けて再試行
+                failures += 1
+                wait = min(CHECK_INTERVAL * 2 ** failures, RETRY_MAX_INTERVAL)
+                retry_at = time.monotonic() + wait
+                print(f"注文を置けませんでした（{failures}回連続）→ {wait:.0f}秒後に再試行")
+        time.sleep(CHECK_INTERVAL)
+
+def check_fills(book: GridBook, bid, ask) -> list:
+    """約定したレベルを板から外して返す（ヒットが無ければ O(1)）"""
+    if not book.any_filled(bid, ask):
+        return []
+    hits = book.filled(bid, ask)
+    for ticket, _, _ in hits:
+        book.remove(ticket)
+    return hits
+
+if __name__ == "__main__":
+    # --headless: Tkを使わずに端末を選ぶ（--login=12345 / --server=Xxx-Demo で指定）
+    args = dict(a[2:].split("=", 1) if "=" in a else (a[2:], True) for a in sys.argv[1:] if a.startswith("--"))
+    exe = select_terminal(headless=bool(args.get("headless")), login=args.get("login"), server=args.get("server"))
+    if exe is None:
+        sys.exit("MT5端末が選択されませんでした")
+    if not mt5.initialize(path=exe):
+        sys.exit(f"MT5初期化失敗: {mt5.last_error()}")
+    try:
+        watch_grid()
+    except KeyboardInterrupt:
+        print("\n停止しました")
+    finally:
+        mt5.shutdown()
@@ -0,0 +1,142 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+_LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARN", ERROR: "ERROR"}
+
+
+class AsyncLogger:
+    """キュー + 書き込みスレッドの非同期ロガー
+
+    呼び出し側はレベル判定とキューへの put だけを行い、文字列の整形と
+    stdout / ファイルへの書き込みはバックグラウンドスレッドで行う。
+    キューが溢れたら待たずに捨てて件数だけ数える（売買スレッドを止めない）。
+    書き込みスレッドは最初にログを出すときに起動する（import しただけでは動かない）。
+
+        log.info("発注 {side} @ {price}", side="BUY", price=150.12)
+    """
+
+    def __init__(self, name="bot", level=INFO, stream=None, path=None, json_lines=False,
+                 maxsize=10000):
+        self.name = name
+        self.level = level
+        self.stream = stream if stream is not None else sys.stdout
+        self.path = path
+        self.json_lines = json_lines
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._writer, name=f"{self.name}-log", daemon=True)
+                thread.start()
+                atexit.register(self.close)
+                self._thread = thread
+
+    def enabled_for(self, level):
+        return level >= self.level
+
+    def log(self, level, msg, **fields):
+        if level < self.level:
+            return
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((time.time(), level, msg, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, msg, **fields):
+        if DEBUG >= self.level:
+            self.log(DEBUG, msg, **fields)
+
+    def info(self, msg, **fields):
+        if INFO >= self.level:
+            self.log(INFO, msg, **fields)
+
+    def warning(self, msg, **fields):
+        self.log(WARNING, msg, **fields)
+
+    def error(self, msg, **fields):
+        self.log(ERROR, msg, **fields)
+
+    def _format(self, ts, level, msg, fields):
+        if self.json_lines:
+            rec = {"ts": ts, "level": _LEVEL_NAMES.get(level, level), "name": self.name, "msg": msg}
+            rec.update(fields)
+            return json.dumps(rec, ensure_ascii=False, default=str)
+        try:
+            text = msg.format(**fields) if fields else msg
+        except (KeyError, IndexError, ValueError):
+            text = f"{msg} {fields}"
+        stamp = time.strftime("%H:%M:%S", time.localtime(ts))
+        return f"[{stamp}] {text}"
+
+    def _writer(self):
+        out = open(self.path, "a", encoding="utf-8") if self.path else self.stream
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            lines = [self._format(*item)]
+            # 溜まっている分はまとめて書く
+            stop = False
+            while len(lines) < 512:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                lines.append(self._format(*item))
+            try:
+                out.write("\n".join(lines) + "\n")
+                out.flush()
+            except (OSError, ValueError):
+                pass
+            if stop:
+                break
+        if self.path:
+            out.close()
+
+    def close(self, timeout=2.0):
+        """残りを書き出して停止"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        if self.dropped:
+            self.log(WARNING, "ログ {n}件を破棄しました（キュー満杯）", n=self.dropped)
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+
+_loggers = {}
+
+
+def get_logger(name="bot"):
+    """名前ごとに1つのロガー（TRADE_BOT_LOG_LEVEL / TRADE_BOT_LOG_JSON で設定）"""
+    logger = _loggers.get(name)
+    if logger is None:
+        level = {"DEBUG": DEBUG, "INFO": INFO, "WARN": WARNING, "WARNING": WARNING,
+                 "ERROR": ERROR}.get(os.environ.get("TRADE_BOT_LOG_LEVEL", "INFO").upper(), INFO)
+        logger = AsyncLogger(name, level=level,
+                             path=os.environ.get("TRADE_BOT_LOG_PATH"),
+                             json_lines=os.environ.get("TRADE_BOT_LOG_JSON") == "1")
+        _loggers[name] = logger
+    return logger
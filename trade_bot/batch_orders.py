@@ -0,0 +1,105 @@
+from lazy_modules import (mt5, TRADE_RETCODE_REQUOTE, TRADE_RETCODE_PRICE_CHANGED, TRADE_RETCODE_PRICE_OFF,
+                          TRADE_RETCODE_DONE, TRADE_RETCODE_PLACED)
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+OrderReport = namedtuple(
+    "OrderReport",
+    "index symbol type price retcode order latency_ms attempts comment",
+)
+
+# 価格が動いたことによる拒否 → 許容範囲内なら再送する
+RETRY_RETCODES = {
+    TRADE_RETCODE_REQUOTE,
+    TRADE_RETCODE_PRICE_CHANGED,
+    TRADE_RETCODE_PRICE_OFF,
+}
+OK_RETCODES = {TRADE_RETCODE_DONE, TRADE_RETCODE_PLACED}
+
+
+class BatchOrderSubmitter:
+    """事前に組み立てた注文をまとめて並行送信するクラス
+
+    order_send は1件ごとに端末との往復待ちになるので、待ち時間を重ねて
+    グリッド全体を置き終わるまでの時間（最初と最後の注文の差）を縮める。
+    同時送信数は max_inflight で制限する。
+    """
+
+    def __init__(self, max_inflight=4, deviation=100, max_retries=3):
+        self.max_inflight = max_inflight
+        self.deviation = deviation  # points
+        self.max_retries = max_retries
+        self._points = {}
+
+    def _point(self, symbol):
+        point = self._points.get(symbol)
+        if point is None:
+            info = mt5.symbol_info(symbol)
+            point = info.point if info else 0.0
+            self._points[symbol] = point
+        return point
+
+    def _send_one(self, index, request, point):
+        """1件送信（成行注文のリクオート時は deviation 内で再送）"""
+        req = dict(request)
+        origin = req.get("price", 0.0)
+        attempts = 0
+        started = time.perf_counter()
+        while True:
+            attempts += 1
+            result = mt5.order_send(req)
+            if result is None:
+                code, comment = mt5.last_error()
+                retcode, order = code, 0
+            else:
+                retcode, order, comment = result.retcode, result.order, result.comment
+
+            # 再送するのは成行注文だけ（逆指値・取消は同じ内容を送り直しても結果が変わらない）
+            if (retcode not in RETRY_RETCODES or attempts > self.max_retries
+                    or req.get("action") != mt5.TRADE_ACTION_DEAL):
+                break
+
+            # 最新価格で出し直す。元の価格から deviation を超えたら諦める
+            tick = mt5.symbol_info_tick(req["symbol"])
+            if tick is None:
+                break
+            price = tick.ask if req["type"] == mt5.ORDER_TYPE_BUY else tick.bid
+            if point and abs(price - origin) > self.deviation * point:
+                comment = f"deviation超過 ({abs(price - origin) / point:.0f}pt)"
+                break
+            req["price"] = price
+
+        latency_ms = (time.perf_counter() - started) * 1000
+        return OrderReport(index, req["symbol"], req.get("type"), req.get("price", 0.0),
+                           retcode, order, latency_ms, attempts, comment)
+
+    def submit(self, requests):
+        """全注文を送信して結果を元の順番で返す"""
+        if not requests:
+            return []
+        points = {r["symbol"]: self._point(r["symbol"]) for r in requests}
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_inflight) as pool:
+            futures = [pool.submit(self._send_one, i, r, points[r["symbol"]])
+                       for i, r in enumerate(requests)]
+            reports = [f.result() for f in futures]
+        self.last_elapsed_ms = (time.perf_counter() - started) * 1000
+        return reports
+
+    def print_report(self, reports):
+        """レイテンシとリターンコードの集計表示"""
+        if not reports:
+            return
+        latencies = sorted(r.latency_ms for r in reports)
+        ok = sum(1 for r in reports if r.retcode in OK_RETCODES)
+        retried = sum(1 for r in reports if r.attempts > 1)
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"一括発注: {ok}/{len(reports)}件成功 | 全体 {self.last_elapsed_ms:.1f}ms | "
+              f"1件 p50 {p50:.1f}ms / p95 {p95:.1f}ms / max {latencies[-1]:.1f}ms | 再送 {retried}件")
+        for r in reports:
+            if r.retcode not in OK_RETCODES:
+                print(f"  [NG] #{r.index} type={r.type} price={r.price} "
+                      f"code={r.retcode} ({r.comment}) 試行{r.attempts}回")
@@ -0,0 +1,116 @@
+import json
+import multiprocessing as mp
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 計測対象（指標・バックテスト・ワーカーから import されるモジュール）
+MODULES = ("trend", "MarketStructureTrader", "Stop_Grid_Trader", "signal_pool", "tick_bars",
+           "grid_montecarlo", "risk_aggregator")
+
+# import しただけで読み込まれてほしくない重いモジュール
+HEAVY = ("MetaTrader5", "pandas", "tkinter", "psutil")
+
+_PROBE = """
+import sys, time, json
+sys.path.insert(0, {here!r})
+t = time.perf_counter()
+import {module}
+ms = (time.perf_counter() - t) * 1000
+print(json.dumps({{"ms": ms, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module, repeat=5):
+    """新しいインタプリタで import 時間を計測（中央値 ms と、読み込まれた重いモジュール）"""
+    times = []
+    heavy = []
+    for _ in range(repeat):
+        code = _PROBE.format(here=HERE, module=module, heavy=HEAVY)
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if out.returncode != 0:
+            return {"error": (out.stderr.strip().splitlines() or ["?"])[-1]}
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(result["ms"])
+        heavy = result["heavy"]
+    return {"ms": statistics.median(times), "min_ms": min(times), "heavy": heavy}
+
+
+def _spawn_target(module, conn):
+    t = time.perf_counter()
+    __import__(module)
+    conn.send((time.perf_counter() - t) * 1000)
+    conn.close()
+
+
+def measure_spawn(module="signal_pool", repeat=5):
+    """spawn ワーカーの起動から import 完了までの時間（中央値 ms）"""
+    ctx = mp.get_context("spawn")
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE)
+    times = []
+    for _ in range(repeat):
+        parent, child = ctx.Pipe(duplex=False)
+        t = time.perf_counter()
+        proc = ctx.Process(target=_spawn_target, args=(module, child))
+        proc.start()
+        parent.recv()
+        times.append((time.perf_counter() - t) * 1000)
+        proc.join()
+    return {"ms": statistics.median(times), "min_ms": min(times)}
+
+
+def run(repeat=5, modules=MODULES):
+    results = {}
+    for module in modules:
+        results[module] = measure_import(module, repeat)
+    results["spawn:signal_pool"] = measure_spawn("signal_pool", repeat)
+    return results
+
+
+def compare(results, baseline, tolerance=1.5, slack_ms=20.0):
+    """基準より tolerance 倍 + slack_ms 以上遅いもの、重いモジュールが増えたものを返す"""
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base or "ms" not in base or "ms" not in cur:
+            continue
+        if cur["ms"] > base["ms"] * tolerance + slack_ms:
+            regressions.append(f"{name}: {base['ms']:.1f}ms → {cur['ms']:.1f}ms")
+        added = set(cur.get("heavy", ())) - set(base.get("heavy", ()))
+        if added:
+            regressions.append(f"{name}: import 時に {', '.join(sorted(added))} を読み込むようになった")
+    return regressions
+
+
+def print_results(results):
+    print(f"{'module':<24} {'median ms':>10} {'min ms':>8}  heavy")
+    for name, r in results.items():
+        if "error" in r:
+            print(f"{name:<24} {'-':>10} {'-':>8}  失敗: {r['error']}")
+            continue
+        print(f"{name:<24} {r['ms']:>10.1f} {r['min_ms']:>8.1f}  {', '.join(r.get('heavy', ())) or '-'}")
+
+
+if __name__ == "__main__":
+    # python bench_import.py [--repeat=5] [--save=import_baseline.json] [--baseline=import_baseline.json]
+    args = dict(a[2:].split("=", 1) if "=" in a else (a[2:], True) for a in sys.argv[1:] if a.startswith("--"))
+    results = run(int(args.get("repeat", 5)))
+    print_results(results)
+    if args.get("save"):
+        with open(args["save"], "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"保存しました: {args['save']}")
+    if args.get("baseline"):
+        with open(args["baseline"], encoding="utf-8") as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print("import 時間の劣化:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("基準内です")
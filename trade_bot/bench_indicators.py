@@ -0,0 +1,190 @@
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+import synthetic_data
+
+SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+
+def install_mt5_stub(n_bars=5000, seed=0):
+    """MetaTrader5 が無い環境用の代役を sys.modules に入れる（レートとティックは合成データ）"""
+    try:
+        import MetaTrader5  # noqa: F401
+        return False
+    except ImportError:
+        pass
+    import lazy_modules
+    stub = types.ModuleType("MetaTrader5")
+    for name in dir(lazy_modules):
+        if name.startswith(("TIMEFRAME_", "TRADE_RETCODE_")):
+            setattr(stub, name, getattr(lazy_modules, name))
+    stub.ORDER_TYPE_BUY, stub.ORDER_TYPE_SELL = 0, 1
+    stub.POSITION_TYPE_BUY, stub.POSITION_TYPE_SELL = 0, 1
+    stub.COPY_TICKS_ALL = -1
+    stub.initialize = lambda *a, **k: True
+    stub.shutdown = lambda: None
+    stub.last_error = lambda: (1, "stub")
+    stub.copy_rates_from_pos = lambda symbol, tf, pos, count: synthetic_data.make_rates(
+        n_bars, seed)[max(0, n_bars - pos - count):n_bars - pos]
+    stub.copy_ticks_from = lambda symbol, since, count, flags: synthetic_data.make_ticks(count, seed)
+    sys.modules["MetaTrader5"] = stub
+    return True
+
+
+def _cases():
+    """(名前, setup(df) → 計測する0引数関数)。df を書き換える処理は setup 側でコピーする"""
+    from trend import FreshAlgoTrader_Fixed
+    from MarketStructureTrader import MarketStructureTrader
+    fa = FreshAlgoTrader_Fixed("BENCH")
+    swing = MarketStructureTrader("BENCH")
+
+    def market_signal(df):
+        ms = MarketStructureTrader("BENCH")
+        frame = df.copy()
+        return lambda: ms.generate_trading_signal(frame)
+
+    return [
+        ("atr", lambda df: lambda: fa.atr(df, fa.st_tuner)),
+        ("supertrend", lambda df: lambda: fa.supertrend(df, fa.sensitivity, fa.st_tuner)),
+        ("hma", lambda df: lambda: fa.hma(df['close'], fa.hma55_period)),
+        ("dchannel", lambda df: lambda: fa.dchannel(df, fa.dchannel_period)),
+        ("dmi", lambda df: lambda: fa.dmi(df, 14)),
+        ("calculate_ts", lambda df: lambda: fa.calculate_ts(df)),
+        ("analyze_signals", lambda df: (lambda frame: lambda: fa.analyze_signals(frame))(df.copy())),
+        ("find_swing_points", lambda df: (lambda frame: lambda: swing.find_swing_points(frame))(df.copy())),
+        ("generate_trading_signal", market_signal),
+    ]
+
+
+def _time_once(setup, df):
+    fn = setup(df)
+    gc.collect()
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def _peak_memory(setup, df):
+    fn = setup(df)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def run(sizes=SIZES, names=None, budget=30.0, repeat=3, memory=True, seed=0):
+    """ケースごとに小さいサイズから計測し、次のサイズの推定時間が budget 秒を超えたら打ち切る"""
+    cases = [c for c in _cases() if names is None or c[0] in names]
+    frames = {}
+    results = {}
+    for name, setup in cases:
+        results[name] = {}
+        prev = None
+        for n in sizes:
+            if prev is not None and prev[1] * (n / prev[0]) > budget:
+                results[name][str(n)] = {"skipped": f"推定 {prev[1] * n / prev[0]:.0f}s > 予算 {budget:g}s"}
+                continue
+            if n not in frames:
+                frames.clear()  # 大きいサイズを複数持たない
+                frames[n] = synthetic_data.make_frame(n, seed)
+            df = frames[n]
+
+            first = _time_once(setup, df)
+            times = [first]
+            if first * repeat < budget:
+                times += [_time_once(setup, df) for _ in range(repeat - 1)]
+            best = min(times)
+            row = {"s": best, "per_bar_us": best / n * 1e6}
+            if memory and first < budget:
+                row["peak_mb"] = _peak_memory(setup, df)
+            results[name][str(n)] = row
+            prev = (n, best)
+            print(f"  {name:<24} {n:>9,} bars  {best * 1000:>11.2f} ms  "
+                  f"{row['per_bar_us']:>8.2f} us/bar  {row.get('peak_mb', float('nan')):>8.1f} MB", flush=True)
+    return results
+
+
+def environment():
+    import pandas as pd
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "machine": platform.machine(), "processor": platform.processor()}
+
+
+def compare(results, baseline, tolerance=1.3, slack_s=0.002, mem_tolerance=1.3, slack_mb=1.0):
+    """基準と同じ (ケース, サイズ) を比べ、劣化したものを文字列で返す"""
+    regressions = []
+    for name, rows in results.items():
+        for n, cur in rows.items():
+            base = baseline.get("results", {}).get(name, {}).get(n)
+            if not base or "s" not in base or "s" not in cur:
+                continue
+            if cur["s"] > base["s"] * tolerance + slack_s:
+                regressions.append(f"{name} @ {n}: {base['s'] * 1000:.2f}ms → {cur['s'] * 1000:.2f}ms "
+                                   f"(x{cur['s'] / base['s']:.2f})")
+            if "peak_mb" in cur and "peak_mb" in base and cur["peak_mb"] > base["peak_mb"] * mem_tolerance + slack_mb:
+                regressions.append(f"{name} @ {n}: メモリ {base['peak_mb']:.1f}MB → {cur['peak_mb']:.1f}MB")
+    return regressions
+
+
+if __name__ == "__main__":
+    # python bench_indicators.py [--sizes=1e3,1e4] [--cases=atr,hma] [--budget=30] [--repeat=3]
+    #                            [--no-memory] [--save-baseline[=path]] [--baseline=path] [--out=path]
+    # 基準は実行環境ごとのものなのでリポジトリには置かない。既定の基準ファイル（bench_baseline.json）が
+    # 無ければ初回の結果をそれとして保存し、2回目以降はそれと比べて劣化があれば終了コード1で失敗する。
+    # --baseline で指定したファイルが無いときは比較できないので終了コード2で失敗する。
+    args = dict(a[2:].split("=", 1) if "=" in a else (a[2:], True) for a in sys.argv[1:] if a.startswith("--"))
+    sizes = tuple(int(float(s)) for s in args["sizes"].split(",")) if "sizes" in args else SIZES
+    names = set(args["cases"].split(",")) if "cases" in args else None
+
+    if install_mt5_stub():
+        print("MetaTrader5 が無いのでスタブを使用します")
+    print(f"サイズ {', '.join(f'{n:,}' for n in sizes)} / 予算 {float(args.get('budget', 30)):g}s")
+    results = run(sizes, names, budget=float(args.get("budget", 30)), repeat=int(args.get("repeat", 3)),
+                  memory="no-memory" not in args)
+    report = {"environment": environment(), "results": results}
+
+    if args.get("out"):
+        with open(args["out"], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    if args.get("save-baseline"):
+        path = BASELINE_PATH if args["save-baseline"] is True else args["save-baseline"]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        print(f"基準を保存しました: {path}")
+        sys.exit(0)
+
+    path = args.get("baseline", BASELINE_PATH)
+    if not os.path.exists(path):
+        if "baseline" in args:
+            print(f"基準ファイルがありません: {path}")
+            sys.exit(2)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        print(f"基準ファイルが無いので今回の結果を基準として保存しました: {path}（次回からこれと比較します）")
+        sys.exit(0)
+    with open(path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != report["environment"]:
+        print(f"注意: 基準と実行環境が違います {baseline.get('environment')}")
+    regressions = compare(results, baseline)
+    if regressions:
+        print("\n" + "!" * 60)
+        print(f"性能劣化 {len(regressions)}件:")
+        for line in regressions:
+            print(f"  {line}")
+        print("!" * 60)
+        sys.exit(1)
+    print("基準内です")
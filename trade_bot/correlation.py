@@ -0,0 +1,160 @@
+import math
+
+import numpy as np
+
+from lazy_modules import mt5, TIMEFRAME_M15
+from tick_bars import TIMEFRAME_SECONDS
+
+
+class EwmaCorrelation:
+    """N銘柄のリターンの EWMA 平均・共分散を確定バーごとに更新するクラス
+
+    窓で毎回計算し直す代わりに、1本ごとに
+        d = x - mean;  mean += α d;  cov = (1 - α)(cov + α d dᵀ)
+    で N×N 行列を更新する（O(N²)、N=数百でも1回 1ms 未満）。
+    価格は update_prices で渡し、対数リターンは内部で計算する。
+    """
+
+    def __init__(self, symbols, halflife=100.0, min_obs=30):
+        self.symbols = list(symbols)
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.alpha = 1.0 - 0.5 ** (1.0 / halflife)
+        self.min_obs = min_obs
+
+        n = len(self.symbols)
+        self.mean = np.zeros(n)
+        self.cov = np.zeros((n, n))
+        self.count = 0
+        self._last = np.full(n, np.nan)
+        self._x = np.zeros(n)
+        self._outer = np.empty((n, n))
+
+    def update(self, returns):
+        """1本分のリターン（長さNの配列、欠損は0扱い）で更新"""
+        x = np.nan_to_num(np.asarray(returns, dtype=float), copy=False)
+        a = self.alpha
+        d = x - self.mean
+        self.mean += a * d
+        np.multiply.outer(d, d * ((1.0 - a) * a), out=self._outer)
+        self.cov *= 1.0 - a
+        self.cov += self._outer
+        self.count += 1
+
+    def update_prices(self, prices):
+        """{symbol: 確定足の終値} から対数リターンを作って更新（前回値が無い銘柄は0）"""
+        x = self._x
+        x.fill(0.0)
+        for symbol, price in prices.items():
+            i = self.index.get(symbol)
+            if i is None or not price > 0:
+                continue
+            last = self._last[i]
+            if last == last:  # NaN でない
+                x[i] = math.log(price / last)
+            self._last[i] = price
+        self.update(x)
+
+    def warm_up(self, closes):
+        """T×N の終値行列（古い順）で初期化"""
+        closes = np.asarray(closes, dtype=float)
+        for row in np.diff(np.log(closes), axis=0):
+            self.update(row)
+        self._last[:] = closes[-1]
+
+    # --- 参照 ---
+    @property
+    def ready(self):
+        return self.count >= self.min_obs
+
+    def corr(self, a, b):
+        i, j = self.index[a], self.index[b]
+        denom = math.sqrt(self.cov[i, i] * self.cov[j, j])
+        return self.cov[i, j] / denom if denom > 0 else 0.0
+
+    def corr_row(self, symbol):
+        """symbol と全銘柄の相関（長さN）"""
+        i = self.index[symbol]
+        var = np.diagonal(self.cov)
+        denom = np.sqrt(var * var[i])
+        return np.divide(self.cov[i], denom, out=np.zeros(len(var)), where=denom > 0)
+
+    def corr_matrix(self):
+        std = np.sqrt(np.diagonal(self.cov))
+        denom = np.outer(std, std)
+        return np.divide(self.cov, denom, out=np.zeros_like(self.cov), where=denom > 0)
+
+    def overlap(self, symbol, side, exposures):
+        """新規 side(+1/-1) と同じ向きに効いている既存建玉の最大相関と、その銘柄
+
+        exposures は {symbol: ネット建玉（符号付き）}。自銘柄は含めない。
+        """
+        if not self.ready or symbol not in self.index:
+            return 0.0, None
+        row = self.corr_row(symbol)
+        best, best_symbol = 0.0, None
+        for other, net in exposures.items():
+            j = self.index.get(other)
+            if j is None or other == symbol or not net:
+                continue
+            c = row[j] * side * (1.0 if net > 0 else -1.0)
+            if c > best:
+                best, best_symbol = c, other
+        return best, best_symbol
+
+    def adjust_lots(self, symbol, side, lots, exposures, veto=0.8, min_lots=0.0):
+        """相関のある既存建玉と重なる分だけロットを減らす（veto 以上の相関なら0）
+
+        lots × (1 - 最大の同方向相関)。min_lots 未満になったら0を返す。
+        """
+        c, _ = self.overlap(symbol, side, exposures)
+        if c >= veto:
+            return 0.0
+        adjusted = lots * (1.0 - c)
+        return adjusted if adjusted >= min_lots else 0.0
+
+
+class BarCloseFeed:
+    """各銘柄の確定足を監視し、全銘柄のバーが揃うたびに EwmaCorrelation を更新する
+
+    バーの確定時刻が来るまでは端末に問い合わせないので、毎ループ呼んでもよい。
+    確定後 grace 秒たってもバーが無い銘柄（取引時間外など）はリターン0で進める。
+    """
+
+    def __init__(self, engine, timeframe=TIMEFRAME_M15, grace=30.0):
+        self.engine = engine
+        self.timeframe = timeframe
+        self.seconds = TIMEFRAME_SECONDS[timeframe]
+        self.grace = grace
+        self._last_bar = 0
+
+    def warm_up(self, bars=500):
+        """履歴の終値を時刻で揃えて初期化"""
+        series = {}
+        for symbol in self.engine.symbols:
+            rates = mt5.copy_rates_from_pos(symbol, self.timeframe, 1, bars)
+            if rates is None or not len(rates):
+                return False
+            series[symbol] = dict(zip(rates['time'].tolist(), rates['close'].tolist()))
+        common = sorted(set.intersection(*(set(s) for s in series.values())))
+        if len(common) < 2:
+            return False
+        closes = [[series[s][t] for s in self.engine.symbols] for t in common]
+        self.engine.warm_up(closes)
+        self._last_bar = common[-1]
+        return True
+
+    def poll(self, server_time):
+        """server_time（サーバー時刻 epoch秒）で新しい確定足があれば取り込む"""
+        closed = (int(server_time) // self.seconds - 1) * self.seconds
+        if closed <= self._last_bar:
+            return False
+        prices = {}
+        for symbol in self.engine.symbols:
+            rates = mt5.copy_rates_from_pos(symbol, self.timeframe, 1, 1)
+            if rates is not None and len(rates) and int(rates['time'][0]) == closed:
+                prices[symbol] = float(rates['close'][0])
+        if len(prices) < len(self.engine.symbols) and server_time < closed + self.seconds + self.grace:
+            return False  # まだ確定していない銘柄がある → 次のループで再試行
+        self.engine.update_prices(prices)
+        self._last_bar = closed
+        return True
@@ -0,0 +1,126 @@
+from bisect import bisect_left, bisect_right
+
+
+class GridSide:
+    """片側のグリッド注文（価格昇順の配列 + チケット⇔価格の対応表）"""
+
+    def __init__(self):
+        self.prices = []          # 昇順
+        self.tickets = []         # prices と同じ並び
+        self.price_of = {}        # ticket -> price
+
+    def __len__(self):
+        return len(self.prices)
+
+    def add(self, price, ticket):
+        i = bisect_right(self.prices, price)
+        self.prices.insert(i, price)
+        self.tickets.insert(i, ticket)
+        self.price_of[ticket] = price
+
+    def remove(self, ticket):
+        price = self.price_of.pop(ticket, None)
+        if price is None:
+            return None
+        i = bisect_left(self.prices, price)
+        # 同値の価格があり得るのでチケットで特定
+        while self.tickets[i] != ticket:
+            i += 1
+        del self.prices[i]
+        del self.tickets[i]
+        return price
+
+    def clear(self):
+        self.prices.clear()
+        self.tickets.clear()
+        self.price_of.clear()
+
+
+def _match(existing_prices, existing_tickets, targets, tol):
+    """昇順同士を突き合わせ、tol以内で一致しない既存/目標を返す"""
+    cancel, add = [], []
+    i = j = 0
+    while i < len(existing_prices) and j < len(targets):
+        diff = existing_prices[i] - targets[j]
+        if abs(diff) <= tol:
+            i += 1
+            j += 1
+        elif diff < 0:
+            cancel.append(existing_tickets[i])
+            i += 1
+        else:
+            add.append(targets[j])
+            j += 1
+    cancel.extend(existing_tickets[i:])
+    add.extend(targets[j:])
+    return cancel, add
+
+
+class GridBook:
+    """グリッド注文の板
+
+    買い逆指値は ask が価格以上になると約定、売り逆指値は bid が価格以下で約定するので、
+    昇順配列の二分探索で約定した範囲が O(log n) で分かる。毎秒の orders_get 全走査を避ける。
+    """
+
+    def __init__(self, magic=None, tag=None):
+        self.magic = magic
+        self.tag = tag
+        self.buy = GridSide()    # 買い逆指値（現在値より上）
+        self.sell = GridSide()   # 売り逆指値（現在値より下）
+
+    def __len__(self):
+        return len(self.buy) + len(self.sell)
+
+    def load(self, orders, buy_type, sell_type):
+        """orders_get の結果から板を作り直す（起動時・再同期用）"""
+        self.buy.clear()
+        self.sell.clear()
+        for o in orders or ():
+            if self.magic is not None and o.magic != self.magic:
+                continue
+            if self.tag is not None and o.comment != self.tag:
+                continue
+            if o.type == buy_type:
+                self.buy.add(o.price_open, o.ticket)
+            elif o.type == sell_type:
+                self.sell.add(o.price_open, o.ticket)
+
+    def filled(self, bid, ask):
+        """現在の bid/ask で約定したと見なせるレベル [(ticket, price, side), ...]"""
+        hits = []
+        n = bisect_right(self.buy.prices, ask)
+        for k in range(n):
+            hits.append((self.buy.tickets[k], self.buy.prices[k], "BUY"))
+        m = bisect_left(self.sell.prices, bid)
+        for k in range(m, len(self.sell.prices)):
+            hits.append((self.sell.tickets[k], self.sell.prices[k], "SELL"))
+        return hits
+
+    def any_filled(self, bid, ask):
+        """最も近いレベルだけ見る O(1) 判定"""
+        return bool((self.buy.prices and self.buy.prices[0] <= ask) or
+                    (self.sell.prices and self.sell.prices[-1] >= bid))
+
+    def remove(self, ticket):
+        """約定・取消したチケットを板から外す"""
+        if self.buy.remove(ticket) is not None:
+            return "BUY"
+        if self.sell.remove(ticket) is not None:
+            return "SELL"
+        return None
+
+    def diff(self, buy_levels, sell_levels, tol):
+        """目標レベルとの差分 → (取消チケット, 追加する買いレベル, 追加する売りレベル)
+
+        tol 以内のずれは同じレベルとして扱い、動いたレベルだけを入れ替える。
+        """
+        cancel_b, add_b = _match(self.buy.prices, self.buy.tickets, sorted(buy_levels), tol)
+        cancel_s, add_s = _match(self.sell.prices, self.sell.tickets, sorted(sell_levels), tol)
+        return cancel_b + cancel_s, add_b, add_s
+
+    def add(self, side, price, ticket):
+        if side == "BUY":
+            self.buy.add(price, ticket)
+        else:
+            self.sell.add(price, ticket)
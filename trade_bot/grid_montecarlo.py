@@ -0,0 +1,172 @@
+import numpy as np
+import time
+
+from Stop_Grid_Trader import (DEF_SYMBOL, DEF_LOTS, DEF_ORDERS_SIDE, DEF_MULTIPLIER,
+                              DEF_LOOP, DEF_MAX_RISK)
+
+
+def simulate_paths(n_paths, n_steps, s0, returns=None, mu=0.0, sigma=0.001, seed=None,
+                   dtype=np.float64):
+    """価格パスを (n_paths, n_steps + 1) の2次元配列で生成
+
+    returns を渡すと過去の対数リターンからブートストラップ、無ければ正規分布モデル。
+    """
+    rng = np.random.default_rng(seed)
+    if returns is not None:
+        returns = np.asarray(returns, dtype=dtype)
+        idx = rng.integers(0, len(returns), size=(n_paths, n_steps))
+        steps = returns[idx]
+    else:
+        steps = rng.normal(mu, sigma, size=(n_paths, n_steps)).astype(dtype)
+    log_paths = np.empty((n_paths, n_steps + 1), dtype=dtype)
+    log_paths[:, 0] = 0.0
+    np.cumsum(steps, axis=1, out=log_paths[:, 1:])
+    return s0 * np.exp(log_paths)
+
+
+def simulate_grid(prices, spread, multiplier=DEF_MULTIPLIER, lots=DEF_LOTS,
+                  orders_side=DEF_ORDERS_SIDE, loops=DEF_LOOP, max_risk=DEF_MAX_RISK,
+                  balance=100000.0, contract_size=1.0, leverage=100.0):
+    """グリッドの約定/再グリッドのルールを全パス同時に適用する
+
+    - 現在値を中心に上に買い逆指値、下に売り逆指値を step 間隔で orders_side 本ずつ
+    - どちらかが約定したらそのループは終了、残りを取消して現在値で置き直す
+    - loops 回で新規発注を止める。損失が残高の max_risk % に達したら全決済して停止
+    時間方向だけPythonでループし、パス方向はすべてNumPyのベクトル演算。
+    """
+    n_paths, n_cols = prices.shape
+    step = spread * multiplier
+    half = spread * 0.5
+
+    center = prices[:, 0].copy()
+    net_lots = np.zeros(n_paths)      # 符号付きロット（買い+ / 売り-）
+    gross_lots = np.zeros(n_paths)
+    cost = np.zeros(n_paths)          # Σ 符号付きロット × 約定価格
+    loops_done = np.zeros(n_paths, dtype=np.int32)
+    active = np.ones(n_paths, dtype=bool)   # まだ新規発注するパス
+    alive = np.ones(n_paths, dtype=bool)    # 損失上限に達していないパス
+
+    equity = np.full(n_paths, balance)
+    peak = equity.copy()
+    max_dd = np.zeros(n_paths)
+    max_margin = np.zeros(n_paths)
+    time_to_limit = np.full(n_paths, -1, dtype=np.int64)
+    fills = np.zeros(n_paths, dtype=np.int64)
+    limit = balance * max_risk / 100.0
+
+    for t in range(1, n_cols):
+        p = prices[:, t]
+
+        # 何本目まで逆指値を抜けたか（中心からの移動量 / step）
+        d = (p - center) / step
+        n_up = np.clip(np.floor(d), 0, orders_side)
+        n_dn = np.clip(np.floor(-d), 0, orders_side)
+        trade = active & alive
+        n_up *= trade
+        n_dn *= trade
+
+        hit = (n_up + n_dn) > 0
+        if hit.any():
+            ask0 = center + half
+            bid0 = center - half
+            # 等差数列の和で約定価格の合計を出す（レベルごとのループ不要）
+            buy_sum = n_up * ask0 + step * n_up * (n_up + 1) * 0.5
+            sell_sum = n_dn * bid0 - step * n_dn * (n_dn + 1) * 0.5
+            net_lots += lots * (n_up - n_dn)
+            gross_lots += lots * (n_up + n_dn)
+            cost += lots * (buy_sum - sell_sum)
+            fills += (n_up + n_dn).astype(np.int64)
+            loops_done += hit
+            center = np.where(hit, p, center)
+            active &= loops_done < loops
+
+        # 評価損益（決済時に半スプレッドを払う前提）
+        pnl = contract_size * (net_lots * p - cost - gross_lots * half)
+        eq = np.where(alive, balance + pnl, equity)
+
+        breach = alive & (balance - eq >= limit)
+        if breach.any():
+            time_to_limit[breach] = t
+            alive &= ~breach
+
+        equity = eq
+        np.maximum(peak, equity, out=peak)
+        np.maximum(max_dd, (peak - equity) / peak * 100.0, out=max_dd)
+        margin = gross_lots * contract_size * p / leverage
+        usage = np.divide(margin, equity, out=np.zeros(n_paths), where=equity > 0) * 100.0
+        np.maximum(max_margin, np.where(alive, usage, 0.0), out=max_margin)
+
+    return {
+        "max_drawdown": max_dd,
+        "max_margin_usage": max_margin,
+        "time_to_limit": time_to_limit,
+        "fills": fills,
+        "final_pnl": equity - balance,
+    }
+
+
+def summarize(result, label=""):
+    """パス分布の要約（パーセンタイル）"""
+    dd = result["max_drawdown"]
+    margin = result["max_margin_usage"]
+    ttl = result["time_to_limit"]
+    hit = ttl >= 0
+    summary = {
+        "label": label,
+        "paths": len(dd),
+        "hit_rate": float(hit.mean()),
+        "dd_p50": float(np.percentile(dd, 50)),
+        "dd_p95": float(np.percentile(dd, 95)),
+        "dd_p99": float(np.percentile(dd, 99)),
+        "margin_p95": float(np.percentile(margin, 95)),
+        "ttl_p50": float(np.median(ttl[hit])) if hit.any() else None,
+        "pnl_p50": float(np.median(result["final_pnl"])),
+    }
+    ttl_text = f"{summary['ttl_p50']:.0f}" if summary["ttl_p50"] is not None else "-"
+    print(f"{label:<24} 上限到達率 {summary['hit_rate'] * 100:5.1f}% | "
+          f"DD p50/p95/p99 {summary['dd_p50']:5.1f}/{summary['dd_p95']:5.1f}/{summary['dd_p99']:5.1f}% | "
+          f"証拠金 p95 {summary['margin_p95']:5.1f}% | 到達時間中央値 {ttl_text} | "
+          f"損益中央値 {summary['pnl_p50']:.0f}")
+    return summary
+
+
+def run_montecarlo(s0, spread, n_paths=20000, n_steps=1440, returns=None, sigma=0.001,
+                   seed=0, chunk=10000, label="", **grid_params):
+    """パスをチャンクに分けて生成・シミュレーション（メモリを一定に保つ）"""
+    started = time.perf_counter()
+    parts = []
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_paths, chunk):
+        n = min(chunk, n_paths - start)
+        prices = simulate_paths(n, n_steps, s0, returns=returns, sigma=sigma,
+                                seed=int(rng.integers(1 << 31)))
+        parts.append(simulate_grid(prices, spread, **grid_params))
+    result = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+    summary = summarize(result, label)
+    summary["elapsed"] = time.perf_counter() - started
+    return result, summary
+
+
+def load_returns(symbol=DEF_SYMBOL, count=50000):
+    """MT5のM1足から対数リターンを取得（ブートストラップ用）"""
+    import MetaTrader5 as mt5
+    if not mt5.initialize():
+        return None
+    try:
+        rates = mt5.copy_rates_from_pos(symbol, mt5.TIMEFRAME_M1, 0, count)
+    finally:
+        mt5.shutdown()
+    if rates is None or len(rates) < 2:
+        return None
+    return np.diff(np.log(rates['close']))
+
+
+# 使用例: 間隔の倍率と片側本数を変えて上限到達率を比較
+if __name__ == "__main__":
+    s0 = 60000.0     # BTCUSD 想定
+    spread = 15.0
+    for multiplier in (1.0, 2.0, 4.0):
+        for orders_side in (5, 10):
+            run_montecarlo(s0, spread, n_paths=20000, n_steps=1440, sigma=0.0008,
+                           label=f"x{multiplier} / {orders_side}本",
+                           multiplier=multiplier, orders_side=orders_side)
@@ -0,0 +1,67 @@
+import importlib
+import importlib.util
+
+
+class LazyModule:
+    """最初に属性を参照したときに import するモジュールの代役
+
+        from lazy_modules import mt5, pd
+        mt5.initialize()   # ここで初めて MetaTrader5 を読み込む
+
+    指標計算だけ使うツールやバックテスト、ワーカープロセスが端末・pandas の
+    import 時間を払わずに済むようにする。一度引いた属性は自分の __dict__ に
+    載せるので、2回目以降は通常の属性参照と同じ速さになる。
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        value = getattr(self._load(), attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __setattr__(self, attr, value):
+        # 差し替え（テスト用のスタブなど）は実モジュールにも反映する
+        setattr(self._load(), attr, value)
+        self.__dict__[attr] = value
+
+    @property
+    def loaded(self):
+        return self.__dict__["_module"] is not None
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyModule {self.__dict__['_name']} ({state})>"
+
+
+def available(name):
+    """import せずにモジュールがインストールされているか確認"""
+    return importlib.util.find_spec(name) is not None
+
+
+mt5 = LazyModule("MetaTrader5")
+pd = LazyModule("pandas")
+
+# 既定引数やモジュール定数で端末モジュールを読まないための定数（MetaTrader5 と同値）
+TIMEFRAME_M1 = 1
+TIMEFRAME_M5 = 5
+TIMEFRAME_M15 = 15
+TIMEFRAME_M30 = 30
+TIMEFRAME_H1 = 16385
+TIMEFRAME_H4 = 16388
+TIMEFRAME_D1 = 16408
+
+TRADE_RETCODE_REQUOTE = 10004
+TRADE_RETCODE_PLACED = 10008
+TRADE_RETCODE_DONE = 10009
+TRADE_RETCODE_PRICE_CHANGED = 10020
+TRADE_RETCODE_PRICE_OFF = 10021
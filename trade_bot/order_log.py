@@ -0,0 +1,100 @@
+import os
+import struct
+import sys
+import threading
+
+# 1注文 = 固定長レコード（リトルエンディアン、パディングなし）
+#   bar_time  シグナル元バーの確定時刻（サーバー時刻 epoch秒）
+#   tick_msc  送信に使ったティックの時刻（サーバー時刻 ms）→ bar_time と同じ時計で遅れを測る
+#   decided   シグナル判定時刻 / sent 送信直前 / done 結果受信 (ローカル epoch ns)
+#   symbol, strategy, side(+1買/-1売), kind(0新規/1決済), retcode, filling, deviation
+#   requested 要求価格 / filled 約定価格 / point / volume / order チケット
+RECORD = struct.Struct("<qqqqq12s12sbbibHddddQ")
+
+KIND_OPEN = 0
+KIND_CLOSE = 1
+
+
+class OrderLog:
+    """発注1件ごとの時刻・価格を追記専用のバイナリファイルに記録する"""
+
+    def __init__(self, path="orders.bin"):
+        self.path = path
+        self._f = None
+        self._lock = threading.Lock()
+
+    def append(self, symbol, strategy, side, kind, bar_time, tick_msc, decided_ns, sent_ns, done_ns,
+               requested, filled, deviation, filling, retcode, point, volume, order=0):
+        rec = RECORD.pack(
+            int(bar_time or 0), int(tick_msc or 0),
+            int(decided_ns or sent_ns), int(sent_ns), int(done_ns),
+            symbol.encode()[:12], strategy.encode()[:12], side, kind,
+            int(retcode), int(filling if filling is not None else -1), int(deviation),
+            float(requested), float(filled or 0.0), float(point or 0.0), float(volume), int(order or 0),
+        )
+        with self._lock:
+            if self._f is None:
+                self._f = open(self.path, "ab")
+            self._f.write(rec)
+            self._f.flush()
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+def read_records(path):
+    """レコードを辞書で順に返す"""
+    with open(path, "rb") as f:
+        data = f.read()
+    usable = len(data) - len(data) % RECORD.size  # 書き込み途中の末尾は捨てる
+    for (bar_time, tick_msc, decided, sent, done, symbol, strategy, side, kind, retcode, filling,
+         deviation, requested, filled, point, volume, order) in RECORD.iter_unpack(data[:usable]):
+        yield {
+            "bar_time": bar_time, "tick_msc": tick_msc, "decided_ns": decided, "sent_ns": sent, "done_ns": done,
+            "symbol": symbol.rstrip(b"\0").decode(), "strategy": strategy.rstrip(b"\0").decode(),
+            "side": side, "kind": kind, "retcode": retcode, "filling": filling,
+            "deviation": deviation, "requested": requested, "filled": filled,
+            "point": point, "volume": volume, "order": order,
+        }
+
+
+def _pct(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(path, ok_retcodes=(10008, 10009)):
+    """シンボル/戦略ごとのレイテンシ分位点とスリッページ（ポイント）"""
+    groups = {}
+    for r in read_records(path):
+        groups.setdefault((r["symbol"], r["strategy"]), []).append(r)
+
+    print(f"{'symbol':<10} {'strategy':<12} {'n':>4} {'ok%':>5} | "
+          f"{'送信→結果 ms p50/p95/p99':>26} | {'判定→送信 ms p50':>14} | "
+          f"{'バー確定→送信 s p50':>14} | {'slip pt mean/p95':>16}")
+    for (symbol, strategy), recs in sorted(groups.items()):
+        ok = [r for r in recs if r["retcode"] in ok_retcodes]
+        rtt = [(r["done_ns"] - r["sent_ns"]) / 1e6 for r in recs]
+        prep = [(r["sent_ns"] - r["decided_ns"]) / 1e6 for r in recs]
+        lag = [r["tick_msc"] / 1000 - r["bar_time"] for r in recs if r["bar_time"] and r["tick_msc"]]
+        # 正 = 不利方向への滑り
+        slip = [(r["filled"] - r["requested"]) * r["side"] / r["point"]
+                for r in ok if r["point"] and r["filled"]]
+        slip_mean = sum(slip) / len(slip) if slip else float("nan")
+        print(f"{symbol:<10} {strategy:<12} {len(recs):>4} {len(ok) / len(recs) * 100:>5.1f} | "
+              f"{_pct(rtt, .5):>8.1f}/{_pct(rtt, .95):>8.1f}/{_pct(rtt, .99):>8.1f} | "
+              f"{_pct(prep, .5):>14.2f} | {_pct(lag, .5):>14.1f} | "
+              f"{slip_mean:>7.1f}/{_pct(slip, .95):>8.1f}")
+
+
+# プロセス内で共有する記録先（TRADE_BOT_ORDER_LOG で変更）
+order_log = OrderLog(os.environ.get("TRADE_BOT_ORDER_LOG", "orders.bin"))
+
+
+if __name__ == "__main__":
+    summarize(sys.argv[1] if len(sys.argv) > 1 else "orders.bin")
@@ -0,0 +1,164 @@
+import json
+import os
+import signal
+import threading
+import time
+
+# 1/4オクターブ刻みの対数バケット（誤差±20%程度、1ステージあたり固定 256 スロット）
+N_BUCKETS = 256
+
+
+def _bucket(ns):
+    if ns < 4:
+        return ns if ns > 0 else 0
+    bl = ns.bit_length()
+    return 4 + (bl - 3) * 4 + ((ns >> (bl - 3)) - 4)
+
+
+def _bucket_upper(idx):
+    if idx < 4:
+        return idx
+    e, sub = divmod(idx - 4, 4)
+    return (5 + sub) << e
+
+
+class _Histogram:
+    __slots__ = ("counts", "n", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.n = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, ns):
+        self.counts[_bucket(ns)] += 1
+        self.n += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, q):
+        if not self.n:
+            return 0
+        target = q * self.n
+        seen = 0
+        for idx, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return min(_bucket_upper(idx), self.max)
+        return self.max
+
+
+class _Span:
+    __slots__ = ("hist", "start")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.add(time.perf_counter_ns() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullSpan()
+
+
+class StageTimer:
+    """ステージ・指標ごとの処理時間を固定メモリのヒストグラムに貯める
+
+    with timer.stage("get_rates"): ... で計測。無効時は共有の空コンテキストを返すだけ。
+    dump() で p50/p95/p99 をJSONに書き出す（定期実行 or シグナル）。
+    """
+
+    def __init__(self, enabled=False, path="perf_stats.json", dump_interval=300):
+        self.enabled = enabled
+        self.path = path
+        self.dump_interval = dump_interval
+        self._hists = {}
+        self._lock = threading.Lock()
+        self._last_dump = time.monotonic()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL
+        hist = self._hists.get(name)
+        if hist is None:
+            with self._lock:
+                hist = self._hists.setdefault(name, _Histogram())
+        return _Span(hist)
+
+    def record(self, name, seconds):
+        """計測済みの時間を直接登録"""
+        if not self.enabled:
+            return
+        hist = self._hists.get(name)
+        if hist is None:
+            with self._lock:
+                hist = self._hists.setdefault(name, _Histogram())
+        hist.add(int(seconds * 1e9))
+
+    def stats(self):
+        out = {}
+        for name, h in list(self._hists.items()):
+            if not h.n:
+                continue
+            out[name] = {
+                "count": h.n,
+                "mean_us": h.total / h.n / 1000,
+                "p50_us": h.percentile(0.50) / 1000,
+                "p95_us": h.percentile(0.95) / 1000,
+                "p99_us": h.percentile(0.99) / 1000,
+                "max_us": h.max / 1000,
+            }
+        return out
+
+    def dump(self, path=None):
+        """集計をJSONで書き出す（一時ファイル経由で置き換え）"""
+        path = path or self.path
+        data = {"time": time.time(), "pid": os.getpid(), "stages": self.stats()}
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, path)
+        self._last_dump = time.monotonic()
+
+    def maybe_dump(self):
+        """dump_interval 秒ごとに書き出す（ループの最後で呼ぶ）"""
+        if self.enabled and time.monotonic() - self._last_dump >= self.dump_interval:
+            self.dump()
+
+    def install_signal(self):
+        """SIGUSR1（WindowsはCtrl+Break）で即時書き出し"""
+        sig = getattr(signal, "SIGUSR1", None) or getattr(signal, "SIGBREAK", None)
+        if sig is None or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(sig, lambda *_: self.dump())
+        return True
+
+    def reset(self):
+        with self._lock:
+            self._hists.clear()
+
+
+# TRADE_BOT_PROFILE=1 で有効化（出力先は TRADE_BOT_PROFILE_PATH）
+timer = StageTimer(
+    enabled=os.environ.get("TRADE_BOT_PROFILE") == "1",
+    path=os.environ.get("TRADE_BOT_PROFILE_PATH", "perf_stats.json"),
+)
+if timer.enabled:
+    timer.install_signal()
@@ -0,0 +1,162 @@
+from lazy_modules import mt5
+from collections import namedtuple
+import time
+
+TrackedPosition = namedtuple(
+    "TrackedPosition", "ticket symbol magic type volume price_open time")
+
+# 約定時刻はサーバー時刻なので、ローカル時刻とのずれを吸収するため取得範囲の終端は広めに取る
+_FUTURE = 2 * 86400
+
+
+class PositionTracker:
+    """(symbol, magic) ごとのポジション帳簿を約定履歴の差分で更新するクラス
+
+    毎ループ positions_get で全件取り直す代わりに、最後に見た約定チケットより
+    新しい約定だけを history_deals_get で取り込む。reconcile_interval 秒ごとに
+    positions_get で全体を突き合わせてずれを直す。
+    購読者には ("open" | "close" | "fill", データ) と、帳簿を書き換えた後に
+    ("change", (symbol, magic)) を通知する。
+    """
+
+    def __init__(self, magics=None, reconcile_interval=60.0):
+        self.magics = set(magics) if magics else None
+        self.reconcile_interval = reconcile_interval
+
+        self.books = {}          # (symbol, magic) -> {position_id: TrackedPosition}
+        self._where = {}         # position_id -> (symbol, magic)
+        self._subscribers = []
+        self._last_ticket = 0
+        self._cursor = None      # 最後に取り込んだ約定の時刻（サーバー時刻）
+        self._last_reconcile = 0.0
+
+    def subscribe(self, callback):
+        """イベント購読 callback(event, data)"""
+        self._subscribers.append(callback)
+
+    def _emit(self, event, data):
+        for callback in self._subscribers:
+            callback(event, data)
+
+    def _wanted(self, magic):
+        return self.magics is None or magic in self.magics
+
+    # --- 参照 ---
+    def count(self, symbol, magic):
+        book = self.books.get((symbol, magic))
+        return len(book) if book else 0
+
+    def positions(self, symbol, magic):
+        book = self.books.get((symbol, magic))
+        return list(book.values()) if book else []
+
+    # --- 更新 ---
+    def start(self, lookback=86400):
+        """全件同期して、約定カーソルを現在の最新チケットに合わせる"""
+        now = int(time.time())
+        deals = mt5.history_deals_get(now - lookback, now + _FUTURE)
+        if deals:
+            last = max(deals, key=lambda d: d.ticket)
+            self._last_ticket = last.ticket
+            self._cursor = last.time
+        else:
+            self._cursor = now - lookback
+        self.reconcile()
+
+    def poll(self):
+        """前回以降の約定だけを取り込む。取り込んだ件数を返す"""
+        if self._cursor is None:
+            self.start()
+        deals = mt5.history_deals_get(self._cursor - 1, int(time.time()) + _FUTURE)
+        applied = 0
+        if deals:
+            for d in sorted(deals, key=lambda d: (d.time_msc, d.ticket)):
+                if d.ticket <= self._last_ticket:
+                    continue
+                self._apply(d)
+                self._last_ticket = d.ticket
+                self._cursor = max(self._cursor, d.time)
+                applied += 1
+
+        if time.monotonic() - self._last_reconcile >= self.reconcile_interval:
+            self.reconcile()
+        return applied
+
+    def _apply(self, d):
+        """約定1件を帳簿へ反映"""
+        if d.type not in (mt5.DEAL_TYPE_BUY, mt5.DEAL_TYPE_SELL):
+            return  # 入出金・クレジット・手数料などの取引以外の deal
+        if d.entry == mt5.DEAL_ENTRY_IN:
+            if not self._wanted(d.magic):
+                return
+            key = (d.symbol, d.magic)
+            self._emit("fill", d)
+            book = self.books.setdefault(key, {})
+            pos = book.get(d.position_id)
+            pos_type = mt5.POSITION_TYPE_BUY if d.type == mt5.DEAL_TYPE_BUY else mt5.POSITION_TYPE_SELL
+            if pos is None:
+                pos = TrackedPosition(d.position_id, d.symbol, d.magic, pos_type,
+                                      d.volume, d.price, d.time)
+                book[d.position_id] = pos
+                self._where[d.position_id] = key
+                self._emit("open", pos)
+            else:
+                # 同じポジションへの追加約定（部分約定など）→ 平均建値
+                volume = pos.volume + d.volume
+                price = (pos.price_open * pos.volume + d.price * d.volume) / volume
+                book[d.position_id] = pos._replace(volume=volume, price_open=price)
+            self._emit("change", key)
+            return
+
+        # 決済系はマジックではなくポジションIDで探す（SL/TP決済のdealにも対応）
+        key = self._where.get(d.position_id)
+        if key is None:
+            return
+        self._emit("fill", d)
+        book = self.books[key]
+        pos = book[d.position_id]
+        volume = round(pos.volume - d.volume, 8)
+        if d.entry == mt5.DEAL_ENTRY_INOUT and volume < 0:
+            # ドテン: 残りは逆方向のポジション
+            flipped = mt5.POSITION_TYPE_SELL if pos.type == mt5.POSITION_TYPE_BUY else mt5.POSITION_TYPE_BUY
+            self._emit("close", pos)
+            pos = pos._replace(type=flipped, volume=-volume, price_open=d.price, time=d.time)
+            book[d.position_id] = pos
+            self._emit("open", pos)
+        elif volume <= 0:
+            del book[d.position_id]
+            del self._where[d.position_id]
+            self._emit("close", pos)
+        else:
+            book[d.position_id] = pos._replace(volume=volume)
+        self._emit("change", key)
+
+    def reconcile(self):
+        """positions_get の全件と突き合わせて帳簿を作り直す"""
+        self._last_reconcile = time.monotonic()
+        positions = mt5.positions_get()
+        if positions is None:
+            return
+        fresh = {}
+        where = {}
+        for p in positions:
+            if not self._wanted(p.magic):
+                continue
+            key = (p.symbol, p.magic)
+            fresh.setdefault(key, {})[p.ticket] = TrackedPosition(
+                p.ticket, p.symbol, p.magic, p.type, p.volume, p.price_open, p.time)
+            where[p.ticket] = key
+
+        # 差分だけ通知（取りこぼした約定の補正）
+        for pid, key in self._where.items():
+            if pid not in where:
+                self._emit("close", self.books[key][pid])
+        for pid, key in where.items():
+            if pid not in self._where:
+                self._emit("open", fresh[key][pid])
+
+        changed = set(self.books) | set(fresh)
+        self.books = fresh
+        self._where = where
+        for key in changed:
+            self._emit("change", key)
@@ -0,0 +1,484 @@
+from lazy_modules import mt5, TIMEFRAME_M15
+import os
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from position_tracker import PositionTracker
+from symbol_cache import default_cache
+
+# ローカルのリスクサービス（TRADE_BOT_RISK_ADDR=127.0.0.1:6011 で各ボットから参照）
+# 接続は pickle でやり取りするので、認証キーはリポジトリに置かず TRADE_BOT_RISK_AUTHKEY で渡す
+DEFAULT_ADDRESS = ("127.0.0.1", 6011)
+AUTHKEY_ENV = "TRADE_BOT_RISK_AUTHKEY"
+# 呼び出し側ごとに変えられる上限（RiskClient は can_open のたびにサーバーへ渡す）
+LIMIT_KEYS = ("max_loss_pct", "max_margin_pct", "max_net_lots")
+
+_ZERO = (0.0, 0.0, 0.0, 0.0)
+
+
+def _authkey(authkey=None):
+    """authkey か環境変数 TRADE_BOT_RISK_AUTHKEY の値（どちらも無ければ None）"""
+    if authkey is not None:
+        return authkey
+    key = os.environ.get(AUTHKEY_ENV)
+    return key.encode() if key else None
+
+
+def _totals(positions):
+    """(買いロット, 売りロット, 買い建値×ロット, 売り建値×ロット)"""
+    buy = sell = buy_notional = sell_notional = 0.0
+    for p in positions:
+        if p.type == mt5.POSITION_TYPE_BUY:
+            buy += p.volume
+            buy_notional += p.volume * p.price_open
+        else:
+            sell += p.volume
+            sell_notional += p.volume * p.price_open
+    return buy, sell, buy_notional, sell_notional
+
+
+class RiskAggregator:
+    """口座全体（全マジック・全シンボル）の建玉・証拠金・含み損益をメモリ上で集計する
+
+    PositionTracker の "change" イベントで変わった (symbol, magic) だけを集計し直し、
+    価格は update_price で受け取る。その際、建玉がある他のシンボル（他ボット分）の価格も
+    price_ttl 秒より古ければ端末から取り直す。can_open は端末に問い合わせず、保持している
+    値だけで判定する。
+
+    - 含み損益は symbol_info の trade_tick_value / trade_tick_size で口座通貨に換算（概算）
+    - 証拠金は order_calc_margin の1ロットあたりの値を margin_ttl 秒キャッシュし、
+      両建ては大きい方の建玉で計算する（概算）
+    """
+
+    def __init__(self, max_loss_pct=50.0, max_margin_pct=50.0, max_net_lots=None,
+                 symbols=None, margin_ttl=60.0, account_interval=30.0, price_ttl=1.0):
+        self.max_loss_pct = max_loss_pct        # 含み損が残高の何%で新規を止めるか
+        self.max_margin_pct = max_margin_pct    # 必要証拠金 / 有効証拠金 の上限%
+        self.max_net_lots = dict(max_net_lots or {})  # symbol -> 全ボット合計のネットロット上限（"*" で既定値）
+        self.symbols = symbols or default_cache
+        self.margin_ttl = margin_ttl
+        self.account_interval = account_interval
+        self.price_ttl = price_ttl
+
+        self.tracker = None
+        self.correlation = None  # EwmaCorrelation（任意）: adjust_lots で相関のある重複建玉を減らす
+        self._corr_lock = threading.Lock()
+        self._corr_thread = None
+        self.balance = 0.0
+        self.currency = ""
+        self._lock = threading.Lock()
+        self._exposure = {}      # (symbol, magic) -> _totals
+        self._by_symbol = {}     # symbol -> 全マジック合計の _totals
+        self._prices = {}        # symbol -> (bid, ask)
+        self._priced_at = {}     # symbol -> 価格を受け取った時刻
+        self._pnl = {}           # symbol -> 含み損益（口座通貨）
+        self._margin_lot = {}    # symbol -> (取得時刻, 買い1ロット, 売り1ロット)
+        self._account_at = None
+
+    # --- 更新 ---
+    def attach(self, tracker):
+        """トラッカーのイベントを購読し、現在の帳簿から初期化"""
+        self.tracker = tracker
+        tracker.subscribe(self._on_event)
+        for key in list(tracker.books):
+            self._rebuild(key)
+        self.refresh_account()
+
+    def _on_event(self, event, data):
+        if event == "change":
+            self._rebuild(data)
+        elif event == "close":
+            self._account_at = None  # 残高が変わるので次の update_price で取り直す
+
+    def _rebuild(self, key):
+        symbol = key[0]
+        totals = _totals(self.tracker.positions(*key))
+        with self._lock:
+            if totals[0] or totals[1]:
+                self._exposure[key] = totals
+            else:
+                self._exposure.pop(key, None)
+            rows = [t for (s, _), t in self._exposure.items() if s == symbol]
+            if rows:
+                self._by_symbol[symbol] = tuple(map(sum, zip(*rows)))
+            else:
+                self._by_symbol.pop(symbol, None)
+            self._pnl[symbol] = self._symbol_pnl(symbol, self._by_symbol.get(symbol, _ZERO))
+
+    def update_price(self, symbol, bid, ask):
+        """最新価格を反映（含み損益の再計算と、期限切れの証拠金・口座情報の取り直し）
+
+        呼び出し側のシンボル以外にも建玉があれば、古くなった価格をここで取り直す
+        （そうしないと他ボットの建玉の含み損益・証拠金が 0 のままになる）。
+        """
+        now = time.monotonic()
+        if self._account_at is None or now - self._account_at >= self.account_interval:
+            self.refresh_account()
+        self._set_price(symbol, bid, ask, now)
+        for other in list(self._by_symbol):
+            at = self._priced_at.get(other)
+            if other != symbol and (at is None or now - at >= self.price_ttl):
+                tick = self.symbols.tick(other)
+                if tick is not None:
+                    self._set_price(other, tick.bid, tick.ask, now)
+
+    def _set_price(self, symbol, bid, ask, now):
+        cached = self._margin_lot.get(symbol)
+        if cached is None or now - cached[0] >= self.margin_ttl:
+            self._refresh_margin(symbol, bid, ask)
+        with self._lock:
+            self._prices[symbol] = (bid, ask)
+            self._priced_at[symbol] = now
+            self._pnl[symbol] = self._symbol_pnl(symbol, self._by_symbol.get(symbol, _ZERO))
+
+    def refresh_account(self):
+        info = mt5.account_info()
+        self._account_at = time.monotonic()
+        if info is not None:
+            self.balance = info.balance
+            self.currency = info.currency
+
+    def _refresh_margin(self, symbol, bid, ask):
+        buy = mt5.order_calc_margin(mt5.ORDER_TYPE_BUY, symbol, 1.0, ask)
+        sell = mt5.order_calc_margin(mt5.ORDER_TYPE_SELL, symbol, 1.0, bid)
+        if buy is not None and sell is not None:
+            self._margin_lot[symbol] = (time.monotonic(), buy, sell)
+
+    def _symbol_pnl(self, symbol, totals, price=None):
+        price = price or self._prices.get(symbol)
+        info = self.symbols.info(symbol)
+        if price is None or info is None or not info.trade_tick_size:
+            return 0.0
+        bid, ask = price
+        buy, sell, buy_notional, sell_notional = totals
+        diff = (bid * buy - buy_notional) + (sell_notional - ask * sell)
+        return diff / info.trade_tick_size * info.trade_tick_value
+
+    def _symbol_margin(self, symbol, buy, sell):
+        cached = self._margin_lot.get(symbol)
+        if cached is None:
+            return 0.0
+        return max(buy * cached[1], sell * cached[2])
+
+    # --- 参照 ---
+    def net_lots(self, symbol, magic=None):
+        """ネットロット（買い + / 売り -）。magic 省略で全ボット合計"""
+        totals = self._by_symbol.get(symbol, _ZERO) if magic is None else self._exposure.get((symbol, magic), _ZERO)
+        return totals[0] - totals[1]
+
+    def unrealized(self):
+        return sum(self._pnl.values())
+
+    def margin(self):
+        return sum(self._symbol_margin(s, t[0], t[1]) for s, t in self._by_symbol.items())
+
+    def equity(self):
+        return self.balance + self.unrealized()
+
+    def can_open(self, magic, symbol, side, lots, limits=None):
+        """新規 lots（side: +1 買い / -1 売り）を建ててよいか → (可否, 理由)
+
+        limits（LIMIT_KEYS の dict）を渡すと、その呼び出しだけ上限を置き換える。
+        """
+        limits = limits or {}
+        max_loss_pct = limits.get("max_loss_pct", self.max_loss_pct)
+        max_margin_pct = limits.get("max_margin_pct", self.max_margin_pct)
+        max_net_lots = limits.get("max_net_lots", self.max_net_lots)
+        with self._lock:
+            pnl = sum(self._pnl.values())
+            if self.balance > 0 and max_loss_pct is not None and -pnl >= self.balance * max_loss_pct / 100.0:
+                return False, f"含み損 {pnl:.0f} {self.currency} が残高の{max_loss_pct:g}%に到達"
+
+            buy, sell, _, _ = self._by_symbol.get(symbol, _ZERO)
+            if side > 0:
+                buy += lots
+            else:
+                sell += lots
+            limit = max_net_lots.get(symbol, max_net_lots.get("*"))
+            if limit is not None and abs(buy - sell) > limit + 1e-9:
+                return False, f"{symbol} ネット {buy - sell:+.2f}lot が上限 {limit}lot を超過"
+
+            if max_margin_pct is not None and self.balance > 0:
+                used = sum(self._symbol_margin(s, t[0], t[1])
+                           for s, t in self._by_symbol.items() if s != symbol)
+                used += self._symbol_margin(symbol, buy, sell)
+                equity = self.balance + pnl
+                if equity <= 0 or used / equity * 100.0 > max_margin_pct:
+                    return False, f"証拠金使用率 {used / max(equity, 1e-9) * 100.0:.1f}% が上限 {max_margin_pct:g}% を超過"
+        return True, ""
+
+    def adjust_lots(self, magic, symbol, side, lots, veto=0.8):
+        """他銘柄の建玉と相関で重なる分だけ lots を減らす（相関エンジンが無ければそのまま）"""
+        if self.correlation is None:
+            return lots
+        exposures = {s: t[0] - t[1] for s, t in self._by_symbol.items() if s != symbol}
+        with self._corr_lock:
+            return self.correlation.adjust_lots(symbol, side, lots, exposures, veto)
+
+    def start_correlation(self, symbols, timeframe=TIMEFRAME_M15, interval=5.0):
+        """symbols の確定足で相関行列を更新するスレッドを起動し、adjust_lots で使う
+
+        確定足は interval 秒ごとに BarCloseFeed で確認する（足の確定時刻までは端末に問い合わせない）。
+        """
+        from correlation import EwmaCorrelation, BarCloseFeed
+        engine = EwmaCorrelation(symbols)
+        feed = BarCloseFeed(engine, timeframe)
+        if not feed.warm_up():
+            print("相関の初期化に必要な履歴が取れませんでした（確定足ごとに蓄積します）")
+        self.correlation = engine
+
+        def loop():
+            while True:
+                tick = self.symbols.tick(symbols[0])
+                if tick is not None:
+                    with self._corr_lock:
+                        feed.poll(tick.time)
+                time.sleep(interval)
+
+        self._corr_thread = threading.Thread(target=loop, name="risk-correlation", daemon=True)
+        self._corr_thread.start()
+
+    def snapshot(self):
+        """シンボル・マジックごとの建玉と含み損益（表示・IPC用）"""
+        with self._lock:
+            rows = []
+            for (symbol, magic), totals in sorted(self._exposure.items()):
+                rows.append({
+                    "symbol": symbol, "magic": magic,
+                    "buy": totals[0], "sell": totals[1], "net": totals[0] - totals[1],
+                    "pnl": self._symbol_pnl(symbol, totals),
+                    "margin": self._symbol_margin(symbol, totals[0], totals[1]),
+                })
+            pnl = sum(self._pnl.values())
+        return {"balance": self.balance, "currency": self.currency, "unrealized": pnl,
+                "equity": self.balance + pnl, "margin": self.margin(), "positions": rows}
+
+    def print_snapshot(self):
+        snap = self.snapshot()
+        print(f"残高 {snap['balance']:.0f} / 有効証拠金 {snap['equity']:.0f} {snap['currency']} | "
+              f"含み損益 {snap['unrealized']:+.0f} | 必要証拠金 {snap['margin']:.0f}")
+        for r in snap["positions"]:
+            print(f"  {r['symbol']:<10} magic={r['magic']:<8} 買{r['buy']:.2f} 売{r['sell']:.2f} "
+                  f"ネット{r['net']:+.2f} 損益{r['pnl']:+.0f} 証拠金{r['margin']:.0f}")
+
+
+class RiskServer:
+    """RiskAggregator を multiprocessing.connection でローカル公開する（接続ごとに1スレッド）
+
+    応答は (True, 戻り値) か (False, 例外)。認証キーが無ければ起動しない。
+    """
+
+    OPS = ("can_open", "adjust_lots", "net_lots", "snapshot")
+
+    def __init__(self, risk, address=DEFAULT_ADDRESS, authkey=None):
+        authkey = _authkey(authkey)
+        if not authkey:
+            raise RuntimeError(f"認証キーがありません（環境変数 {AUTHKEY_ENV} を設定してください）")
+        self.risk = risk
+        self.listener = Listener(address, authkey=authkey)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._accept, name="risk-server", daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    op, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if op not in self.OPS:
+                    conn.send((False, ValueError(f"未知の操作: {op}")))
+                    continue
+                try:
+                    reply = (True, getattr(self.risk, op)(*args))
+                except Exception as e:
+                    reply = (False, e)
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+                except Exception as e:  # 例外が pickle できないとき
+                    conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+    def close(self):
+        self.listener.close()
+
+
+class RiskClient:
+    """RiskServer への問い合わせ（RiskAggregator と同じ呼び方）
+
+    limits（LIMIT_KEYS）は can_open のたびにサーバーへ渡し、このボットの上限として使わせる。
+    サーバー側で起きた例外はここで送出し直す。
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None, **limits):
+        authkey = _authkey(authkey)
+        if not authkey:
+            raise RuntimeError(f"認証キーがありません（環境変数 {AUTHKEY_ENV} を設定してください）")
+        self.limits = limits
+        self._conn = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+
+    def _call(self, op, *args):
+        with self._lock:
+            self._conn.send((op, args))
+            ok, value = self._conn.recv()
+        if not ok:
+            raise value
+        return value
+
+    def can_open(self, magic, symbol, side, lots, limits=None):
+        return tuple(self._call("can_open", magic, symbol, side, lots, {**self.limits, **(limits or {})}))
+
+    def adjust_lots(self, magic, symbol, side, lots, veto=0.8):
+        return self._call("adjust_lots", magic, symbol, side, lots, veto)
+
+    def net_lots(self, symbol, magic=None):
+        return self._call("net_lots", symbol, magic)
+
+    def snapshot(self):
+        return self._call("snapshot")
+
+    def update_price(self, symbol, bid, ask):
+        pass  # 価格はサーバー側で取得する
+
+    def close(self):
+        self._conn.close()
+
+
+def _parse_address(text):
+    host, _, port = text.rpartition(":")
+    return (host or DEFAULT_ADDRESS[0], int(port))
+
+
+def connect_risk(tracker, corr_symbols=None, corr_timeframe=TIMEFRAME_M15, **limits):
+    """TRADE_BOT_RISK_ADDR があればリスクサービスへ接続、なければプロセス内で集計
+
+    プロセス内の場合は tracker の帳簿をそのまま使うので、他ボットの建玉も見るには
+    tracker を magics=None（全マジック）で作っておくこと。
+    corr_symbols（省略時は TRADE_BOT_RISK_CORR=USDJPY,EURUSD,...）を渡すと、プロセス内でも
+    相関行列を更新して adjust_lots に使う。リスクサービス利用時の相関はサービス側の --corr で決まる。
+    リスクサービスに渡せるのは LIMIT_KEYS の上限だけで、それ以外の引数は無視する。
+    """
+    if corr_symbols is None and os.environ.get("TRADE_BOT_RISK_CORR"):
+        corr_symbols = os.environ["TRADE_BOT_RISK_CORR"].split(",")
+    addr = os.environ.get("TRADE_BOT_RISK_ADDR")
+    if addr:
+        remote = {k: v for k, v in limits.items() if k in LIMIT_KEYS}
+        ignored = sorted(set(limits) - set(remote))
+        try:
+            client = RiskClient(_parse_address(addr), **remote)
+            if ignored:
+                print(f"リスクサービス利用時は {', '.join(ignored)} を無視します")
+            return client
+        except (OSError, RuntimeError, AuthenticationError) as e:
+            print(f"リスクサービスに接続できません ({addr}): {e} → プロセス内で集計します")
+    risk = RiskAggregator(**limits)
+    risk.attach(tracker)
+    if corr_symbols:
+        risk.start_correlation(corr_symbols, corr_timeframe)
+    return risk
+
+
+def serve(address=DEFAULT_ADDRESS, interval=0.5, report_every=60.0, corr_symbols=None,
+          timeframe=TIMEFRAME_M15, **limits):
+    """全マジックを追跡してリスクサービスを提供（MT5初期化済みであること）
+
+    corr_symbols を渡すと、その銘柄の確定足で相関行列を更新し adjust_lots に使う。
+    """
+    tracker = PositionTracker()
+    risk = RiskAggregator(**limits)
+    tracker.start()
+    risk.attach(tracker)
+    if corr_symbols:
+        risk.start_correlation(corr_symbols, timeframe, interval)
+    server = RiskServer(risk, address)
+    server.start()
+    print(f"リスクサービス起動: {address[0]}:{address[1]}")
+
+    last_report = 0.0
+    try:
+        while True:
+            tracker.poll()
+            for symbol in {s for s, _ in tracker.books}:
+                tick = risk.symbols.tick(symbol)
+                if tick is not None:
+                    risk.update_price(symbol, tick.bid, tick.ask)
+            if time.monotonic() - last_report >= report_every:
+                risk.print_snapshot()
+                last_report = time.monotonic()
+            time.sleep(interval)
+    finally:
+        server.close()
+
+
+def _selftest():
+    """端末なしの確認: 価格を受け取るのが1シンボルだけでも、他シンボルの建玉が上限に効くこと
+
+    MetaTrader5 の代わりにスタブを入れて動かす（python risk_aggregator.py --selftest）。
+    """
+    from types import SimpleNamespace as NS
+    from symbol_cache import SymbolCache
+
+    ticks = {"USDJPY": NS(bid=150.00, ask=150.02), "BTCUSD": NS(bid=57000.0, ask=57010.0)}
+    infos = {"USDJPY": NS(trade_tick_size=0.001, trade_tick_value=1.0),
+             "BTCUSD": NS(trade_tick_size=0.01, trade_tick_value=0.01)}
+    stub = NS(POSITION_TYPE_BUY=0, POSITION_TYPE_SELL=1, ORDER_TYPE_BUY=0, ORDER_TYPE_SELL=1,
+              account_info=lambda: NS(balance=10_000.0, currency="USD"),
+              symbol_info=infos.get, symbol_info_tick=ticks.get,
+              order_calc_margin=lambda kind, symbol, lots, price: price * lots / 100.0)
+    sys.modules["MetaTrader5"] = stub
+
+    class Tracker:
+        # 別ボット（magic=2）が BTCUSD を 60000 で 1 ロット買っている
+        books = {("BTCUSD", 2): {1: None}}
+
+        def subscribe(self, callback):
+            pass
+
+        def positions(self, symbol, magic):
+            return [NS(type=0, volume=1.0, price_open=60_000.0)] if symbol == "BTCUSD" else []
+
+    risk = RiskAggregator(max_loss_pct=50.0, max_margin_pct=50.0, symbols=SymbolCache())
+    risk.attach(Tracker())
+    risk.update_price("USDJPY", 150.00, 150.02)  # このボットは USDJPY の価格しか渡さない
+    assert abs(risk.unrealized() - -3000.0) < 1e-6, risk.unrealized()
+    assert abs(risk.margin() - 570.1) < 1e-6, risk.margin()
+    ok, reason = risk.can_open(1, "USDJPY", 1, 0.1)
+    assert ok, reason
+    ok, reason = risk.can_open(1, "USDJPY", 1, 0.1, {"max_loss_pct": 25.0})
+    assert not ok and "含み損" in reason, reason
+    ok, reason = risk.can_open(1, "USDJPY", 1, 0.1, {"max_margin_pct": 5.0})
+    assert not ok and "証拠金" in reason, reason
+    print("selftest OK")
+
+
+if __name__ == "__main__":
+    if "--selftest" in sys.argv:
+        sys.exit(_selftest())
+    if not mt5.initialize():
+        sys.exit(f"MT5初期化失敗: {mt5.last_error()}")
+    # python risk_aggregator.py [host:port] [--corr=USDJPY,EURUSD,BTCUSD]
+    args = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    positional = [a for a in sys.argv[1:] if not a.startswith("--")]
+    try:
+        serve(_parse_address(positional[0]) if positional else DEFAULT_ADDRESS,
+              corr_symbols=args["corr"].split(",") if "corr" in args else None)
+    except KeyboardInterrupt:
+        print("\n停止しました")
+    finally:
+        mt5.shutdown()
@@ -0,0 +1,326 @@
+from lazy_modules import mt5, pd, TIMEFRAME_M15
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import re
+import time
+import zlib
+
+# copy_rates_from_pos が返す構造化配列と同じレイアウト
+RATES_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('tick_volume', '<u8'),
+    ('spread', '<i4'),
+    ('real_volume', '<u8'),
+])
+
+# ヘッダー: [seq, count, 最新バー時刻, 予備]  seqが奇数の間は書き込み中
+HEADER_SLOTS = 4
+HEADER_BYTES = HEADER_SLOTS * 8
+
+SIGNAL_NONE = 0
+SIGNAL_BUY = 1
+SIGNAL_SELL = -1
+
+
+class SharedBars:
+    """1シンボル分のバー配列を共有メモリ上に置くクラス"""
+
+    def __init__(self, symbol, capacity=500, name=None, create=True):
+        self.symbol = symbol
+        self.capacity = capacity
+        size = HEADER_BYTES + capacity * RATES_DTYPE.itemsize
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=self.shm.buf)
+        self.rates = np.ndarray((capacity,), dtype=RATES_DTYPE,
+                                buffer=self.shm.buf, offset=HEADER_BYTES)
+        if create:
+            self.header[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, rates):
+        """フェッチしたバーをその場で上書き（seqlock）"""
+        n = min(len(rates), self.capacity)
+        self.header[0] += 1  # 奇数 = 書き込み中
+        self.rates[:n] = rates[-n:]
+        self.header[1] = n
+        self.header[2] = int(rates['time'][-1]) if n else 0
+        self.header[0] += 1  # 偶数 = 確定
+
+    def read(self, retries=100):
+        """一貫性のあるスナップショットをコピーして返す"""
+        for _ in range(retries):
+            seq = int(self.header[0])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            n = int(self.header[1])
+            snapshot = self.rates[:n].copy()
+            if int(self.header[0]) == seq:
+                return seq, snapshot
+        return None, None
+
+    def close(self, unlink=False):
+        # ndarrayの参照を先に外さないとcloseできない
+        self.header = None
+        self.rates = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _make_strategy(kind, symbol, timeframe):
+    """ワーカー側で戦略インスタンスを生成"""
+    if kind == "freshalgo":
+        from trend import FreshAlgoTrader_Fixed
+        return FreshAlgoTrader_Fixed(symbol, timeframe=timeframe)
+    if kind == "structure":
+        from MarketStructureTrader import MarketStructureTrader
+        return MarketStructureTrader(symbol, timeframe=timeframe)
+    raise ValueError(f"未知の戦略: {kind}")
+
+
+def _evaluate(strategy, kind, df):
+    """戦略を1回評価して (signal, entry, sl, tp) を返す"""
+    if kind == "freshalgo":
+        if len(df) < 300:
+            return SIGNAL_NONE, 0.0, 0.0, 0.0
+        df = strategy.analyze_signals(df)
+        if df['bull_signal'].iloc[-2] and not df['bull_signal'].iloc[-3]:
+            entry = float(df['close'].iloc[-2])
+            sl, tp1, _, _ = strategy.calculate_sl_tp(df, entry, "BUY")
+            return SIGNAL_BUY, entry, float(sl), float(tp1)
+        if df['bear_signal'].iloc[-2] and not df['bear_signal'].iloc[-3]:
+            entry = float(df['close'].iloc[-2])
+            sl, tp1, _, _ = strategy.calculate_sl_tp(df, entry, "SELL")
+            return SIGNAL_SELL, entry, float(sl), float(tp1)
+        return SIGNAL_NONE, 0.0, 0.0, 0.0
+
+    signal = strategy.generate_trading_signal(df)
+    entry = float(df['close'].iloc[-1])
+    if signal == "BUY":
+        return SIGNAL_BUY, entry, 0.0, 0.0
+    if signal == "SELL":
+        return SIGNAL_SELL, entry, 0.0, 0.0
+    return SIGNAL_NONE, entry, 0.0, 0.0
+
+
+def _worker_main(tasks, results, timeframe):
+    """常駐ワーカー: 共有メモリにアタッチして評価し、小さなレコードだけ返す
+
+    結果の先頭にはタスクの評価番号を付けて返す（親が古い結果を捨てられるように）。
+    """
+    segments = {}
+    strategies = {}
+    last_seq = {}
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        eval_id, symbol, seg_name, kind = task
+        started = time.perf_counter()
+        try:
+            seg = segments.get(seg_name)
+            if seg is None:
+                seg = SharedBars(symbol, name=seg_name, create=False,
+                                 capacity=_capacity_of(seg_name))
+                segments[seg_name] = seg
+            seq, rates = seg.read()
+            # 前回から更新がなければ評価を省略
+            if seq is None or last_seq.get((symbol, kind)) == seq:
+                results.put((eval_id, symbol, kind, 0, SIGNAL_NONE, 0.0, 0.0, 0.0, 0.0))
+                continue
+            last_seq[(symbol, kind)] = seq
+
+            strategy = strategies.get((symbol, kind))
+            if strategy is None:
+                strategy = _make_strategy(kind, symbol, timeframe)
+                strategies[(symbol, kind)] = strategy
+
+            df = pd.DataFrame(rates)
+            bar_time = int(df['time'].iloc[-2]) if len(df) >= 2 else 0
+            df['time'] = pd.to_datetime(df['time'], unit='s')
+            signal, entry, sl, tp = _evaluate(strategy, kind, df)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            results.put((eval_id, symbol, kind, bar_time, signal, entry, sl, tp, elapsed_ms))
+        except Exception as e:
+            print(f"[worker] {symbol}/{kind} 評価エラー: {e}")
+            results.put((eval_id, symbol, kind, 0, SIGNAL_NONE, 0.0, 0.0, 0.0, 0.0))
+
+    for seg in segments.values():
+        seg.close()
+
+
+# セグメント名に容量を埋め込んで、ワーカーが別途問い合わせなくて済むようにする
+# シンボルは英数字以外を "-" にして使い、置き換えで重なっても区別できるよう crc32 を添える
+def _segment_name(symbol, capacity):
+    safe = re.sub(r"[^0-9A-Za-z]", "-", symbol)
+    tag = zlib.crc32(symbol.encode())
+    return f"tb_{safe}_{tag:08x}_{capacity}_{mp.current_process().pid}"
+
+
+def _capacity_of(seg_name):
+    return int(seg_name.split("_")[-2])
+
+
+class SignalPool:
+    """シンボルごとのシグナル評価をプロセスプールで並列化する
+
+    親プロセスがMT5接続と発注を持ち、ワーカーは共有メモリ上のバーを読むだけ。
+    同じシンボルは常に同じワーカーへ回すので、MarketStructureの状態も保たれる。
+    """
+
+    def __init__(self, symbols, timeframe=TIMEFRAME_M15,
+                 strategies=("freshalgo",), workers=None, bars=500):
+        self.symbols = list(symbols)
+        self.timeframe = timeframe
+        self.strategies = tuple(strategies)
+        self.workers = workers or max(1, min(len(self.symbols), mp.cpu_count() - 1))
+        self.bars = bars
+
+        self.segments = {}
+        self._eval_id = 0
+        self._tasks = []
+        self._results = None
+        self._procs = []
+
+    def start(self):
+        """共有メモリ確保とワーカー起動"""
+        for symbol in self.symbols:
+            self.segments[symbol] = SharedBars(
+                symbol, capacity=self.bars, name=_segment_name(symbol, self.bars))
+
+        ctx = mp.get_context("spawn")
+        self._results = ctx.Queue()
+        for _ in range(self.workers):
+            q = ctx.Queue()
+            p = ctx.Process(target=_worker_main,
+                            args=(q, self._results, self.timeframe), daemon=True)
+            p.start()
+            self._tasks.append(q)
+            self._procs.append(p)
+        print(f"SignalPool起動: {len(self.symbols)}シンボル / {self.workers}ワーカー")
+
+    def refresh(self):
+        """MT5からバーを取得して共有メモリをその場で更新"""
+        updated = 0
+        for symbol, seg in self.segments.items():
+            rates = mt5.copy_rates_from_pos(symbol, self.timeframe, 0, self.bars)
+            if rates is None or len(rates) == 0:
+                continue
+            seg.write(rates)
+            updated += 1
+        return updated
+
+    def evaluate(self, timeout=30.0):
+        """全シンボルを評価してシグナルレコードのリストを返す
+
+        タイムアウトで取り残した結果は、次回以降に届いても評価番号が違うので捨てる。
+        """
+        self._eval_id += 1
+        eval_id = self._eval_id
+        pending = 0
+        for i, symbol in enumerate(self.symbols):
+            q = self._tasks[i % self.workers]
+            for kind in self.strategies:
+                q.put((eval_id, symbol, self.segments[symbol].name, kind))
+                pending += 1
+
+        records = []
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"評価タイムアウト: 残り{pending}件")
+                break
+            try:
+                result = self._results.get(timeout=remaining)
+            except Exception:
+                break
+            if result[0] != eval_id:
+                continue  # 前回タイムアウトした評価の結果
+            records.append(result[1:])
+            pending -= 1
+        return records
+
+    def stop(self):
+        """ワーカー停止と共有メモリ解放"""
+        for q in self._tasks:
+            q.put(None)
+        for p in self._procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        for seg in self.segments.values():
+            seg.close(unlink=True)
+        self.segments.clear()
+        self._tasks.clear()
+        self._procs.clear()
+
+
+def run_pool(symbols, timeframe=TIMEFRAME_M15, strategies=("freshalgo",),
+             workers=None, interval=30):
+    """並列評価のメインループ（発注は親プロセスで行う）"""
+    if not mt5.initialize():
+        print("MT5初期化失敗")
+        return
+
+    from trend import FreshAlgoTrader_Fixed
+    from MarketStructureTrader import MarketStructureTrader
+
+    routers = {}
+    for symbol in symbols:
+        routers[(symbol, "freshalgo")] = FreshAlgoTrader_Fixed(symbol, timeframe=timeframe)
+        routers[(symbol, "structure")] = MarketStructureTrader(symbol, timeframe=timeframe)
+
+    pool = SignalPool(symbols, timeframe, strategies, workers)
+    pool.start()
+    last_bar = {}
+    try:
+        while True:
+            started = time.perf_counter()
+            pool.refresh()
+            records = pool.evaluate()
+            for symbol, kind, bar_time, signal, entry, sl, tp, _ in records:
+                if signal == SIGNAL_NONE:
+                    continue
+                # 同じ確定バーで二重発注しない
+                if last_bar.get((symbol, kind)) == bar_time:
+                    continue
+                last_bar[(symbol, kind)] = bar_time
+                side = "BUY" if signal == SIGNAL_BUY else "SELL"
+                trader = routers[(symbol, kind)]
+                if kind == "freshalgo":
+                    if trader.check_positions() == 0:
+                        trader.send_order(side, sl, tp)
+                else:
+                    if len(trader.check_positions()) == 0:
+                        order_type = mt5.ORDER_TYPE_BUY if signal == SIGNAL_BUY else mt5.ORDER_TYPE_SELL
+                        trader.open_position(order_type)
+            elapsed = time.perf_counter() - started
+            print(f"[{time.strftime('%H:%M:%S')}] {len(records)}件評価 ({elapsed:.2f}秒)")
+            time.sleep(max(0.0, interval - elapsed))
+    except KeyboardInterrupt:
+        print("\n停止しました")
+    finally:
+        pool.stop()
+        mt5.shutdown()
+
+
+# 使用例
+if __name__ == "__main__":
+    run_pool(
+        symbols=["BTCUSD", "ETHUSD", "USDJPY", "EURUSD"],
+        timeframe=mt5.TIMEFRAME_M15,
+        strategies=("freshalgo", "structure"),
+    )
@@ -0,0 +1,138 @@
+import math
+from bisect import bisect_left, insort
+
+
+class RollingSpreadStats:
+    """スプレッドとボラティリティを1ティックO(1)で更新するストリーミング推定器
+
+    固定長のリングバッファで直近 window ティックの
+      - スプレッド平均（累積和の差分更新）
+      - スプレッドEWMA
+      - スプレッド分位点（整数ポイントのヒストグラムを増減。max_spread_points を超えた値は
+        ソート済みの溢れリストに正確な値のまま置くので、上限で頭打ちにならない）
+      - 実現ボラティリティ（mid対数リターン二乗の累積和）
+    を持つ。毎ループ読み出してもティック履歴を再計算しない。
+    """
+
+    def __init__(self, point, window=1000, ewma_alpha=0.05, max_spread_points=5000):
+        self.point = point
+        self.window = window
+        self.alpha = ewma_alpha
+        self.max_bucket = max_spread_points
+
+        self._spreads = [0] * window      # ポイント単位のスプレッド
+        self._sq_returns = [0.0] * window
+        self._pos = 0
+        self.count = 0
+
+        self._spread_sum = 0
+        self._sq_sum = 0.0
+        self._hist = [0] * (max_spread_points + 1)
+        self._overflow = []  # max_spread_points を超えたスプレッド（昇順）
+        self._last_mid = None
+        self.ewma = None
+        self.last_spread = 0
+
+    def update(self, bid, ask):
+        """1ティック反映"""
+        spread = int(round((ask - bid) / self.point))
+        if spread < 0:
+            spread = 0
+
+        mid = (bid + ask) * 0.5
+        r2 = 0.0
+        if self._last_mid is not None and self._last_mid > 0 and mid > 0:
+            r = math.log(mid / self._last_mid)
+            r2 = r * r
+        self._last_mid = mid
+
+        i = self._pos
+        if self.count == self.window:
+            # 一番古い値を窓から外す
+            old = self._spreads[i]
+            self._spread_sum -= old
+            if old > self.max_bucket:
+                del self._overflow[bisect_left(self._overflow, old)]
+            else:
+                self._hist[old] -= 1
+            self._sq_sum -= self._sq_returns[i]
+        else:
+            self.count += 1
+
+        self._spreads[i] = spread
+        self._sq_returns[i] = r2
+        self._spread_sum += spread
+        if spread > self.max_bucket:
+            insort(self._overflow, spread)
+        else:
+            self._hist[spread] += 1
+        self._sq_sum += r2
+        if i + 1 < self.window:
+            self._pos = i + 1
+        else:
+            # 1周ごとに浮動小数点の誤差をリセット（償却O(1)）
+            self._pos = 0
+            self._sq_sum = math.fsum(self._sq_returns)
+
+        self.last_spread = spread
+        self.ewma = spread if self.ewma is None else self.ewma + self.alpha * (spread - self.ewma)
+
+    def mean(self):
+        """窓内の平均スプレッド（ポイント）"""
+        return self._spread_sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """窓内のスプレッド分位点（ポイント）
+
+        ヒストグラムを走査するのでコストはバケット数で決まり、ティック数には依存しない。
+        上限を超えた分に入る分位点は溢れリストから正確な値を返す。
+        """
+        if not self.count:
+            return 0
+        target = q * self.count
+        in_hist = self.count - len(self._overflow)
+        if target <= in_hist:
+            seen = 0
+            for spread, n in enumerate(self._hist):
+                seen += n
+                if seen >= target:
+                    return spread
+        k = min(len(self._overflow) - 1, max(0, math.ceil(target) - in_hist - 1))
+        return self._overflow[k]
+
+    def realized_vol(self):
+        """窓内の実現ボラティリティ（1ティックあたりの対数リターン標準偏差）"""
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(max(self._sq_sum, 0.0) / (self.count - 1))
+
+    def snapshot(self):
+        return {
+            "last": self.last_spread,
+            "mean": self.mean(),
+            "ewma": self.ewma or 0.0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "vol": self.realized_vol(),
+            "count": self.count,
+        }
+
+
+if __name__ == "__main__":
+    import random
+
+    # 上限（max_spread_points）を超えるスプレッドでも分位点が窓内の正確な値と一致すること
+    rng = random.Random(0)
+    stats = RollingSpreadStats(point=0.01, window=500, max_spread_points=100)
+    window = []
+    for i in range(5000):
+        spread = rng.choice((rng.randint(0, 80), rng.randint(50, 400), rng.randint(2000, 9000)))
+        stats.update(60000.0, 60000.0 + spread * 0.01)
+        window = (window + [spread])[-500:]
+        if i % 97 == 0:
+            ordered = sorted(window)
+            for q in (0.1, 0.5, 0.9, 0.99, 1.0):
+                expected = ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+                assert stats.quantile(q) == expected, (i, q, stats.quantile(q), expected)
+            assert stats.mean() == sum(window) / len(window)
+    print("p90 =", stats.snapshot()["p90"], "pt（上限 100pt）: OK")
@@ -0,0 +1,140 @@
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from signal_pool import RATES_DTYPE
+from async_log import get_logger
+
+log = get_logger("state")
+
+# ファイル = ヘッダー + zlib(JSONメタ + バー配列のバイト列)
+#   magic, スキーマ版数, 予備, crc32(圧縮後本体), JSONメタの長さ, 圧縮後本体の長さ
+HEADER = struct.Struct("<4sHHIII")
+MAGIC = b"TBSS"
+SCHEMA_VERSION = 1
+
+STATE_DIR = os.environ.get("TRADE_BOT_STATE_DIR", "state")
+
+
+def snapshot_path(strategy, symbol, timeframe, directory=None):
+    return os.path.join(directory or STATE_DIR, f"{strategy}_{symbol}_{timeframe}.snap")
+
+
+def encode(meta, rates=None):
+    meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode()
+    blob = b"" if rates is None else np.ascontiguousarray(rates, dtype=RATES_DTYPE).tobytes()
+    body = zlib.compress(meta_bytes + blob, 6)
+    return HEADER.pack(MAGIC, SCHEMA_VERSION, 0, zlib.crc32(body), len(meta_bytes), len(body)) + body
+
+
+def decode(data, schema=SCHEMA_VERSION):
+    """(meta, rates) を返す。壊れている・版数違いなら ValueError"""
+    if len(data) < HEADER.size:
+        raise ValueError("ヘッダーが短い")
+    magic, version, _, crc, meta_len, body_len = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("スナップショットではありません")
+    if version != schema:
+        raise ValueError(f"スキーマ版数が違います ({version} != {schema})")
+    body = data[HEADER.size:HEADER.size + body_len]
+    if len(body) != body_len or zlib.crc32(body) != crc:
+        raise ValueError("CRC不一致（書き込み途中か破損）")
+    raw = zlib.decompress(body)
+    meta = json.loads(raw[:meta_len])
+    blob = raw[meta_len:]
+    rates = np.frombuffer(blob, dtype=RATES_DTYPE).copy() if blob else None
+    return meta, rates
+
+
+def save(path, meta, rates=None):
+    """一時ファイルに書いてから os.replace で置き換える（途中で落ちても前回分が残る）"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(encode(meta, rates))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load(path, schema=SCHEMA_VERSION):
+    """(meta, rates) または None（無い・壊れている場合）"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    try:
+        return decode(data, schema)
+    except (ValueError, zlib.error, json.JSONDecodeError) as e:
+        log.warning("スナップショットを破棄: {path} ({error})", path=path, error=e)
+        return None
+
+
+def frame_to_rates(df):
+    """get_rates / BarHistory.frame の DataFrame → RATES_DTYPE 配列"""
+    rates = np.zeros(len(df), dtype=RATES_DTYPE)
+    rates['time'] = df['time'].values.astype('datetime64[s]').astype(np.int64)
+    for name in RATES_DTYPE.names[1:]:
+        if name in df:
+            rates[name] = df[name].values
+    return rates
+
+
+def merge_rates(saved, fresh, rtol=1e-6):
+    """保存済みの確定バーで fresh の前側を補う
+
+    両者が重なっていない（間が空いた）場合や、重なったバーの値が一致しない場合
+    （別シンボル・別サーバーのデータなど）は None。重なり部分は fresh を優先する。
+    """
+    if saved is None or not len(saved):
+        return fresh
+    if not len(fresh):
+        return None
+    first = fresh['time'][0]
+    if saved['time'][-1] < first:
+        return None
+    overlap = saved[saved['time'] >= first]
+    idx = np.searchsorted(fresh['time'], overlap['time'])
+    idx = idx[idx < len(fresh)]
+    matched = fresh[idx]
+    overlap = overlap[:len(matched)]
+    same_time = matched['time'] == overlap['time']
+    if not same_time.any():
+        return None
+    if not np.allclose(matched['close'][same_time], overlap['close'][same_time], rtol=rtol):
+        return None
+    return np.concatenate([saved[saved['time'] < first], fresh])
+
+
+class Snapshotter:
+    """interval 秒ごとにスナップショットを書く"""
+
+    def __init__(self, path, interval=60.0):
+        self.path = path
+        self.interval = interval
+        self._last = 0.0
+
+    def due(self):
+        return time.monotonic() - self._last >= self.interval
+
+    def save(self, meta, rates=None):
+        started = time.perf_counter()
+        try:
+            save(self.path, meta, rates)
+        except OSError as e:
+            log.warning("スナップショット保存失敗: {error}", error=e)
+            return False
+        self._last = time.monotonic()
+        log.debug("スナップショット保存 {path} ({ms:.1f}ms)", path=self.path,
+                  ms=(time.perf_counter() - started) * 1000)
+        return True
+
+    def load(self):
+        return load(self.path)
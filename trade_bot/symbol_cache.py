@@ -0,0 +1,79 @@
+from lazy_modules import mt5
+import time
+
+
+class SymbolCache:
+    """symbol_info / symbol_info_tick のキャッシュ
+
+    シンボル仕様（digits, point, filling_mode など）はセッション中ほぼ変わらないので
+    一度だけ取得し、ティックは短いTTLの間だけ使い回す。
+    """
+
+    def __init__(self, tick_ttl=0.25):
+        self.tick_ttl = tick_ttl
+        self._info = {}
+        self._selected = set()
+        self._ticks = {}
+
+    def info(self, symbol):
+        """シンボル仕様（セッション中キャッシュ）"""
+        info = self._info.get(symbol)
+        if info is None:
+            info = mt5.symbol_info(symbol)
+            if info is None:
+                return None
+            self._info[symbol] = info
+        return info
+
+    def ensure_selected(self, symbol):
+        """気配値表示に追加済みか確認（初回のみsymbol_select）"""
+        if symbol in self._selected:
+            return True
+        info = self.info(symbol)
+        if info is None:
+            return False
+        if not info.visible and not mt5.symbol_select(symbol, True):
+            return False
+        self._selected.add(symbol)
+        return True
+
+    def tick(self, symbol, max_age=None):
+        """最新ティック（TTL内なら前回値を返す）"""
+        ttl = self.tick_ttl if max_age is None else max_age
+        now = time.monotonic()
+        cached = self._ticks.get(symbol)
+        if cached is not None and now - cached[0] <= ttl:
+            return cached[1]
+        tick = mt5.symbol_info_tick(symbol)
+        if tick is None:
+            return None
+        self._ticks[symbol] = (now, tick)
+        return tick
+
+    def filling_mode(self, symbol):
+        """対応しているフィリングモードを判定（FOK > IOC > RETURN）"""
+        info = self.info(symbol)
+        if info is None:
+            return None
+        if info.filling_mode & 1:
+            return mt5.ORDER_FILLING_FOK
+        if info.filling_mode & 2:
+            return mt5.ORDER_FILLING_IOC
+        if info.filling_mode & 4:
+            return mt5.ORDER_FILLING_RETURN
+        return None
+
+    def invalidate(self, symbol=None):
+        """キャッシュ破棄（再接続時など）"""
+        if symbol is None:
+            self._info.clear()
+            self._selected.clear()
+            self._ticks.clear()
+            return
+        self._info.pop(symbol, None)
+        self._selected.discard(symbol)
+        self._ticks.pop(symbol, None)
+
+
+# プロセス内で共有するデフォルトのキャッシュ
+default_cache = SymbolCache()
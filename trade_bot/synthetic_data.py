@@ -0,0 +1,70 @@
+import numpy as np
+
+from signal_pool import RATES_DTYPE
+
+# copy_ticks_from が返す構造化配列と同じレイアウト
+TICK_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('bid', '<f8'),
+    ('ask', '<f8'),
+    ('last', '<f8'),
+    ('volume', '<u8'),
+    ('time_msc', '<i8'),
+    ('flags', '<u4'),
+    ('volume_real', '<f8'),
+])
+
+
+def _returns(rng, n, vol, regime_len):
+    """トレンド局面が入れ替わる対数リターン（指標がシグナルを出す程度の値動き）"""
+    n_regimes = n // regime_len + 1
+    drift = rng.choice((-1.0, 0.0, 1.0), size=n_regimes) * vol * 0.15
+    return rng.standard_normal(n) * vol + np.repeat(drift, regime_len)[:n]
+
+
+def make_rates(n, seed=0, start=1_700_000_000, step=900, price=100.0, vol=0.002,
+               spread=20, regime_len=400):
+    """シード固定の合成 OHLCV（copy_rates_from_pos と同じ dtype）"""
+    rng = np.random.default_rng(seed)
+    close = price * np.exp(np.cumsum(_returns(rng, n, vol, regime_len)))
+    open_ = np.empty(n)
+    open_[0] = price
+    open_[1:] = close[:-1]
+    body_high = np.maximum(open_, close)
+    body_low = np.minimum(open_, close)
+    wick = np.abs(rng.standard_normal((2, n))) * vol * 0.5 * close
+
+    rates = np.zeros(n, dtype=RATES_DTYPE)
+    rates['time'] = start + np.arange(n, dtype=np.int64) * step
+    rates['open'] = open_
+    rates['high'] = body_high + wick[0]
+    rates['low'] = body_low - wick[1]
+    rates['close'] = close
+    rates['tick_volume'] = rng.poisson(200, n) + 1
+    rates['spread'] = spread
+    return rates
+
+
+def make_frame(n, seed=0, **kwargs):
+    """get_rates と同じ形の DataFrame（time は datetime）"""
+    import pandas as pd
+    df = pd.DataFrame(make_rates(n, seed, **kwargs))
+    df['time'] = pd.to_datetime(df['time'], unit='s')
+    return df
+
+
+def make_ticks(n, seed=0, start_msc=1_700_000_000_000, mean_gap_ms=250, price=100.0,
+               vol=0.0002, point=0.001, spread_points=(10, 40)):
+    """シード固定の合成ティック（copy_ticks_from と同じ dtype）"""
+    rng = np.random.default_rng(seed)
+    msc = start_msc + np.cumsum(rng.exponential(mean_gap_ms, n).astype(np.int64) + 1)
+    mid = price * np.exp(np.cumsum(rng.standard_normal(n) * vol))
+    spread = rng.integers(spread_points[0], spread_points[1] + 1, n) * point
+
+    ticks = np.zeros(n, dtype=TICK_DTYPE)
+    ticks['time_msc'] = msc
+    ticks['time'] = msc // 1000
+    ticks['bid'] = np.round((mid - spread / 2) / point) * point
+    ticks['ask'] = ticks['bid'] + spread
+    ticks['flags'] = 6  # BID | ASK
+    return ticks
@@ -0,0 +1,117 @@
+import json
+import multiprocessing as mp
+import os
+import time
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".mt5_terminals.json")
+PROBE_TIMEOUT = 10.0  # sec / terminal
+
+
+def _probe_worker(exe, timeout_ms, out):
+    """別プロセスで1端末に接続して口座情報を取る（MT5の接続はプロセスに1つだけ）"""
+    import MetaTrader5 as mt5
+    info = {"exe": exe}
+    try:
+        if not mt5.initialize(path=exe, timeout=timeout_ms):
+            info["error"] = str(mt5.last_error())
+        else:
+            acc = mt5.account_info()
+            if acc is not None:
+                info.update(login=acc.login, server=acc.server, balance=acc.balance,
+                            currency=acc.currency, name=acc.name)
+    except Exception as e:
+        info["error"] = str(e)
+    finally:
+        try:
+            mt5.shutdown()
+        except Exception:
+            pass
+    out.put(info)
+
+
+def load_cache(path=CACHE_PATH) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache, path=CACHE_PATH):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def _mtime(exe):
+    try:
+        return os.path.getmtime(exe)
+    except OSError:
+        return None
+
+
+def probe_terminals(exes, timeout=PROBE_TIMEOUT, use_cache=True, cache_path=CACHE_PATH) -> list[dict]:
+    """端末ごとの口座情報を並列に取得する
+
+    exeのパスと更新時刻が同じならディスクキャッシュを使い、接続しない。
+    キャッシュに無い端末だけ1端末1プロセスで同時に接続し、timeout を過ぎたものは打ち切る。
+    """
+    cache = load_cache(cache_path) if use_cache else {}
+    rows = {}
+    todo = []
+    for exe in exes:
+        hit = cache.get(exe)
+        if hit and hit.get("mtime") == _mtime(exe) and "login" in hit:
+            rows[exe] = dict(hit, cached=True)
+        else:
+            todo.append(exe)
+
+    if todo:
+        ctx = mp.get_context("spawn")
+        out = ctx.Queue()
+        procs = []
+        for exe in todo:
+            p = ctx.Process(target=_probe_worker, args=(exe, int(timeout * 1000), out), daemon=True)
+            p.start()
+            procs.append(p)
+
+        deadline = time.monotonic() + timeout
+        pending = len(procs)
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                info = out.get(timeout=remaining)
+            except Exception:
+                break
+            pending -= 1
+            info["mtime"] = _mtime(info["exe"])
+            info["probed_at"] = time.time()
+            rows[info["exe"]] = info
+            if "login" in info:
+                cache[info["exe"]] = info
+
+        for p in procs:
+            p.join(timeout=0.1)
+            if p.is_alive():
+                p.terminate()
+        for exe in todo:
+            rows.setdefault(exe, {"exe": exe, "error": "timeout"})
+        if use_cache:
+            save_cache(cache, cache_path)
+
+    return [rows[exe] for exe in exes]
+
+
+def pick_headless(rows, login=None, server=None) -> str | None:
+    """GUIなしで端末を選ぶ（login/server指定 > 接続できた最初の端末）"""
+    ok = [r for r in rows if "login" in r]
+    for r in ok:
+        if login is not None and str(r["login"]) != str(login):
+            continue
+        if server is not None and r.get("server") != server:
+            continue
+        return r["exe"]
+    return None
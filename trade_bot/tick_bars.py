@@ -0,0 +1,193 @@
+from lazy_modules import (mt5, pd, TIMEFRAME_M1, TIMEFRAME_M5, TIMEFRAME_M15, TIMEFRAME_M30,
+                          TIMEFRAME_H1, TIMEFRAME_H4, TIMEFRAME_D1)
+import numpy as np
+from collections import deque
+import time
+
+from async_log import get_logger
+from signal_pool import RATES_DTYPE
+
+log = get_logger("tick_bars")
+
+# MT5の時間足定数 → 秒数（週足・月足は境界が一定でないので非対応）
+TIMEFRAME_SECONDS = {
+    TIMEFRAME_M1: 60,
+    TIMEFRAME_M5: 300,
+    TIMEFRAME_M15: 900,
+    TIMEFRAME_M30: 1800,
+    TIMEFRAME_H1: 3600,
+    TIMEFRAME_H4: 14400,
+    TIMEFRAME_D1: 86400,
+}
+
+
+class TickBarBuilder:
+    """ティックを差分取得して、購読中の時間足ごとに形成中バーを組み立てるクラス
+
+    ティックがバー境界を越えた瞬間に確定バーを購読者へ通知するので、
+    copy_rates_from_pos のポーリングを待たずにシグナル判定できる。
+    """
+
+    def __init__(self, symbol, timeframes=(TIMEFRAME_M15,), buffer_size=10000,
+                 batch=5000):
+        self.symbol = symbol
+        self.timeframes = tuple(timeframes)
+        self.batch = batch
+        self.ticks = deque(maxlen=buffer_size)  # (time_msc, bid, ask) の直近リングバッファ
+        self.forming = {tf: None for tf in self.timeframes}
+        self.point = 0.0
+
+        self._subscribers = []
+        self._last_msc = 0
+        self._seen_at_last = 0  # 同じミリ秒に複数ティックがあるので、取得済み件数を覚える
+
+    def subscribe(self, callback):
+        """確定バー通知を購読 callback(symbol, timeframe, bar)"""
+        self._subscribers.append(callback)
+
+    def prime(self):
+        """端末の形成中バーと最新ティック時刻から開始する"""
+        info = mt5.symbol_info(self.symbol)
+        self.point = info.point if info else 0.0
+        for tf in self.timeframes:
+            rates = mt5.copy_rates_from_pos(self.symbol, tf, 0, 1)
+            if rates is not None and len(rates):
+                r = rates[-1]
+                self.forming[tf] = {
+                    'time': int(r['time']), 'open': float(r['open']),
+                    'high': float(r['high']), 'low': float(r['low']),
+                    'close': float(r['close']), 'tick_volume': int(r['tick_volume']),
+                    'spread': int(r['spread']), 'real_volume': int(r['real_volume']),
+                }
+        tick = mt5.symbol_info_tick(self.symbol)
+        if tick is not None:
+            self._last_msc = tick.time_msc
+            self._seen_at_last = 1
+
+    def poll(self):
+        """前回以降のティックだけ取得して反映。処理したティック数を返す"""
+        since = self._last_msc // 1000
+        ticks = mt5.copy_ticks_from(self.symbol, since, self.batch, mt5.COPY_TICKS_ALL)
+        if ticks is None or len(ticks) == 0:
+            return 0
+
+        msc = ticks['time_msc']
+        start = int(np.searchsorted(msc, self._last_msc, side='left'))
+        same = int(np.searchsorted(msc, self._last_msc, side='right')) - start
+        start += min(same, self._seen_at_last)
+        if start >= len(ticks):
+            return 0
+
+        new = ticks[start:]
+        for t in new:
+            self.on_tick(int(t['time_msc']), float(t['bid']), float(t['ask']))
+
+        last = int(new['time_msc'][-1])
+        if last == self._last_msc:
+            self._seen_at_last += len(new)
+        else:
+            self._last_msc = last
+            self._seen_at_last = int(np.count_nonzero(new['time_msc'] == last))
+        return len(new)
+
+    def on_tick(self, time_msc, bid, ask):
+        """1ティックを全時間足の形成中バーへ反映（バーはMT5と同じくBid基準）"""
+        self.ticks.append((time_msc, bid, ask))
+        sec = time_msc // 1000
+        spread = int(round((ask - bid) / self.point)) if self.point else 0
+        for tf in self.timeframes:
+            length = TIMEFRAME_SECONDS[tf]
+            bar_time = sec - sec % length
+            bar = self.forming[tf]
+            if bar is None or bar_time > bar['time']:
+                # 新しいバーを先に作ってから確定を通知する（購読側が形成中バーも使えるように）
+                self.forming[tf] = {
+                    'time': bar_time, 'open': bid, 'high': bid, 'low': bid,
+                    'close': bid, 'tick_volume': 1, 'spread': spread, 'real_volume': 0,
+                }
+                if bar is not None:
+                    self._emit(tf, bar)
+            elif bar_time == bar['time']:
+                if bid > bar['high']:
+                    bar['high'] = bid
+                if bid < bar['low']:
+                    bar['low'] = bid
+                bar['close'] = bid
+                bar['tick_volume'] += 1
+                if spread < bar['spread']:
+                    bar['spread'] = spread
+
+    def _emit(self, tf, bar):
+        for callback in self._subscribers:
+            callback(self.symbol, tf, bar)
+
+    def run(self, interval=0.1, stop=None):
+        """ポーリングループ（stop() が True を返すまで）"""
+        self.prime()
+        while stop is None or not stop():
+            started = time.perf_counter()
+            self.poll()
+            time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+
+class BarHistory:
+    """確定バーの履歴（起動時だけ copy_rates で埋め、以降は確定バー通知で伸ばす）"""
+
+    def __init__(self, symbol, timeframe, size=500):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.size = size
+        self.rates = np.zeros(0, dtype=RATES_DTYPE)
+
+    def seed(self):
+        # pos=1 から取得して形成中バーを含めない
+        rates = mt5.copy_rates_from_pos(self.symbol, self.timeframe, 1, self.size)
+        if rates is None:
+            return False
+        self.rates = np.asarray(rates).astype(RATES_DTYPE)
+        return True
+
+    def append(self, bar):
+        row = np.zeros(1, dtype=RATES_DTYPE)
+        for name in RATES_DTYPE.names:
+            row[name] = bar[name]
+        if len(self.rates) and self.rates['time'][-1] >= bar['time']:
+            self.rates[-1] = row[0]
+        else:
+            self.rates = np.concatenate([self.rates[-(self.size - 1):], row])
+
+    def frame(self, forming=None):
+        """確定バー + 形成中バーのDataFrame（[-2]が確定バーになる）"""
+        rates = self.rates
+        if forming is not None:
+            extra = np.zeros(1, dtype=RATES_DTYPE)
+            for name in RATES_DTYPE.names:
+                extra[name] = forming[name]
+            rates = np.concatenate([rates, extra])
+        df = pd.DataFrame(rates)
+        df['time'] = pd.to_datetime(df['time'], unit='s')
+        return df
+
+
+def stream_strategy(trader, on_bars, interval=0.1):
+    """trader のシンボル/時間足を購読し、確定のたびに on_bars(df) を呼ぶ"""
+    history = BarHistory(trader.symbol, trader.timeframe)
+    if not history.seed():
+        log.warning("価格データの取得に失敗しました")
+        return
+    # 再起動直後などで本数が足りなければ、戦略側の保存済みバーで補う
+    warm = getattr(trader, "warm_rates", None)
+    if warm is not None:
+        history.rates = warm(history.rates)[-history.size:]
+    builder = TickBarBuilder(trader.symbol, (trader.timeframe,))
+
+    def on_close(symbol, tf, bar):
+        started = time.perf_counter()
+        history.append(bar)
+        on_bars(history.frame(builder.forming[tf]))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        log.info("バー確定 {bar_time} → 判定 {ms:.0f}ms",
+                 bar_time=pd.to_datetime(bar['time'], unit='s'), ms=elapsed_ms)
+
+    builder.subscribe(on_close)
+    builder.run(interval)
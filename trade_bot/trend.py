@@ -1,14 +1,67 @@
-import MetaTrader5 as mt5
-import pandas as pd
+from lazy_modules import mt5, pd, TIMEFRAME_M15
 import numpy as np
 from datetime import datetime
 import time
 import warnings
+from symbol_cache import default_cache
+from perf_timer import timer
+from order_log import order_log, KIND_OPEN
+from async_log import get_logger, DEBUG
+from position_tracker import PositionTracker
+from risk_aggregator import connect_risk
+from signal_pool import RATES_DTYPE
+import state_snapshot
 
 warnings.filterwarnings('ignore', category=FutureWarning)
 
+log = get_logger("FreshAlgo")
+
+# デバッグ表示のテンプレート（整形はログスレッド側で行う）
+DEBUG_TEMPLATE = """
+{rule}
+[{now}] デバッグ情報
+{rule}
+【バー時刻】
+  [-3]: {t3}
+  [-2]: {t2} ← 確定バー（エントリー判定）
+  [-1]: {t1} ← 形成中
+
+【価格情報（確定バー[-2]）】
+  Close[-2]: {close2:.2f}
+  SuperTrend[-2]: {st2:.2f}
+  位置: {pos2}
+
+【クロスオーバー判定】
+  [-3]: Close={side3} ST
+  [-2]: Close={side2} ST
+  → Crossover[-2]: {crossover2}
+  → Crossunder[-2]: {crossunder2}
+
+【主要指標（最新[-1]）】
+  EMA150: {ema150:.2f}
+  EMA250: {ema250:.2f}
+  MACD: {macd:.2f}
+  MainTrend: {maintrend}
+  ADX: {adx:.2f}
+
+【Trending Signals [Mode] フィルター】
+  ✓ ADX > 20: {adx_ok} (ADX={adx:.2f})
+  - Volume Filter: 強制無効
+
+【シグナル】
+  Bull Signal[-3]: {bull3}
+  Bull Signal[-2]: {bull2} ← エントリー判定
+  Bear Signal[-3]: {bear3}
+  Bear Signal[-2]: {bear2} ← エントリー判定
+
+【エントリー条件】
+  BUY条件: {will_buy}
+  SELL条件: {will_sell}
+{rule}
+"""
+
 class FreshAlgoTrader_Fixed:
-    def __init__(self, symbol, timeframe=mt5.TIMEFRAME_M15, lot_size=0.01):
+    def __init__(self, symbol, timeframe=TIMEFRAME_M15, lot_size=0.01):
         self.symbol = symbol
         self.timeframe = timeframe
         self.lot_size = lot_size
@@ -47,6 +100,15 @@ class FreshAlgoTrader_Fixed:
         self.last_trade_time = 0
         self.min_interval = 60
         
+        self.symbols = default_cache
+        self.tracker = None  # run() で PositionTracker を設定
+        self.risk = None     # run() で口座全体のリスク集計を設定
+        
+        # 再起動時のウォームアップ用スナップショット（確定バー + 最終取引時刻）
+        self.snapshots = state_snapshot.Snapshotter(
+            state_snapshot.snapshot_path("freshalgo", symbol, timeframe))
+        self._saved_rates = None
+        
     def initialize_mt5(self):
         """MT5接続"""
         if not mt5.initialize():
@@ -65,7 +127,7 @@ class FreshAlgoTrader_Fixed:
         rates = mt5.copy_rates_from_pos(self.symbol, self.timeframe, 0, count)
         if rates is None:
             return None
-        df = pd.DataFrame(rates)
+        df = pd.DataFrame(self.warm_rates(rates)[-count:])
         df['time'] = pd.to_datetime(df['time'], unit='s')
         return df
     
@@ -274,26 +336,33 @@ class FreshAlgoTrader_Fixed:
         close = df['close']
         
         # 各種指標の計算
-        df['ema150'] = self.ema(close, self.ema150_period)
-        df['ema250'] = self.ema(close, self.ema250_period)
-        df['ema200'] = self.ema(close, 200)
-        df['hma55'] = self.hma(close, self.hma55_period)
+        with timer.stage("indicator.ema"):
+            df['ema150'] = self.ema(close, self.ema150_period)
+            df['ema250'] = self.ema(close, self.ema250_period)
+            df['ema200'] = self.ema(close, 200)
+        with timer.stage("indicator.hma"):
+            df['hma55'] = self.hma(close, self.hma55_period)
         
         # スーパートレンド
-        df['supertrend'] = self.supertrend(df, self.sensitivity, self.st_tuner)
+        with timer.stage("indicator.supertrend"):
+            df['supertrend'] = self.supertrend(df, self.sensitivity, self.st_tuner)
         
         # MACD
-        df['macd'], df['macd_signal'] = self.macd(close, self.macd_fast, 
-                                                   self.macd_slow, self.macd_signal)
+        with timer.stage("indicator.macd"):
+            df['macd'], df['macd_signal'] = self.macd(close, self.macd_fast, 
+                                                       self.macd_slow, self.macd_signal)
         
         # Donchian Channel Trend
-        df['maintrend'] = self.dchannel(df, self.dchannel_period)
+        with timer.stage("indicator.dchannel"):
+            df['maintrend'] = self.dchannel(df, self.dchannel_period)
         
         # ADX
-        df['adx'] = self.dmi(df, 14)
+        with timer.stage("indicator.dmi"):
+            df['adx'] = self.dmi(df, 14)
         
         # TsFast/TsSlow
-        df['ts_fast'], df['ts_slow'] = self.calculate_ts(df)
+        with timer.stage("indicator.ts"):
+            df['ts_fast'], df['ts_slow'] = self.calculate_ts(df)
         df['cont_bull'] = df['ts_fast'] < 35
         df['cont_bear'] = df['ts_fast'] > 65
         
@@ -442,51 +511,59 @@ class FreshAlgoTrader_Fixed:
         
         return sl, tp1, tp2, tp3
     
-    def send_order(self, signal_type, sl, tp):
-        """注文送信"""
+    def send_order(self, signal_type, sl, tp, bar_time=None, decided_ns=None):
+        """注文送信（bar_time: シグナル元バーの確定時刻 epoch秒）"""
         current_time = time.time()
         if current_time - self.last_trade_time < self.min_interval:
-            print(f"取引間隔制限: {self.min_interval}秒待機")
+            log.info("取引間隔制限: {sec}秒待機", sec=self.min_interval)
             return False
         
-        symbol_info = mt5.symbol_info(self.symbol)
+        symbol_info = self.symbols.info(self.symbol)
         if symbol_info is None:
-            print(f"{self.symbol}が見つかりません")
+            log.warning("{symbol}が見つかりません", symbol=self.symbol)
             return False
             
-        if not symbol_info.visible:
-            if not mt5.symbol_select(self.symbol, True):
-                print(f"{self.symbol}を選択できません")
-                return False
+        if not self.symbols.ensure_selected(self.symbol):
+            log.warning("{symbol}を選択できません", symbol=self.symbol)
+            return False
         
-        tick = mt5.symbol_info_tick(self.symbol)
+        tick = self.symbols.tick(self.symbol)
         if tick is None:
-            print("価格取得失敗")
+            log.warning("価格取得失敗")
             return False
             
         price = tick.ask if signal_type == "BUY" else tick.bid
         
+        lots = self.lot_size
+        if self.risk is not None:
+            side = 1 if signal_type == "BUY" else -1
+            self.risk.update_price(self.symbol, tick.bid, tick.ask)
+            ok, reason = self.risk.can_open(self.magic_number, self.symbol, side, lots)
+            if not ok:
+                log.warning("リスク制限で見送り: {reason}", reason=reason)
+                return False
+            # 相関の高い他銘柄の建玉と同じ向きなら縮小（重なりが大きければ見送り）
+            lots = self.risk.adjust_lots(self.magic_number, self.symbol, side, lots)
+            lots = round(round(lots / symbol_info.volume_step) * symbol_info.volume_step, 8)
+            if lots < symbol_info.volume_min:
+                log.warning("相関のある建玉と重なるため見送り")
+                return False
+        
         digits = symbol_info.digits
         sl = round(sl, digits)
         tp = round(tp, digits)
         
-        # フィリングモード自動判定
-        filling_type = None
-        if symbol_info.filling_mode & 1:
-            filling_type = mt5.ORDER_FILLING_FOK
-        elif symbol_info.filling_mode & 2:
-            filling_type = mt5.ORDER_FILLING_IOC
-        elif symbol_info.filling_mode & 4:
-            filling_type = mt5.ORDER_FILLING_RETURN
+        # フィリングモード自動判定（シンボル仕様からキャッシュ済み）
+        filling_type = self.symbols.filling_mode(self.symbol)
         
         if filling_type is None:
-            print("サポートされているフィリングモードが見つかりません")
+            log.warning("サポートされているフィリングモードが見つかりません")
             return False
         
         request = {
             "action": mt5.TRADE_ACTION_DEAL,
             "symbol": self.symbol,
-            "volume": self.lot_size,
+            "volume": lots,
             "type": mt5.ORDER_TYPE_BUY if signal_type == "BUY" else mt5.ORDER_TYPE_SELL,
             "price": price,
             "sl": sl,
@@ -498,83 +575,178 @@ class FreshAlgoTrader_Fixed:
             "type_filling": filling_type,
         }
         
-        result = mt5.order_send(request)
+        sent_ns = time.time_ns()
+        with timer.stage("order_send"):
+            result = mt5.order_send(request)
+        done_ns = time.time_ns()
+        
+        order_log.append(
+            self.symbol, "FreshAlgo", 1 if signal_type == "BUY" else -1, KIND_OPEN,
+            bar_time, tick.time_msc, decided_ns, sent_ns, done_ns,
+            price, result.price if result else 0.0, request["deviation"], filling_type,
+            result.retcode if result else -1, symbol_info.point, lots,
+            result.order if result else 0,
+        )
+        
+        if result is None:
+            log.error("[NG] 注文失敗: {error}", error=mt5.last_error())
+            return False
         
         if result.retcode == mt5.TRADE_RETCODE_DONE:
             self.last_trade_time = current_time
-            print(f"[OK] {signal_type} @ {price}, SL: {sl}, TP: {tp}")
+            log.info("[OK] {side} @ {price}, SL: {sl}, TP: {tp}", side=signal_type, price=price, sl=sl, tp=tp)
             return True
         else:
-            print(f"[NG] 注文失敗: {result.comment} (code: {result.retcode})")
+            log.error("[NG] 注文失敗: {comment} (code: {retcode})", comment=result.comment, retcode=result.retcode)
             return False
     
     def check_positions(self):
-        """ポジション確認"""
+        """ポジション確認（トラッカーがあれば約定差分から数える）"""
+        if self.tracker is not None:
+            self.tracker.poll()
+            return self.tracker.count(self.symbol, self.magic_number)
         positions = mt5.positions_get(symbol=self.symbol, magic=self.magic_number)
         return len(positions) if positions else 0
     
+    def save_state(self, df):
+        """確定バー（形成中の[-1]を除く）と最終取引時刻を保存"""
+        meta = {"strategy": "freshalgo", "symbol": self.symbol, "timeframe": self.timeframe,
+                "last_trade_time": self.last_trade_time}
+        return self.snapshots.save(meta, state_snapshot.frame_to_rates(df.iloc[:-1]))
+    
+    def restore_state(self):
+        """スナップショットを読み込む（バーは warm_rates で最新データと突き合わせてから使う）"""
+        loaded = self.snapshots.load()
+        if loaded is None:
+            return False
+        meta, rates = loaded
+        if meta.get("symbol") != self.symbol or meta.get("timeframe") != self.timeframe:
+            log.warning("スナップショットのシンボル/時間軸が違うため破棄")
+            return False
+        self.last_trade_time = max(self.last_trade_time, meta.get("last_trade_time", 0))
+        self._saved_rates = rates
+        log.info("スナップショット復元: バー{n}本, 最終取引 {t}", n=0 if rates is None else len(rates),
+                 t=datetime.fromtimestamp(self.last_trade_time) if self.last_trade_time else "-")
+        return True
+    
+    def warm_rates(self, rates):
+        """取得できたバーが300本に満たないとき、保存済みの確定バーで前側を補う"""
+        if self._saved_rates is None or len(rates) >= 300:
+            return rates
+        merged = state_snapshot.merge_rates(self._saved_rates, np.asarray(rates).astype(RATES_DTYPE))
+        if merged is None:
+            log.warning("スナップショットのバーが最新データと繋がらない（値が一致しない）ため破棄")
+            self._saved_rates = None
+            return rates
+        return merged
+    
     def print_debug_info(self, df):
-        """デバッグ情報を表示"""
-        i = -1
-        print(f"\n{'='*80}")
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] デバッグ情報")
-        print(f"{'='*80}")
-        
-        # バー時刻
-        print(f"【バー時刻】")
-        print(f"  [-3]: {df['time'].iloc[-3]}")
-        print(f"  [-2]: {df['time'].iloc[-2]} ← 確定バー（エントリー判定）")
-        print(f"  [-1]: {df['time'].iloc[-1]} ← 形成中")
-        
-        # 価格情報
-        print(f"\n【価格情報（確定バー[-2]）】")
-        print(f"  Close[-2]: {df['close'].iloc[-2]:.2f}")
-        print(f"  SuperTrend[-2]: {df['supertrend'].iloc[-2]:.2f}")
-        print(f"  位置: {'Above ST' if df['close'].iloc[-2] > df['supertrend'].iloc[-2] else 'Below ST'}")
-        
-        # クロスオーバー判定
-        print(f"\n【クロスオーバー判定】")
-        close_above_st_2 = df['close'].iloc[-2] > df['supertrend'].iloc[-2]
-        close_above_st_3 = df['close'].iloc[-3] > df['supertrend'].iloc[-3]
-        print(f"  [-3]: Close={'Above' if close_above_st_3 else 'Below'} ST")
-        print(f"  [-2]: Close={'Above' if close_above_st_2 else 'Below'} ST")
-        print(f"  → Crossover[-2]: {df['crossover'].iloc[-2]}")
-        print(f"  → Crossunder[-2]: {df['crossunder'].iloc[-2]}")
-        
-        # 主要指標
-        print(f"\n【主要指標（最新[-1]）】")
-        print(f"  EMA150: {df['ema150'].iloc[i]:.2f}")
-        print(f"  EMA250: {df['ema250'].iloc[i]:.2f}")
-        print(f"  MACD: {df['macd'].iloc[i]:.2f}")
-        print(f"  MainTrend: {df['maintrend'].iloc[i]}")
-        print(f"  ADX: {df['adx'].iloc[i]:.2f}")
-        
-        # フィルター判定
-        print(f"\n【Trending Signals [Mode] フィルター】")
-        print(f"  ✓ ADX > 20: {df['adx'].iloc[i] > 20} (ADX={df['adx'].iloc[i]:.2f})")
-        print(f"  - Volume Filter: 強制無効")
-        
-        # シグナル
-        print(f"\n【シグナル】")
-        print(f"  Bull Signal[-3]: {df['bull_signal'].iloc[-3]}")
-        print(f"  Bull Signal[-2]: {df['bull_signal'].iloc[-2]} ← エントリー判定")
-        print(f"  Bear Signal[-3]: {df['bear_signal'].iloc[-3]}")
-        print(f"  Bear Signal[-2]: {df['bear_signal'].iloc[-2]} ← エントリー判定")
-        
-        # エントリー条件チェック
-        print(f"\n【エントリー条件】")
-        will_buy = df['bull_signal'].iloc[-2] and not df['bull_signal'].iloc[-3]
-        will_sell = df['bear_signal'].iloc[-2] and not df['bear_signal'].iloc[-3]
-        print(f"  BUY条件: {will_buy}")
-        print(f"  SELL条件: {will_sell}")
-        
-        print(f"{'='*80}\n")
+        """デバッグ情報を表示（DEBUGレベルが無効なら何も参照しない）"""
+        if not log.enabled_for(DEBUG):
+            return
+        
+        # 値だけ取り出して渡し、文字列の組み立てはログスレッドに任せる
+        close = df['close'].values
+        st = df['supertrend'].values
+        bull = df['bull_signal'].values
+        bear = df['bear_signal'].values
+        adx = float(df['adx'].iloc[-1])
+        log.debug(
+            DEBUG_TEMPLATE,
+            rule='=' * 80,
+            now=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            t3=df['time'].iloc[-3], t2=df['time'].iloc[-2], t1=df['time'].iloc[-1],
+            close2=close[-2], st2=st[-2],
+            pos2='Above ST' if close[-2] > st[-2] else 'Below ST',
+            side3='Above' if close[-3] > st[-3] else 'Below',
+            side2='Above' if close[-2] > st[-2] else 'Below',
+            crossover2=df['crossover'].iloc[-2], crossunder2=df['crossunder'].iloc[-2],
+            ema150=df['ema150'].iloc[-1], ema250=df['ema250'].iloc[-1],
+            macd=df['macd'].iloc[-1], maintrend=df['maintrend'].iloc[-1],
+            adx=adx, adx_ok=adx > 20,
+            bull3=bull[-3], bull2=bull[-2], bear3=bear[-3], bear2=bear[-2],
+            will_buy=bool(bull[-2] and not bull[-3]),
+            will_sell=bool(bear[-2] and not bear[-3]),
+        )
+    
+    def process_bars(self, df, debug_mode=False):
+        """バーを分析して、確定バー[-2]にシグナルがあれば発注"""
+        try:
+            with timer.stage("analyze_signals"):
+                df = self.analyze_signals(df)
+        except Exception as e:
+            import traceback
+            log.error("分析エラー: {error}\n{tb}", error=e, tb=traceback.format_exc())
+            return
+        
+        # デバッグモードで詳細表示
+        if debug_mode:
+            self.print_debug_info(df)
+        
+        # シグナルチェック（確定バー[-2]を使用）
+        with timer.stage("generate_signal"):
+            signal = None
+            if len(df) >= 3:
+                if df['bull_signal'].iloc[-2] and not df['bull_signal'].iloc[-3]:
+                    signal = "BUY"
+                elif df['bear_signal'].iloc[-2] and not df['bear_signal'].iloc[-3]:
+                    signal = "SELL"
+        
+        if signal is not None:
+            decided_ns = time.time_ns()
+            bar_time = int(df['time'].iloc[-1].timestamp())  # [-2]の確定時刻 = [-1]の開始時刻
+            log.info("{signal} シグナル検出（確定バー） 時刻: {bar}", signal=signal, bar=df['time'].iloc[-2])
+            entry = df['close'].iloc[-2]
+            sl, tp1, tp2, tp3 = self.calculate_sl_tp(df, entry, signal)
+            if self.send_order(signal, sl, tp1, bar_time, decided_ns):
+                self.save_state(df)  # 最終取引時刻はすぐ残す（再起動直後の重複発注防止）
+                return
+        
+        if self.snapshots.due():
+            self.save_state(df)
+    
+    def run_stream(self, debug_mode=False):
+        """ティックからバーを組み立て、バー確定の瞬間に判定するメインループ"""
+        if not self.initialize_mt5():
+            return
+        
+        from tick_bars import stream_strategy
+        self.tracker = PositionTracker()  # 他ボットの建玉もリスク集計に使うので全マジック
+        self.tracker.start()
+        self.risk = connect_risk(self.tracker)
+        self.restore_state()
+        if debug_mode:
+            log.level = min(log.level, DEBUG)
+        
+        def on_bars(df):
+            if self.check_positions() > 0:
+                return
+            if len(df) < 300:
+                log.warning("データ不足")
+                return
+            self.process_bars(df, debug_mode)
+        
+        print(f"ストリームモード: {self.symbol} / 時間軸 {self.timeframe}")
+        try:
+            stream_strategy(self, on_bars)
+        except KeyboardInterrupt:
+            print("\n停止しました")
+        finally:
+            mt5.shutdown()
     
     def run(self, debug_mode=False):
         """メインループ"""
         if not self.initialize_mt5():
             return
         
+        if debug_mode:
+            log.level = min(log.level, DEBUG)
+        
+        self.tracker = PositionTracker()  # 他ボットの建玉もリスク集計に使うので全マジック
+        self.tracker.start()
+        self.risk = connect_risk(self.tracker)
+        self.restore_state()
+        
         print("="*60)
         print("Fresh Algo V24 - デバッグ対応版")
         print(f"通貨ペア: {self.symbol}")
@@ -586,44 +758,22 @@ class FreshAlgoTrader_Fixed:
         
         try:
             while True:
-                if self.check_positions() > 0:
+                timer.maybe_dump()
+                with timer.stage("check_positions"):
+                    n_positions = self.check_positions()
+                if n_positions > 0:
                     time.sleep(30)
                     continue
                 
-                df = self.get_rates(500)
+                with timer.stage("get_rates"):
+                    df = self.get_rates(500)
                 if df is None or len(df) < 300:
-                    print("データ取得失敗")
-                    time.sleep(30)
-                    continue
-                
-                try:
-                    df = self.analyze_signals(df)
-                except Exception as e:
-                    print(f"分析エラー: {e}")
-                    import traceback
-                    traceback.print_exc()
+                    log.warning("データ取得失敗")
                     time.sleep(30)
                     continue
                 
-                # デバッグモードで詳細表示
-                if debug_mode:
-                    self.print_debug_info(df)
-                
-                # シグナルチェック（確定バー[-2]を使用）
-                if len(df) >= 3:
-                    if df['bull_signal'].iloc[-2] and not df['bull_signal'].iloc[-3]:
-                        print(f"\n[{datetime.now().strftime('%H:%M:%S')}] BUY シグナル検出（確定バー）")
-                        print(f"時刻: {df['time'].iloc[-2]}")
-                        entry = df['close'].iloc[-2]
-                        sl, tp1, tp2, tp3 = self.calculate_sl_tp(df, entry, "BUY")
-                        self.send_order("BUY", sl, tp1)
-                    
-                    elif df['bear_signal'].iloc[-2] and not df['bear_signal'].iloc[-3]:
-                        print(f"\n[{datetime.now().strftime('%H:%M:%S')}] SELL シグナル検出（確定バー）")
-                        print(f"時刻: {df['time'].iloc[-2]}")
-                        entry = df['close'].iloc[-2]
-                        sl, tp1, tp2, tp3 = self.calculate_sl_tp(df, entry, "SELL")
-                        self.send_order("SELL", sl, tp1)
+                with timer.stage("process_bars"):
+                    self.process_bars(df, debug_mode)
                 
                 time.sleep(30)
                 
@@ -634,6 +784,9 @@ class FreshAlgoTrader_Fixed:
             import traceback
             traceback.print_exc()
         finally:
+            if timer.enabled:
+                timer.dump()
+            log.close()
             mt5.shutdown()
 
 # 使用例